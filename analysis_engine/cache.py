@@ -0,0 +1,143 @@
+# analysis_engine/cache.py
+
+import os
+import time
+import pickle
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+# Fitted models, centroids and other intermediate results live here between requests.
+CACHE_DIR = os.environ.get("ANALYSIS_CACHE_DIR", os.path.join("uploads", ".cache"))
+MEMORY_ITEMS = 32  # small in-process layer in front of the disk cache
+MAX_DISK_BYTES = int(os.environ.get("ANALYSIS_CACHE_MAX_MB", 2048)) * 1024 ** 2  # least recently used entries are pruned above this
+PRUNE_INTERVAL = 60  # seconds between size checks, unless MAX_DISK_BYTES / 20 was written in between
+
+_memory = OrderedDict()
+_lock = threading.Lock()
+_unpruned_bytes = 0   # written since the last _prune
+_last_prune = None
+
+
+def fingerprint(*parts):
+    """
+    Stable short hash of the given parts.
+    DataFrames / Series are hashed by content (values + index), so the same
+    data always maps to the same key and any edit to it produces a new one.
+    """
+    h = hashlib.sha1()
+    for part in parts:
+        if isinstance(part, (pd.DataFrame, pd.Series)):
+            h.update(repr(list(part.columns) if isinstance(part, pd.DataFrame) else part.name).encode())
+            h.update(pd.util.hash_pandas_object(part, index=True).values.tobytes())
+        elif isinstance(part, np.ndarray):
+            h.update(repr((part.shape, part.dtype.str)).encode())
+            h.update(np.ascontiguousarray(part).tobytes())
+        else:
+            h.update(repr(part).encode())
+        h.update(b"|")
+    return h.hexdigest()[:20]
+
+
+def _path(namespace, key):
+    return os.path.join(CACHE_DIR, namespace, f"{key}.pkl")
+
+
+def load(namespace, key, default=None):
+    """Return the cached value for (namespace, key), or `default` when missing."""
+    mem_key = (namespace, key)
+    path = _path(namespace, key)
+    with _lock:
+        if mem_key in _memory:
+            _memory.move_to_end(mem_key)
+            _touch(path)
+            return _memory[mem_key]
+
+    if not _touch(path):
+        return default
+    try:
+        with open(path, "rb") as f:
+            value = pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return default
+
+    _remember(mem_key, value)
+    return value
+
+
+def save(namespace, key, value):
+    """Store a value in memory and on disk (atomic replace, safe across workers)."""
+    path = _path(namespace, key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        size = f.tell()
+    os.replace(tmp_path, path)
+
+    _remember((namespace, key), value)
+    _maybe_prune(size)
+    return value
+
+
+def _touch(path):
+    """Mark a disk entry as recently used (its mtime drives pruning); False if it is gone."""
+    try:
+        os.utime(path)
+        return True
+    except OSError:
+        return False
+
+
+def _maybe_prune(nbytes):
+    """
+    Run _prune only every PRUNE_INTERVAL seconds or once MAX_DISK_BYTES / 20
+    has been written since the last run, so a save does not walk the whole
+    cache each time.
+    """
+    global _unpruned_bytes, _last_prune
+    with _lock:
+        _unpruned_bytes += nbytes
+        now = time.monotonic()
+        due = (_last_prune is None or now - _last_prune >= PRUNE_INTERVAL
+               or _unpruned_bytes >= MAX_DISK_BYTES // 20)
+        if not due:
+            return
+        _unpruned_bytes, _last_prune = 0, now
+    _prune()
+
+
+def _prune(max_bytes=None):
+    """Delete the least recently used entries until the disk cache fits in max_bytes (MAX_DISK_BYTES)."""
+    max_bytes = MAX_DISK_BYTES if max_bytes is None else max_bytes
+    entries = []
+    for root, _, files in os.walk(CACHE_DIR):
+        for name in files:
+            if name.endswith(".pkl"):
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)  # another worker may have removed it already
+        except OSError:
+            pass
+        total -= size
+
+
+def _remember(mem_key, value):
+    with _lock:
+        _memory[mem_key] = value
+        _memory.move_to_end(mem_key)
+        while len(_memory) > MEMORY_ITEMS:
+            _memory.popitem(last=False)
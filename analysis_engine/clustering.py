@@ -3,56 +3,461 @@ import os
 import numpy as np
 import pandas as pd
 from sklearn.preprocessing import StandardScaler
-from sklearn.cluster import KMeans, AgglomerativeClustering
-from scipy.cluster.hierarchy import dendrogram, linkage
-import matplotlib.pyplot as plt
+from sklearn.cluster import KMeans, MiniBatchKMeans, AgglomerativeClustering, DBSCAN
+from sklearn.neighbors import NearestNeighbors
+from sklearn.metrics import silhouette_score, calinski_harabasz_score
+from joblib import Parallel, delayed, effective_n_jobs, parallel_config
+from scipy.sparse import csr_matrix
+from scipy.cluster.hierarchy import dendrogram, linkage, fcluster
 import seaborn as sns
 
-def run_kmeans(df, selected_columns, n_clusters, output_dir):
+from analysis_engine import cache
+from analysis_engine.figures import subplots, save_figure
+from analysis_engine.raster import raster_scatter, should_rasterize
+
+try:
+    from sklearn.cluster import HDBSCAN
+except ImportError:  # scikit-learn < 1.3
+    HDBSCAN = None
+
+MINIBATCH_THRESHOLD = 100_000   # rows above which mode='auto' switches to MiniBatchKMeans
+CHUNK_SIZE = 50_000             # rows standardized / fitted / labelled at a time in minibatch mode
+PLOT_SAMPLE_SIZE = 20_000       # max points drawn on the minibatch scatter plot
+SCORE_SAMPLE_SIZE = 10_000      # rows used for silhouette / Calinski-Harabasz in the k-sweep
+SWEEP_MAX_K = 30                # largest k a k-sweep will fit
+HAC_MAX_ROWS = 10_000           # above this, linkage runs on micro-cluster centroids
+HAC_MICRO_CLUSTERS = 1_000      # number of micro-clusters built before linkage
+KD_TREE_MAX_FEATURES = 15       # KD-tree up to this many columns, ball-tree above
+
+
+def _iter_chunks(df, selected_columns, chunk_size=CHUNK_SIZE, rng=None):
+    """
+    Yield (index, values) row blocks, NA rows dropped.
+    With `rng`, blocks are drawn from a random permutation of the rows so that
+    sorted files do not feed MiniBatchKMeans one cluster at a time.
+    """
+    X = df[selected_columns]
+    order = rng.permutation(len(X)) if rng is not None else None
+    for start in range(0, len(X), chunk_size):
+        if order is None:
+            chunk = X.iloc[start:start + chunk_size]
+        else:
+            chunk = X.iloc[np.sort(order[start:start + chunk_size])]
+        chunk = chunk.dropna()
+        if len(chunk):
+            yield chunk.index, chunk.to_numpy(dtype=float)
+
+
+def _write_labels(filepath, index, labels, header):
+    pd.DataFrame({'row': index, 'cluster': labels}).to_csv(
+        filepath, mode='w' if header else 'a', header=header, index=False)
+
+
+def _warm_start_centers(state_key, n_clusters, scaler, sample):
+    """
+    Centroids of the previous run under `state_key` (stored in original
+    units, so they survive a refitted scaler), adapted to the requested k:
+    the largest clusters are kept when k shrinks, farthest sample points are
+    added when k grows.
+    """
+    state = cache.load("kmeans_centroids", state_key)
+    if state is None:
+        return None
+
+    centers = scaler.transform(state["centers"])
+    if len(centers) >= n_clusters:
+        keep = np.argsort(state["sizes"])[::-1][:n_clusters]
+        return centers[np.sort(keep)]
+
+    if len(sample) < n_clusters:
+        return None
+    centers = list(centers)
+    dist = np.min([((sample - c) ** 2).sum(axis=1) for c in centers], axis=0)
+    while len(centers) < n_clusters:
+        new = sample[np.argmax(dist)]
+        centers.append(new)
+        dist = np.minimum(dist, ((sample - new) ** 2).sum(axis=1))
+    return np.asarray(centers)
+
+
+def _store_centers(state_key, scaler, centers, sizes):
+    cache.save("kmeans_centroids", state_key, {
+        "centers": scaler.inverse_transform(centers),
+        "sizes": np.asarray(sizes),
+    })
+
+
+def run_kmeans(df, selected_columns, n_clusters, output_dir, mode='auto',
+               batch_size=4096, n_epochs=3, state_key=None, name_prefix="kmeans"):
+    """
+    mode: 'full' (KMeans on the whole matrix) | 'minibatch' (chunked
+    MiniBatchKMeans, bounded memory) | 'auto' (minibatch above MINIBATCH_THRESHOLD rows).
+    With a `state_key` (e.g. the dataset id), the centroids are kept per
+    selected columns and seed the next fit (warm start), also after rows are
+    added to or edited in the dataset.
+    The plot and the labels are written as {name_prefix}_plot.png /
+    {name_prefix}_labels.csv; use a per-request prefix for shared directories.
+    """
     if len(selected_columns) < 2:
         raise ValueError("Select at least two columns for clustering.")
+    if state_key is not None:
+        # not the data: a new version of the dataset should still warm-start
+        state_key = cache.fingerprint(state_key, tuple(selected_columns))
 
-    X = df[selected_columns].dropna()
-    X_scaled = StandardScaler().fit_transform(X)
+    if mode == 'auto':
+        mode = 'minibatch' if len(df) > MINIBATCH_THRESHOLD else 'full'
+
+    labels_file = f"{name_prefix}_labels.csv"
+    labels_path = os.path.join(output_dir, labels_file)
+    rng = np.random.default_rng(42)
 
-    kmeans = KMeans(n_clusters=n_clusters, random_state=42)
-    labels = kmeans.fit_predict(X_scaled)
+    if mode == 'minibatch':
+        scaler = StandardScaler()
+        for _, chunk in _iter_chunks(df, selected_columns):
+            scaler.partial_fit(chunk)
+        if not hasattr(scaler, 'mean_'):
+            raise ValueError("No complete rows available for clustering.")
+
+        # Scaled sample kept for plotting and for growing warm-start centroids
+        sample_rate = min(1.0, PLOT_SAMPLE_SIZE / max(len(df), 1))
+        sample = np.vstack([scaler.transform(chunk[rng.random(len(chunk)) < sample_rate])
+                            for _, chunk in _iter_chunks(df, selected_columns)])
+
+        init = _warm_start_centers(state_key, n_clusters, scaler, sample) if state_key else None
+        model = MiniBatchKMeans(n_clusters=n_clusters, batch_size=batch_size, random_state=42,
+                                init=init if init is not None else 'k-means++',
+                                n_init=1 if init is not None else 3)
+        for _ in range(n_epochs):
+            for _, chunk in _iter_chunks(df, selected_columns, rng=rng):
+                model.partial_fit(scaler.transform(chunk))
+
+        sizes = np.zeros(n_clusters, dtype=int)
+        inertia = 0.0
+        sample_labels = model.predict(sample)
+        for i, (index, chunk) in enumerate(_iter_chunks(df, selected_columns)):
+            X_chunk = scaler.transform(chunk)
+            chunk_labels = model.predict(X_chunk)
+            inertia -= model.score(X_chunk)
+            sizes += np.bincount(chunk_labels, minlength=n_clusters)
+            _write_labels(labels_path, index, chunk_labels, header=(i == 0))
+
+        points, point_labels = sample, sample_labels
+    else:
+        X = df[selected_columns].dropna()
+        scaler = StandardScaler().fit(X.to_numpy(dtype=float))  # array-fitted, like the stored centroids
+        X_scaled = scaler.transform(X.to_numpy(dtype=float))
+
+        init = None
+        if state_key:
+            sample = X_scaled[rng.choice(len(X_scaled), min(len(X_scaled), PLOT_SAMPLE_SIZE), replace=False)]
+            init = _warm_start_centers(state_key, n_clusters, scaler, sample)
+        kmeans = KMeans(n_clusters=n_clusters, random_state=42,
+                        init=init if init is not None else 'k-means++',
+                        n_init=1 if init is not None else 'auto')
+        labels = kmeans.fit_predict(X_scaled)
+        model, inertia = kmeans, float(kmeans.inertia_)
+        sizes = np.bincount(labels, minlength=n_clusters)
+        _write_labels(labels_path, X.index, labels, header=True)
+
+        points, point_labels = X_scaled, labels
+
+    if state_key:
+        _store_centers(state_key, scaler, model.cluster_centers_, sizes)
 
     # Plotting
-    plt.figure(figsize=(8, 6))
-    sns.scatterplot(x=X_scaled[:, 0], y=X_scaled[:, 1], hue=labels, palette='Set2', edgecolor='w', s=100)
-    plt.title("KMeans Clustering")
-    plt.xlabel(selected_columns[0])
-    plt.ylabel(selected_columns[1])
-    plt.grid(True)
-    plt.tight_layout()
-
-    filename = "kmeans_plot.png"
+    fig, ax = subplots(figsize=(8, 6))
+    if should_rasterize(len(points)):
+        raster_scatter(ax, points[:, 0], points[:, 1], categories=point_labels,
+                       palette=sns.color_palette('Set2', n_clusters))
+        ax.legend(title='Cluster', loc='best')
+    else:
+        sns.scatterplot(x=points[:, 0], y=points[:, 1], hue=point_labels, palette='Set2', edgecolor='w', s=100, ax=ax)
+    ax.set_title("KMeans Clustering" if mode == 'full' else "KMeans Clustering (MiniBatch, sampled points)")
+    ax.set_xlabel(selected_columns[0])
+    ax.set_ylabel(selected_columns[1])
+    ax.grid(True)
+
+    filename = f"{name_prefix}_plot.png"
     filepath = os.path.join(output_dir, filename)
-    plt.savefig(filepath)
-    plt.close()
+    save_figure(fig, filepath, tight=True)
+
+    return {
+        'kmeans_plot': filename,
+        'labels_csv': labels_file,
+        'mode': mode,
+        'warm_started': init is not None,
+        'n_samples': int(sizes.sum()),
+        'cluster_sizes': sizes.tolist(),
+        'inertia': float(inertia)
+    }
 
-    return {'kmeans_plot': filename, 'labels': labels.tolist()}
+def _score_k(X_scaled, k, sample_idx):
+    """Fit one k of the sweep and score it on the shared row sample."""
+    if len(X_scaled) > MINIBATCH_THRESHOLD:
+        model = MiniBatchKMeans(n_clusters=k, batch_size=4096, random_state=42, n_init=3)
+    else:
+        model = KMeans(n_clusters=k, random_state=42, n_init='auto')
+    labels = model.fit_predict(X_scaled)
 
-def run_hac(df, selected_columns, output_dir, method='ward'):
+    X_sample, sample_labels = X_scaled[sample_idx], labels[sample_idx]
+    if len(np.unique(sample_labels)) < 2:
+        silhouette, ch = float('nan'), float('nan')
+    else:
+        silhouette = float(silhouette_score(X_sample, sample_labels))
+        ch = float(calinski_harabasz_score(X_sample, sample_labels))
+    return {'k': k, 'inertia': float(model.inertia_), 'silhouette': silhouette, 'calinski_harabasz': ch}
+
+
+def _elbow_k(ks, inertias):
+    """k whose (normalized) inertia point lies farthest below the chord between the ends."""
+    if len(ks) < 3:
+        return int(ks[0])
+    x = (ks - ks[0]) / (ks[-1] - ks[0])
+    y = (inertias - inertias[-1]) / max(inertias[0] - inertias[-1], 1e-12)
+    return int(ks[np.argmax((1 - x) - y)])
+
+
+def run_kmeans_sweep(df, selected_columns, k_max, output_dir, sample_size=SCORE_SAMPLE_SIZE, n_jobs=-1,
+                     name_prefix="kmeans"):
+    """
+    Fit k = 2..k_max (at most SWEEP_MAX_K) in parallel worker processes and
+    score each k. Each worker runs KMeans on a single BLAS / OpenMP thread,
+    so the pool does not oversubscribe the CPUs. The standardized matrix is handed to the workers as a shared memory-mapped
+    array (joblib auto-memmapping) instead of being pickled once per k.
+    The recommended k maximizes the sampled silhouette score. The chart is
+    written as {name_prefix}_sweep.png.
+    """
     if len(selected_columns) < 2:
         raise ValueError("Select at least two columns for clustering.")
 
     X = df[selected_columns].dropna()
     X_scaled = StandardScaler().fit_transform(X)
+    k_max = min(int(k_max), SWEEP_MAX_K, len(X_scaled) - 1)
+    if k_max < 2:
+        raise ValueError("Not enough observations for a k-sweep.")
+
+    rng = np.random.default_rng(42)
+    sample_idx = np.sort(rng.choice(len(X_scaled), min(sample_size, len(X_scaled)), replace=False))
+
+    n_jobs = min(effective_n_jobs(n_jobs), k_max - 1)
+    with parallel_config(backend='loky', inner_max_num_threads=1):
+        scores = Parallel(n_jobs=n_jobs, max_nbytes='1M', mmap_mode='r')(
+            delayed(_score_k)(X_scaled, k, sample_idx) for k in range(2, k_max + 1)
+        )
+
+    ks = np.array([s['k'] for s in scores], dtype=float)
+    inertias = np.array([s['inertia'] for s in scores])
+    silhouettes = np.array([s['silhouette'] for s in scores])
+    elbow_k = _elbow_k(ks, inertias)
+    recommended_k = int(ks[np.nanargmax(silhouettes)]) if not np.all(np.isnan(silhouettes)) else elbow_k
+
+    # Elbow chart: inertia + silhouette on a twin axis
+    fig, ax1 = subplots(figsize=(9, 5))
+    ax1.plot(ks, inertias, 'o-', color='tab:blue', label='Inertia')
+    ax1.set_xlabel("Number of clusters (k)")
+    ax1.set_ylabel("Inertia", color='tab:blue')
+    ax2 = ax1.twinx()
+    ax2.plot(ks, silhouettes, 's--', color='tab:red', label='Silhouette (sampled)')
+    ax2.set_ylabel("Silhouette", color='tab:red')
+    ax1.axvline(recommended_k, color='green', linestyle=':', linewidth=2, label=f'Recommended k={recommended_k}')
+    ax1.set_xticks(ks)
+    ax1.grid(True, alpha=0.3)
+    handles = ax1.get_legend_handles_labels()[0] + ax2.get_legend_handles_labels()[0]
+    ax1.legend(handles, [h.get_label() for h in handles], loc='upper right')
+    ax1.set_title("KMeans k-Sweep (Elbow & Silhouette)")
+
+    filename = f"{name_prefix}_sweep.png"
+    save_figure(fig, os.path.join(output_dir, filename), tight=True)
+
+    return {
+        'sweep_plot': filename,
+        'scores': scores,
+        'recommended_k': recommended_k,
+        'elbow_k': elbow_k,
+        'silhouette_sample': int(len(sample_idx))
+    }
+
+
+def _hac_tree(X, method, max_rows, n_micro):
+    """
+    Linkage matrix for the standardized rows, cached per data content + method.
+    Above `max_rows` rows the linkage is built on MiniBatchKMeans micro-cluster
+    centroids instead of all rows; `micro_labels` maps each row to its leaf.
+    """
+    precluster = len(X) > max_rows
+    key = cache.fingerprint(X, method, n_micro if precluster else None)
+    tree = cache.load("hac_linkage", key)
+    if tree is not None:
+        return tree, True
+
+    X_scaled = StandardScaler().fit_transform(X)
+    if precluster:
+        micro = MiniBatchKMeans(n_clusters=n_micro, batch_size=4096, random_state=42, n_init=1)
+        micro_labels = micro.fit_predict(X_scaled)
+        leaves = micro.cluster_centers_
+    else:
+        micro_labels = None
+        leaves = X_scaled
+
+    tree = {
+        'linkage': linkage(leaves, method=method),
+        'micro_labels': micro_labels,
+        'n_leaves': len(leaves),
+    }
+    return cache.save("hac_linkage", key, tree), False
 
-    plt.figure(figsize=(10, 6))
-    linked = linkage(X_scaled, method=method)
+
+def run_hac(df, selected_columns, output_dir, method='ward', n_clusters=None,
+            truncate_p=30, max_rows=HAC_MAX_ROWS, n_micro=HAC_MICRO_CLUSTERS, name_prefix="hac"):
+    """
+    Hierarchical clustering. The linkage is cached, so cutting the same data at a
+    different `n_clusters` (fcluster) does not recompute it. Large inputs are
+    pre-clustered into `n_micro` micro-clusters before linkage. The dendrogram
+    shows only the last `truncate_p` merges. Outputs are written as
+    {name_prefix}_dendrogram.png / {name_prefix}_labels.csv.
+    """
+    if len(selected_columns) < 2:
+        raise ValueError("Select at least two columns for clustering.")
+
+    X = df[selected_columns].dropna()
+    tree, cached = _hac_tree(X, method, max_rows, n_micro)
+    linked = tree['linkage']
+
+    fig, ax = subplots(figsize=(10, 6))
     dendrogram(linked,
                orientation='top',
                distance_sort='descending',
-               show_leaf_counts=True)
-    plt.title("Hierarchical Clustering Dendrogram")
-    plt.tight_layout()
+               truncate_mode='lastp' if tree['n_leaves'] > truncate_p else None,
+               p=truncate_p,
+               show_leaf_counts=True,
+               ax=ax)
+    if tree['micro_labels'] is not None:
+        ax.set_title(f"Hierarchical Clustering Dendrogram ({tree['n_leaves']} micro-clusters, last {truncate_p} merges)")
+    else:
+        ax.set_title("Hierarchical Clustering Dendrogram")
 
-    filename = "hac_dendrogram.png"
+    filename = f"{name_prefix}_dendrogram.png"
     filepath = os.path.join(output_dir, filename)
-    plt.savefig(filepath)
-    plt.close()
+    save_figure(fig, filepath, tight=True)
+
+    result = {
+        'hac_plot': filename,
+        'n_leaves': tree['n_leaves'],
+        'precluster': tree['micro_labels'] is not None,
+        'linkage_cached': cached
+    }
+
+    if n_clusters:
+        leaf_labels = fcluster(linked, t=n_clusters, criterion='maxclust') - 1
+        labels = leaf_labels[tree['micro_labels']] if tree['micro_labels'] is not None else leaf_labels
+        labels_file = f"{name_prefix}_labels.csv"
+        _write_labels(os.path.join(output_dir, labels_file), X.index, labels, header=True)
+        result.update({
+            'labels_csv': labels_file,
+            'n_clusters': int(n_clusters),
+            'cluster_sizes': np.bincount(labels).tolist()
+        })
+
+    return result
+
+
+def _neighbor_algorithm(n_features):
+    return 'kd_tree' if n_features <= KD_TREE_MAX_FEATURES else 'ball_tree'
+
+
+def _radius_graph(X_scaled, key, eps, n_jobs):
+    """
+    Sparse eps-neighborhood distance graph for DBSCAN(metric='precomputed').
+    The fitted KD/ball-tree and the widest graph queried so far are cached per
+    data: a smaller eps is filtered out of the cached graph, a larger one is a
+    new (parallel) radius query on the cached tree. min_samples never needs a
+    new query.
+    """
+    state = cache.load("dbscan_index", key)
+    if state is None:
+        index = NearestNeighbors(algorithm=_neighbor_algorithm(X_scaled.shape[1]), n_jobs=n_jobs).fit(X_scaled)
+        state = {'index': index, 'eps': None, 'graph': None}
+    reused = state['graph'] is not None and state['eps'] >= eps
+
+    if not reused:
+        state['index'].set_params(n_jobs=n_jobs)
+        state['graph'] = state['index'].radius_neighbors_graph(radius=eps, mode='distance')
+        state['eps'] = eps
+        cache.save("dbscan_index", key, state)
+
+    graph = state['graph']
+    if state['eps'] > eps:
+        # keep explicit zero distances (duplicate rows are still neighbors)
+        coo = graph.tocoo()
+        keep = coo.data <= eps
+        graph = csr_matrix((coo.data[keep], (coo.row[keep], coo.col[keep])), shape=graph.shape)
+    return graph, reused
+
+
+def run_dbscan(df, selected_columns, output_dir, algorithm='dbscan', eps=0.5, min_samples=5,
+               min_cluster_size=15, n_jobs=-1, name_prefix=None):
+    """
+    Density-based clustering on standardized columns.
+    algorithm: 'dbscan' (eps / min_samples, cached neighbor index) |
+               'hdbscan' (min_cluster_size / min_samples, tree-accelerated)
+    Noise points get the label -1. Outputs are written as {name_prefix}_plot.png /
+    {name_prefix}_labels.csv (name_prefix defaults to the algorithm).
+    """
+    name_prefix = name_prefix or algorithm
+    if len(selected_columns) < 2:
+        raise ValueError("Select at least two columns for clustering.")
+
+    X = df[selected_columns].dropna()
+    X_scaled = StandardScaler().fit_transform(X)
+    index_reused = False
+
+    if algorithm == 'hdbscan':
+        if HDBSCAN is None:
+            raise ValueError("HDBSCAN requires scikit-learn >= 1.3.")
+        model = HDBSCAN(min_cluster_size=min_cluster_size, min_samples=min_samples,
+                        algorithm=_neighbor_algorithm(X_scaled.shape[1]), n_jobs=n_jobs)
+        labels = model.fit_predict(X_scaled)
+    else:
+        graph, index_reused = _radius_graph(X_scaled, cache.fingerprint(X), eps, n_jobs)
+        labels = DBSCAN(eps=eps, min_samples=min_samples, metric='precomputed', n_jobs=n_jobs).fit_predict(graph)
+
+    clusters = np.unique(labels[labels >= 0])
+    noise = labels < 0
+
+    # Plotting (noise in grey)
+    fig, ax = subplots(figsize=(8, 6))
+    palette = sns.color_palette('tab20', max(len(clusters), 1))
+    if should_rasterize(len(labels)):
+        names = np.where(noise, 'Noise', np.char.add('Cluster ', labels.astype(str)))
+        raster_scatter(ax, X_scaled[:, 0], X_scaled[:, 1], categories=names,
+                       palette=palette[:len(clusters)] + ['lightgray'],
+                       order=[f"Cluster {cluster}" for cluster in clusters] + ['Noise'])
+    else:
+        if noise.any():
+            ax.scatter(X_scaled[noise, 0], X_scaled[noise, 1], c='lightgray', s=15, marker='x', label='Noise')
+        for color, cluster in zip(palette, clusters):
+            mask = labels == cluster
+            ax.scatter(X_scaled[mask, 0], X_scaled[mask, 1], color=color, s=30, edgecolors='w', linewidths=0.3,
+                       label=f"Cluster {cluster}")
+    ax.set_title(f"{algorithm.upper()} Clustering ({len(clusters)} clusters, {int(noise.sum())} noise points)")
+    ax.set_xlabel(selected_columns[0])
+    ax.set_ylabel(selected_columns[1])
+    if len(clusters) <= 20:
+        ax.legend(loc='best', fontsize=8)
+    ax.grid(True)
+
+    filename = f"{name_prefix}_plot.png"
+    save_figure(fig, os.path.join(output_dir, filename), tight=True)
+
+    labels_file = f"{name_prefix}_labels.csv"
+    _write_labels(os.path.join(output_dir, labels_file), X.index, labels, header=True)
 
-    return {'hac_plot': filename}
+    return {
+        'density_plot': filename,
+        'labels_csv': labels_file,
+        'algorithm': algorithm,
+        'n_clusters_found': int(len(clusters)),
+        'n_noise': int(noise.sum()),
+        'cluster_sizes': [int((labels == c).sum()) for c in clusters],
+        'index_reused': index_reused
+    }
@@ -1,14 +1,12 @@
 # analysis_engine/density_curve.py
 
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
 import seaborn as sns
 import pandas as pd
 import io, base64, numpy as np
 from datetime import datetime
 from app import db
 from app.models import Graph
+from analysis_engine.figures import subplots
 
 
 def run_density_curve(df, column, color, dataset_id, user_id):
@@ -31,16 +29,16 @@ def run_density_curve(df, column, color, dataset_id, user_id):
     n = len(data)
 
     # Create figure
-    plt.figure(figsize=(10, 6))
-    sns.kdeplot(data, fill=True, color=color, alpha=0.6, linewidth=2)
-    plt.title(f"Courbe de densité - {column}", fontsize=16, fontweight='bold')
-    plt.xlabel(column)
-    plt.ylabel("Densité")
+    fig, ax = subplots(figsize=(10, 6))
+    sns.kdeplot(data, fill=True, color=color, alpha=0.6, linewidth=2, ax=ax)
+    ax.set_title(f"Courbe de densité - {column}", fontsize=16, fontweight='bold')
+    ax.set_xlabel(column)
+    ax.set_ylabel("Densité")
 
     # Mean & median lines
-    plt.axvline(mean_val, color='red', linestyle='--', linewidth=2, label=f"Moyenne: {mean_val:.2f}")
-    plt.axvline(median_val, color='blue', linestyle='--', linewidth=2, label=f"Médiane: {median_val:.2f}")
-    plt.legend()
+    ax.axvline(mean_val, color='red', linestyle='--', linewidth=2, label=f"Moyenne: {mean_val:.2f}")
+    ax.axvline(median_val, color='blue', linestyle='--', linewidth=2, label=f"Médiane: {median_val:.2f}")
+    ax.legend()
 
     # Stats box
     stats_text = (
@@ -49,19 +47,18 @@ def run_density_curve(df, column, color, dataset_id, user_id):
         f"Écart-type: {std_val:.2f}\n"
         f"N: {n}"
     )
-    plt.text(
+    ax.text(
         0.02, 0.98, stats_text,
-        transform=plt.gca().transAxes,
+        transform=ax.transAxes,
         verticalalignment='top',
         bbox=dict(boxstyle='round', facecolor='wheat', alpha=0.8)
     )
 
-    plt.tight_layout()
+    fig.tight_layout()
 
     # Save figure to memory
     buffer = io.BytesIO()
-    plt.savefig(buffer, format='png', bbox_inches='tight', dpi=300)
-    plt.close()
+    fig.savefig(buffer, format='png', bbox_inches='tight', dpi=300)
     buffer.seek(0)
 
     # Encode to Base64
@@ -2,108 +2,328 @@
 
 import pandas as pd
 import numpy as np
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-from sklearn.decomposition import PCA
+from matplotlib.patches import Circle
+from sklearn.decomposition import PCA, IncrementalPCA
+from sklearn.manifold import TSNE
+from sklearn.neighbors import NearestNeighbors
 from sklearn.preprocessing import StandardScaler
-import prince
 import os
+from scipy import sparse
+
+from analysis_engine import cache
+from analysis_engine.raster import raster_scatter, should_rasterize
+from analysis_engine.figures import subplots, save_figure
+
+try:
+    import umap
+except ImportError:  # optional dependency (umap-learn)
+    umap = None
 
 # ===================== PCA ===================== 
-def run_pca(df, selected_columns, output_dir, custom_ratios=None):
+INCREMENTAL_MIN_CELLS = 20_000_000  # rows x columns above which 'auto' streams IncrementalPCA
+RANDOMIZED_MIN_DIM = 500            # randomized SVD only pays off on matrices at least this large
+DEFAULT_COMPONENTS = 10             # components kept by the truncated solvers when none are requested
+PCA_CHUNK_ROWS = 100_000            # rows per IncrementalPCA batch
+
+
+def _pca_frame(frame, selected_columns, custom_ratios):
+    """Selected columns + composite ratios, incomplete rows dropped."""
+    df_selected = frame[selected_columns].copy()
+
+    # Handle composite ratios if provided
+    if custom_ratios:
+        for new_col, (num, denom) in custom_ratios.items():
+            if num in frame.columns and denom in frame.columns:
+                df_selected[new_col] = frame[num] / frame[denom]
+
+    return df_selected.dropna()
+
+
+def _iter_pca_chunks(df, selected_columns, custom_ratios):
+    """Prepared row blocks sliced from the in-memory frame, so only one block is copied at a time."""
+    for start in range(0, len(df), PCA_CHUNK_ROWS):
+        chunk = _pca_frame(df.iloc[start:start + PCA_CHUNK_ROWS], selected_columns, custom_ratios)
+        if len(chunk):
+            yield chunk
+
+
+def _pca_batches(chunks, min_rows):
+    """IncrementalPCA needs >= n_components rows per batch: grow short blocks until they are
+    large enough and fold a short remainder into the last batch."""
+    ready, pending = None, []
+    for chunk in chunks:
+        pending.append(chunk)
+        if sum(len(c) for c in pending) < min_rows:
+            continue
+        if ready is not None:
+            yield ready
+        ready, pending = pd.concat(pending), []
+    if pending:
+        ready = pd.concat(([ready] if ready is not None else []) + pending)
+    if ready is not None:
+        yield ready
+
+
+def _choose_solver(n_rows, n_cols, n_components):
+    if n_rows * n_cols > INCREMENTAL_MIN_CELLS:
+        return 'incremental'
+    if n_components and max(n_rows, n_cols) > RANDOMIZED_MIN_DIM and n_components < 0.8 * min(n_rows, n_cols):
+        return 'randomized'
+    return 'exact'
+
+
+def _fit_pca(df, selected_columns, custom_ratios, n_components, solver):
+    n_features = len(selected_columns) + len(custom_ratios or {})
+    if solver == 'auto':
+        solver = _choose_solver(len(df), n_features, n_components)
+
+    if solver == 'incremental':
+        chunks = lambda: _iter_pca_chunks(df, selected_columns, custom_ratios)
+        scaler = StandardScaler()
+        columns = None
+        for chunk in chunks():
+            scaler.partial_fit(chunk)
+            columns = chunk.columns
+        if columns is None:
+            raise ValueError("No complete rows available for PCA.")
+
+        n_components = min(n_components or DEFAULT_COMPONENTS, len(columns), int(scaler.n_samples_seen_))
+        pca = IncrementalPCA(n_components=n_components)
+        for chunk in _pca_batches(chunks(), n_components):
+            pca.partial_fit(scaler.transform(chunk))
+        components = np.vstack([pca.transform(scaler.transform(chunk))[:, :2] for chunk in chunks()])
+    else:
+        df_selected = _pca_frame(df, selected_columns, custom_ratios)
+        columns = df_selected.columns
+
+        # Standardize data (important for PCA)
+        X_scaled = StandardScaler().fit_transform(df_selected)
+
+        if solver == 'randomized':
+            n_components = min(n_components or DEFAULT_COMPONENTS, *X_scaled.shape)
+            pca = PCA(n_components=n_components, svd_solver='randomized', random_state=42)
+        else:
+            pca = PCA(n_components=n_components)
+        components = pca.fit_transform(X_scaled)
+
+    return {
+        "columns": list(columns),
+        "eigenvalues": pca.explained_variance_,
+        "explained_variance": pca.explained_variance_ratio_,
+        "loadings": pca.components_.T,  # coefficients of variables
+        "scores": components[:, :2],
+        "solver": solver,
+    }
+
+
+def run_pca(df, selected_columns, output_dir, custom_ratios=None, n_components=None,
+            solver='auto'):
     """
     Perform PCA with optional custom ratios (composite features).
+    The fit is cached by data content + columns + ratios + solver settings; the
+    plots are not drawn here but on demand by render_pca_plot().
     
     Args:
         df: DataFrame
         selected_columns: list of columns to include
         output_dir: output directory for graphs
         custom_ratios: dict, e.g. {"Subventions/Income": ("Subventions", "Income")}
+        n_components: number of components to keep (None = all for the exact solver)
+        solver: 'auto' | 'exact' | 'randomized' (randomized SVD) |
+                'incremental' (IncrementalPCA over row chunks of df)
     """
-    df_selected = df[selected_columns].copy()
+    if n_components is not None and n_components < 2:
+        raise ValueError("At least two components are needed for the biplot.")
 
-    # Handle composite ratios if provided
-    if custom_ratios:
-        for new_col, (num, denom) in custom_ratios.items():
-            if num in df.columns and denom in df.columns:
-                df_selected[new_col] = df[num] / df[denom]
+    needed = list(selected_columns)
+    for num, denom in (custom_ratios or {}).values():
+        needed += [c for c in (num, denom) if c in df.columns and c not in needed]
+    key = cache.fingerprint(df[needed], list(selected_columns), sorted((custom_ratios or {}).items()),
+                            n_components, solver)
 
-    df_selected = df_selected.dropna()
+    fit = cache.load("pca", key)
+    cached = fit is not None
+    if fit is None:
+        fit = cache.save("pca", key, _fit_pca(df, selected_columns, custom_ratios, n_components, solver))
 
-    # Standardize data (important for PCA)
-    X_scaled = StandardScaler().fit_transform(df_selected)
+    explained_variance = fit["explained_variance"]
+    eigenvalues = fit["eigenvalues"]
+
+    return {
+        "eigenvalues": eigenvalues.tolist(),
+        "explained_variance": explained_variance.tolist(),
+        "loadings": fit["loadings"].tolist(),
+        "coordinates": fit["scores"][:10].tolist(),  # First 10 rows
+        "solver": fit["solver"],
+        "n_components": int(len(eigenvalues)),
+        "variance_captured": float(explained_variance.sum()),
+        "n_observations": int(len(fit["scores"])),
+        "cache_key": key,
+        "cached": cached,
+        "scree_plot": pca_plot_name(key, "scree"),
+        "biplot": pca_plot_name(key, "biplot"),
+        "correlation_circle": pca_plot_name(key, "correlation_circle")
+    }
 
-    pca = PCA()
-    components = pca.fit_transform(X_scaled)
 
-    explained_variance = pca.explained_variance_ratio_
-    eigenvalues = pca.explained_variance_
-    loadings = pca.components_.T  # coefficients of variables
+def _render_scree(fit, path):
+    eigenvalues = fit["eigenvalues"]
+    fig, ax = subplots(figsize=(8, 5))
+    ax.plot(np.arange(1, len(eigenvalues)+1), eigenvalues, 'o-', color='blue')
+    ax.set_title("Scree Plot (Eigenvalues)")
+    ax.set_xlabel("Principal Component")
+    ax.set_ylabel("Eigenvalue")
+    save_figure(fig, path, tight=True)
 
-    # Scree Plot
-    plt.figure(figsize=(8, 5))
-    plt.plot(np.arange(1, len(eigenvalues)+1), eigenvalues, 'o-', color='blue')
-    plt.title("Scree Plot (Eigenvalues)")
-    plt.xlabel("Principal Component")
-    plt.ylabel("Eigenvalue")
-    scree_path = os.path.join(output_dir, "scree_plot.png")
-    plt.tight_layout()
-    plt.savefig(scree_path)
-    plt.close()
 
+def _render_biplot(fit, path):
     # Biplot (first 2 PCs)
-    plt.figure(figsize=(8, 6))
-    xs, ys = components[:, 0], components[:, 1]
-    plt.scatter(xs, ys, alpha=0.6, color='gray', label="Observations")
-
-    for i, var in enumerate(df_selected.columns):
-        plt.arrow(0, 0, loadings[i, 0]*3, loadings[i, 1]*3, 
-                  color='red', alpha=0.7)
-        plt.text(loadings[i, 0]*3.2, loadings[i, 1]*3.2, var, color='red')
-
-    plt.xlabel(f"PC1 ({explained_variance[0]*100:.2f}%)")
-    plt.ylabel(f"PC2 ({explained_variance[1]*100:.2f}%)")
-    plt.title("PCA Biplot")
-    plt.grid(True)
-    biplot_path = os.path.join(output_dir, "pca_biplot.png")
-    plt.savefig(biplot_path)
-    plt.close()
-
-    # Correlation circle
-    plt.figure(figsize=(6, 6))
+    loadings, explained_variance = fit["loadings"], fit["explained_variance"]
+    fig, ax = subplots(figsize=(8, 6))
+    xs, ys = fit["scores"][:, 0], fit["scores"][:, 1]
+    if should_rasterize(len(xs)):
+        raster_scatter(ax, xs, ys, cmap='Greys', zorder=0)
+    else:
+        ax.scatter(xs, ys, alpha=0.6, color='gray', label="Observations")
+
+    for i, var in enumerate(fit["columns"]):
+        ax.arrow(0, 0, loadings[i, 0]*3, loadings[i, 1]*3, 
+                 color='red', alpha=0.7)
+        ax.text(loadings[i, 0]*3.2, loadings[i, 1]*3.2, var, color='red')
+
+    ax.set_xlabel(f"PC1 ({explained_variance[0]*100:.2f}%)")
+    ax.set_ylabel(f"PC2 ({explained_variance[1]*100:.2f}%)")
+    ax.set_title("PCA Biplot")
+    ax.grid(True)
+    save_figure(fig, path)
+
+
+def _render_correlation_circle(fit, path):
+    loadings, columns = fit["loadings"], fit["columns"]
+    fig, ax = subplots(figsize=(6, 6))
     for i in range(loadings.shape[0]):
-        plt.arrow(0, 0, loadings[i, 0], loadings[i, 1], 
-                  color='blue', alpha=0.5)
-        plt.text(loadings[i, 0]*1.1, loadings[i, 1]*1.1, df_selected.columns[i])
-    circle = plt.Circle((0, 0), 1, color='gray', fill=False)
-    plt.gca().add_artist(circle)
-    plt.title("Correlation Circle (PC1 vs PC2)")
-    plt.xlabel("PC1")
-    plt.ylabel("PC2")
-    plt.axis('equal')
-    corr_circle_path = os.path.join(output_dir, "correlation_circle.png")
-    plt.savefig(corr_circle_path)
-    plt.close()
+        ax.arrow(0, 0, loadings[i, 0], loadings[i, 1], 
+                 color='blue', alpha=0.5)
+        ax.text(loadings[i, 0]*1.1, loadings[i, 1]*1.1, columns[i])
+    circle = Circle((0, 0), 1, color='gray', fill=False)
+    ax.add_artist(circle)
+    ax.set_title("Correlation Circle (PC1 vs PC2)")
+    ax.set_xlabel("PC1")
+    ax.set_ylabel("PC2")
+    ax.axis('equal')
+    save_figure(fig, path)
+
+
+PCA_PLOTS = {
+    "scree": _render_scree,
+    "biplot": _render_biplot,
+    "correlation_circle": _render_correlation_circle,
+}
+
+
+def pca_plot_name(cache_key, kind):
+    return f"pca_{cache_key}_{kind}.png"
 
-    return {
-        "eigenvalues": eigenvalues.tolist(),
-        "explained_variance": explained_variance.tolist(),
-        "loadings": loadings.tolist(),
-        "coordinates": components[:, :2].tolist(),
-        "scree_plot": "scree_plot.png",
-        "biplot": "pca_biplot.png",
-        "correlation_circle": "correlation_circle.png"
-    }
+
+def render_pca_plot(cache_key, kind, output_dir):
+    """
+    Draw one PCA view from the cached fit. An image that already exists on
+    disk is returned as-is, so each view is rendered at most once per fit.
+    """
+    if kind not in PCA_PLOTS:
+        raise ValueError(f"Unknown PCA plot '{kind}'.")
+
+    filename = pca_plot_name(cache_key, kind)
+    path = os.path.join(output_dir, filename)
+    if not os.path.exists(path):
+        fit = cache.load("pca", cache_key)
+        if fit is None:
+            raise ValueError("PCA results are no longer cached; please run the analysis again.")
+        PCA_PLOTS[kind](fit, path)
+    return filename
 
 # ===================== MCA =====================
 
+def _indicator_matrix(df_selected):
+    """
+    Sparse complete disjunctive table (one column per variable category) built
+    straight from category codes. Missing values form their own 'nan' category.
+    """
+    n_rows = len(df_selected)
+    codes, labels, offset = [], [], 0
+    for col in df_selected.columns:
+        col_codes, uniques = pd.factorize(df_selected[col], use_na_sentinel=False)
+        codes.append(col_codes + offset)
+        labels += [f"{col}__{value}" for value in uniques]
+        offset += len(uniques)
+
+    row_idx = np.repeat(np.arange(n_rows), len(codes))
+    col_idx = np.column_stack(codes).ravel()
+    Z = sparse.csr_matrix((np.ones(len(row_idx)), (row_idx, col_idx)), shape=(n_rows, offset))
+    return Z, labels
+
+
+def _randomized_svd(matmat, rmatmat, shape, n_components, n_oversamples=10, n_iter=4, random_state=42):
+    """
+    Randomized truncated SVD of an operator only known through its products
+    (Halko et al.). The range finder works on the short side of the matrix, so
+    the QR steps stay small (categories x k) however many rows there are.
+    """
+    transpose = shape[0] > shape[1]
+    if transpose:
+        matmat, rmatmat, shape = rmatmat, matmat, shape[::-1]
+
+    rng = np.random.default_rng(random_state)
+    k = min(n_components + n_oversamples, min(shape))
+    Q, _ = np.linalg.qr(matmat(rng.standard_normal((shape[1], k))))
+    for _ in range(n_iter):
+        Q, _ = np.linalg.qr(matmat(rmatmat(Q)))
+    # SVD of the wide k x n block B = Q^T M through the small Gram matrix B B^T
+    B = rmatmat(Q).T
+    eigvals, W = np.linalg.eigh(B @ B.T)
+    order = np.argsort(eigvals)[::-1]
+    s = np.sqrt(np.clip(eigvals[order], 0, None))
+    W = W[:, order]
+    Vt = (W.T @ B) / np.where(s > 0, s, 1)[:, None]
+    U = Q @ W
+
+    if transpose:
+        return Vt[:n_components].T, s[:n_components], U[:, :n_components].T
+    return U[:, :n_components], s[:n_components], Vt[:n_components]
+
+
+def _sparse_mca(df_selected, n_components=2):
+    """
+    MCA as a correspondence analysis of the sparse indicator matrix Z.
+    The standardized residual matrix S = D_r^-1/2 (P - r c^T) D_c^-1/2 is never
+    materialized: S = A - u v^T with A sparse, and the randomized SVD only
+    needs products with S and S^T.
+    """
+    Z, labels = _indicator_matrix(df_selected)
+    n_rows, n_vars = len(df_selected), df_selected.shape[1]
+    c = np.asarray(Z.sum(axis=0)).ravel() / (n_rows * n_vars)   # column masses
+
+    A = (Z @ sparse.diags(1.0 / np.sqrt(c))) / (n_vars * np.sqrt(n_rows))
+    u = np.full(n_rows, 1.0 / np.sqrt(n_rows))
+    v = np.sqrt(c)
+    matmat = lambda M: A @ M - np.outer(u, v @ M)
+    rmatmat = lambda M: A.T @ M - np.outer(v, u @ M)
+
+    U, s, Vt = _randomized_svd(matmat, rmatmat, Z.shape, n_components)
+
+    eigenvalues = s ** 2
+    total_inertia = (Z.shape[1] - n_vars) / n_vars
+    row_coords = pd.DataFrame(np.sqrt(n_rows) * U * s, index=df_selected.index)
+    col_coords = pd.DataFrame((Vt.T / np.sqrt(c)[:, None]) * s, index=labels)
+    return row_coords, col_coords, eigenvalues, eigenvalues / total_inertia
+
+
 def run_mca(df, selected_columns, output_dir):
     df_selected = df[selected_columns].copy()
 
     # Convert numeric columns to categorical bins for MCA
     for col in selected_columns:
-        if np.issubdtype(df_selected[col].dtype, np.number):
+        if pd.api.types.is_numeric_dtype(df_selected[col]):
             # Use qcut with labels to create meaningful categories
             try:
                 df_selected[col] = pd.qcut(df_selected[col], q=4, duplicates='drop', 
@@ -112,11 +332,7 @@ def run_mca(df, selected_columns, output_dir):
                 # If qcut fails, use cut instead
                 df_selected[col] = pd.cut(df_selected[col], bins=4, 
                                          labels=['Low', 'Med-Low', 'Med-High', 'High'])
-        # Convert to string to ensure categorical treatment
-        df_selected[col] = df_selected[col].astype(str)
 
-    df_selected = df_selected.dropna()
-    
     if df_selected.empty:
         return {
             "error": "No valid data after preprocessing",
@@ -124,64 +340,47 @@ def run_mca(df, selected_columns, output_dir):
         }
 
     try:
-        # Initialize and fit MCA
-        mca = prince.MCA(n_components=2, random_state=42)
-        mca = mca.fit(df_selected)
-
-        # Get row coordinates (observations)
-        row_coords = mca.transform(df_selected)
-        
-        # Get column coordinates (variable categories)
-        col_coords = mca.column_coordinates(df_selected)
-        
-        # Get explained inertia - try different attribute names
-        try:
-            inertia = mca.explained_inertia_
-        except AttributeError:
-            try:
-                # Some versions use eigenvalues_
-                eigenvalues = mca.eigenvalues_
-                total_inertia = eigenvalues.sum()
-                inertia = eigenvalues / total_inertia
-            except AttributeError:
-                # Fallback: calculate manually
-                inertia = np.array([0.5, 0.3])  # Placeholder
+        # Row coordinates (observations), column coordinates (variable categories)
+        # and explained inertia from the sparse correspondence analysis
+        row_coords, col_coords, eigenvalues, inertia = _sparse_mca(df_selected, n_components=2)
 
         # Plot MCA - Row coordinates
-        plt.figure(figsize=(10, 8))
+        fig, ax = subplots(figsize=(10, 8))
         
         # Plot observations (smaller, more transparent)
-        plt.scatter(row_coords.iloc[:, 0], row_coords.iloc[:, 1], 
-                   alpha=0.3, c='lightblue', s=30, label='Observations', edgecolors='blue', linewidth=0.5)
+        if should_rasterize(len(row_coords)):
+            raster_scatter(ax, row_coords.iloc[:, 0], row_coords.iloc[:, 1], cmap='Blues',
+                           spread=4, zorder=0, label='Observations')
+        else:
+            ax.scatter(row_coords.iloc[:, 0], row_coords.iloc[:, 1], 
+                       alpha=0.3, c='lightblue', s=30, label='Observations', edgecolors='blue', linewidth=0.5)
 
         # Plot variable categories (larger, more visible)
         for idx, label in enumerate(col_coords.index):
-            plt.scatter(col_coords.iloc[idx, 0], col_coords.iloc[idx, 1], 
+            ax.scatter(col_coords.iloc[idx, 0], col_coords.iloc[idx, 1], 
                        c='red', marker='o', s=150, edgecolors='darkred', linewidth=2, zorder=5)
-            plt.text(col_coords.iloc[idx, 0] + 0.05, col_coords.iloc[idx, 1] + 0.05, 
+            ax.text(col_coords.iloc[idx, 0] + 0.05, col_coords.iloc[idx, 1] + 0.05, 
                     str(label), fontsize=9, ha='left', weight='bold',
                     bbox=dict(boxstyle='round,pad=0.3', facecolor='yellow', alpha=0.7))
 
         # Format the plot
         try:
-            plt.title(f"MCA Factorial Map (Dim1: {inertia[0]*100:.2f}%, Dim2: {inertia[1]*100:.2f}%)", 
-                     fontsize=14, weight='bold')
-            plt.xlabel(f"Dimension 1 ({inertia[0]*100:.2f}%)", fontsize=12)
-            plt.ylabel(f"Dimension 2 ({inertia[1]*100:.2f}%)", fontsize=12)
+            ax.set_title(f"MCA Factorial Map (Dim1: {inertia[0]*100:.2f}%, Dim2: {inertia[1]*100:.2f}%)", 
+                         fontsize=14, weight='bold')
+            ax.set_xlabel(f"Dimension 1 ({inertia[0]*100:.2f}%)", fontsize=12)
+            ax.set_ylabel(f"Dimension 2 ({inertia[1]*100:.2f}%)", fontsize=12)
         except (TypeError, IndexError):
-            plt.title("MCA Factorial Map", fontsize=14, weight='bold')
-            plt.xlabel("Dimension 1", fontsize=12)
-            plt.ylabel("Dimension 2", fontsize=12)
+            ax.set_title("MCA Factorial Map", fontsize=14, weight='bold')
+            ax.set_xlabel("Dimension 1", fontsize=12)
+            ax.set_ylabel("Dimension 2", fontsize=12)
             
-        plt.legend(loc='best')
-        plt.grid(True, alpha=0.3, linestyle='--')
-        plt.axhline(y=0, color='black', linestyle='-', linewidth=0.8)
-        plt.axvline(x=0, color='black', linestyle='-', linewidth=0.8)
+        ax.legend(loc='best')
+        ax.grid(True, alpha=0.3, linestyle='--')
+        ax.axhline(y=0, color='black', linestyle='-', linewidth=0.8)
+        ax.axvline(x=0, color='black', linestyle='-', linewidth=0.8)
 
         mca_path = os.path.join(output_dir, "mca_map.png")
-        plt.tight_layout()
-        plt.savefig(mca_path, dpi=150, bbox_inches='tight')
-        plt.close()
+        save_figure(fig, mca_path, tight=True, dpi=150, bbox_inches='tight')
 
         # Prepare inertia for return
         inertia_list = inertia.tolist() if hasattr(inertia, 'tolist') else [float(inertia[0]), float(inertia[1])]
@@ -191,6 +390,7 @@ def run_mca(df, selected_columns, output_dir):
             "row_coordinates": row_coords.iloc[:10, :2].to_dict(),  # First 10 rows
             "column_coordinates": col_coords.to_dict(),
             "inertia": inertia_list,
+            "eigenvalues": eigenvalues.tolist(),
             "n_observations": len(row_coords),
             "n_categories": len(col_coords)
         }
@@ -203,4 +403,99 @@ def run_mca(df, selected_columns, output_dir):
             "error": f"{str(e)}",
             "mca_map": None
         }
-    
\ No newline at end of file
+    
+
+# ===================== Nonlinear embedding (t-SNE / UMAP) =====================
+EMBED_MAX_POINTS = 10_000   # above this, the embedding is fitted on a sample and the rest projected
+EMBED_NEIGHBORS = 10        # neighbors used for the out-of-sample projection
+
+
+def _project_out_of_sample(X_fit, Y_fit, X_new, n_neighbors=EMBED_NEIGHBORS, n_jobs=-1):
+    """Place new rows at the inverse-distance weighted mean of their nearest fitted neighbors."""
+    nn = NearestNeighbors(n_neighbors=n_neighbors, n_jobs=n_jobs).fit(X_fit)
+    dist, idx = nn.kneighbors(X_new)
+    weights = 1.0 / np.maximum(dist, 1e-12)
+    weights /= weights.sum(axis=1, keepdims=True)
+    return np.einsum('ij,ijk->ik', weights, Y_fit[idx])
+
+
+def _fit_embedding(X_scaled, method, perplexity, n_neighbors, max_points, n_jobs):
+    n_rows = len(X_scaled)
+    rng = np.random.default_rng(42)
+    fit_idx = np.sort(rng.choice(n_rows, max_points, replace=False)) if n_rows > max_points else np.arange(n_rows)
+    X_fit = X_scaled[fit_idx]
+
+    if method == 'umap':
+        if umap is None:
+            raise ValueError("UMAP requires the optional 'umap-learn' package.")
+        model = umap.UMAP(n_components=2, n_neighbors=n_neighbors, n_jobs=n_jobs)
+        Y_fit = model.fit_transform(X_fit)
+        project = model.transform
+    else:
+        perplexity = min(perplexity, (len(X_fit) - 1) / 3)
+        model = TSNE(n_components=2, perplexity=perplexity, method='barnes_hut', init='pca',
+                     random_state=42, n_jobs=n_jobs)
+        Y_fit = model.fit_transform(X_fit)
+        project = lambda X_new: _project_out_of_sample(X_fit, Y_fit, X_new, n_jobs=n_jobs)
+
+    Y = np.empty((n_rows, 2))
+    Y[fit_idx] = Y_fit
+    rest = np.setdiff1d(np.arange(n_rows), fit_idx, assume_unique=True)
+    if len(rest):
+        Y[rest] = project(X_scaled[rest])
+
+    fitted = np.zeros(n_rows, dtype=bool)
+    fitted[fit_idx] = True
+    return {"coordinates": Y, "fitted": fitted}
+
+
+def run_embedding(df, selected_columns, output_dir, method='tsne', perplexity=30, n_neighbors=15,
+                  max_points=EMBED_MAX_POINTS, n_jobs=-1):
+    """
+    2-D nonlinear embedding of the standardized columns.
+    method: 'tsne' (Barnes-Hut, multithreaded) | 'umap' (needs umap-learn)
+    Above `max_points` rows the embedding is fitted on a random sample and the
+    remaining rows are projected into it. Results and plot are cached per data
+    content + settings, so repeated runs are instant.
+    """
+    if len(selected_columns) < 2:
+        raise ValueError("Select at least two columns for the embedding.")
+
+    X = df[selected_columns].dropna()
+    if len(X) < 5:
+        raise ValueError("Not enough complete rows for an embedding.")
+
+    key = cache.fingerprint(X, method, perplexity, n_neighbors, max_points)
+    emb = cache.load("embedding", key)
+    cached = emb is not None
+    if emb is None:
+        X_scaled = StandardScaler().fit_transform(X)
+        emb = cache.save("embedding", key, _fit_embedding(X_scaled, method, perplexity, n_neighbors, max_points, n_jobs))
+
+    label = "UMAP" if method == 'umap' else "t-SNE"
+    filename = f"embedding_{key}.png"
+    path = os.path.join(output_dir, filename)
+    if not os.path.exists(path):
+        Y, fitted = emb["coordinates"], emb["fitted"]
+        fig, ax = subplots(figsize=(8, 6))
+        if should_rasterize(len(Y)):
+            raster_scatter(ax, Y[:, 0], Y[:, 1], categories=np.where(fitted, "Fitted", "Projected"),
+                           palette=['steelblue', 'lightsteelblue'], order=["Fitted", "Projected"])
+        else:
+            if (~fitted).any():
+                ax.scatter(Y[~fitted, 0], Y[~fitted, 1], s=5, alpha=0.3, color='lightsteelblue', label="Projected")
+            ax.scatter(Y[fitted, 0], Y[fitted, 1], s=8, alpha=0.6, color='steelblue', label="Fitted")
+        ax.set_title(f"{label} Embedding ({len(Y)} observations)")
+        ax.set_xlabel(f"{label} 1")
+        ax.set_ylabel(f"{label} 2")
+        ax.legend(loc='best')
+        ax.grid(True, alpha=0.3)
+        save_figure(fig, path, tight=True, dpi=150)
+
+    return {
+        "embedding_plot": filename,
+        "method": label,
+        "n_observations": int(len(emb["coordinates"])),
+        "n_fitted": int(emb["fitted"].sum()),
+        "cached": cached
+    }
@@ -0,0 +1,102 @@
+# analysis_engine/figures.py
+
+import os
+import pickle
+import threading
+import contextvars
+from contextlib import contextmanager
+
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from plotly.offline import plot as plotly_save
+
+from analysis_engine import render_service
+
+# The engine never goes through pyplot: every chart is its own Figure on its own
+# Agg canvas, so charts can render concurrently in threads without sharing
+# pyplot's global "current figure" state (and nothing needs plt.close()).
+
+# {path: job_id} of the charts queued by save_figure / save_plotly inside deferred_rendering()
+_deferred = contextvars.ContextVar("deferred_renders", default=None)
+
+
+def new_figure(figsize=None, **kwargs):
+    """A Figure attached to a private Agg canvas."""
+    fig = Figure(figsize=figsize, **kwargs)
+    FigureCanvasAgg(fig)
+    return fig
+
+
+def subplots(nrows=1, ncols=1, figsize=None, **kwargs):
+    """Like plt.subplots, without registering the figure with pyplot."""
+    fig = new_figure(figsize=figsize)
+    return fig, fig.subplots(nrows, ncols, **kwargs)
+
+
+@contextmanager
+def deferred_rendering():
+    """
+    Inside this block charts are not drawn: save_figure / save_plotly hand them
+    to the render pool and return at once. Yields the {path: job_id} dict of
+    the charts queued, for the page to poll.
+    """
+    jobs = {}
+    token = _deferred.set(jobs)
+    try:
+        yield jobs
+    finally:
+        _deferred.reset(token)
+
+
+def _tmp_path(path):
+    # keeps the extension so savefig / plotly pick the right format
+    root, ext = os.path.splitext(path)
+    return f"{root}.{os.getpid()}.{threading.get_ident()}.tmp{ext}"
+
+
+def _queue(renderer, figure, path, **kwargs):
+    """Submit a chart to the render pool when deferring; False means draw it here."""
+    jobs = _deferred.get()
+    if jobs is None:
+        return False
+    try:
+        jobs[path] = render_service.submit(renderer, figure=pickle.dumps(figure), path=path, **kwargs)
+    except (RuntimeError, pickle.PicklingError, TypeError, AttributeError):
+        return False  # queue full or the chart does not pickle
+    return True
+
+
+def render_figure(figure, path, tight=False, **savefig_kwargs):
+    """Draw a (possibly pickled) matplotlib Figure to `path`; the file appears complete or not at all."""
+    if isinstance(figure, bytes):
+        figure = pickle.loads(figure)
+    if tight:
+        figure.tight_layout()
+    tmp_path = _tmp_path(path)
+    figure.savefig(tmp_path, **savefig_kwargs)
+    os.replace(tmp_path, path)
+    return os.path.basename(path)
+
+
+def render_plotly(figure, path):
+    """Write a (possibly pickled) plotly Figure to `path` as standalone HTML."""
+    if isinstance(figure, bytes):
+        figure = pickle.loads(figure)
+    tmp_path = _tmp_path(path)
+    plotly_save(figure, filename=tmp_path, auto_open=False, include_plotlyjs="cdn")
+    os.replace(tmp_path, path)
+    return os.path.basename(path)
+
+
+def save_figure(fig, path, tight=False, **savefig_kwargs):
+    """Save a chart, or queue it on the render pool inside deferred_rendering()."""
+    if not _queue("figure", fig, path, tight=tight, **savefig_kwargs):
+        render_figure(fig, path, tight=tight, **savefig_kwargs)
+    return os.path.basename(path)
+
+
+def save_plotly(fig, path):
+    """save_figure for plotly charts."""
+    if not _queue("plotly", fig, path):
+        render_plotly(fig, path)
+    return os.path.basename(path)
@@ -1,42 +1,505 @@
 # analysis_engine/matrix_tools.py
 
 import os
+import time
+import uuid
 import numpy as np
 import pandas as pd
+import warnings
+from scipy import stats as sps
+from joblib import Parallel, delayed, effective_n_jobs, parallel_config
 
-import matplotlib
-matplotlib.use("Agg")  # for server-side rendering
-import matplotlib.pyplot as plt
 import seaborn as sns
 
+from analysis_engine import cache
+from analysis_engine.figures import subplots, save_figure
+
+PAIR_BLOCK_ROWS = 512     # matrix rows scanned at a time when extracting correlated pairs
+MATRIX_TILE = 1_024       # columns per tile of the blocked correlation / covariance product
+MEMMAP_COLUMNS = 2_000    # from this many columns the matrix is written to a memory-mapped file
+HEATMAP_MAX_CELLS = 600   # wider matrices are block-averaged down to this many cells per side
+HTML_MAX_COLUMNS = 60     # wider matrices are only offered as CSV, not as an HTML table
+KENDALL_PAIRS_PER_TASK = 64  # column pairs per worker task for Kendall's tau
+MATRIX_FILE_TTL = 24 * 3600  # memory-mapped matrix files older than this (left by failed requests) are swept
+
 
 def _ensure_dir(path):
     os.makedirs(path, exist_ok=True)
     return path
 
 
-def _save_fig(output_dir, filename_prefix):
+def _save_fig(fig, output_dir, filename_prefix):
     _ensure_dir(output_dir)
     filename = f"{filename_prefix}.png"
     outpath = os.path.join(output_dir, filename)
-    plt.tight_layout()
-    plt.savefig(outpath, bbox_inches="tight", dpi=140)
-    plt.close()
+    save_figure(fig, outpath, tight=True, bbox_inches="tight", dpi=140)
     return filename
 
 
-def _save_csv(output_dir, filename_prefix, df):
+def _band_product(Z, a, tile, scale):
+    """One row band of the upper triangle: tile columns starting at a against every column from a on."""
+    return (Z[:, a:a + tile].T @ Z[:, a:]) / scale
+
+
+def _cross_tiles(Z, out, scale, tile=MATRIX_TILE, n_jobs=-1):
+    """
+    out = Z.T @ Z / scale, one row band of column tiles at a time over the
+    upper triangle, each band mirrored into the lower one. Bands run in
+    worker processes with BLAS pinned to one thread inside each worker
+    (inner_max_num_threads, so this process's BLAS settings are untouched)
+    and are written into `out` as they arrive. `out` can be a memmap; only a
+    few bands are in memory at a time.
+    """
+    p = Z.shape[1]
+    starts = range(0, p, tile)
+
+    def fill(bands):
+        for a, block in zip(starts, bands):
+            out[a:a + tile, a:] = block
+            out[a + tile:, a:a + tile] = block[:, tile:].T
+
+    if effective_n_jobs(n_jobs) == 1 or len(starts) == 1:
+        fill(_band_product(Z, a, tile, scale) for a in starts)
+    else:
+        with parallel_config(backend="loky", inner_max_num_threads=1):
+            fill(Parallel(n_jobs=n_jobs, max_nbytes="1M", mmap_mode="r", return_as="generator")(
+                delayed(_band_product)(Z, a, tile, scale) for a in starts))
+    return out
+
+
+def _matrix_buffer(p, name_prefix, kind):
+    """
+    In-memory matrix, or for very wide panels a .npy memmap in the analysis
+    cache. Each call gets its own file, which belongs to the request that
+    made it and is removed with _discard once its CSV / heatmap is written.
+    """
+    if p < MEMMAP_COLUMNS:
+        return np.empty((p, p))
+    folder = os.path.join(cache.CACHE_DIR, "matrices")
+    os.makedirs(folder, exist_ok=True)
+    _sweep_matrix_files(folder)
+    path = os.path.join(folder, f"{name_prefix}_{kind}_{uuid.uuid4().hex}.npy")
+    return np.lib.format.open_memmap(path, mode="w+", dtype=np.float64, shape=(p, p))
+
+
+def _sweep_matrix_files(folder):
+    cutoff = time.time() - MATRIX_FILE_TTL
+    for entry in os.scandir(folder):
+        try:
+            if entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+        except OSError:
+            pass
+
+
+def _memmap_path(matrix):
+    """File behind a memory-mapped matrix (DataFrame or array), or None."""
+    if matrix is None:
+        return None
+    values = np.asarray(matrix)
+    while values is not None and not isinstance(values, np.memmap):
+        values = values.base
+    return None if values is None else values.filename
+
+
+def _discard(*matrices):
+    """
+    Remove the files behind memory-mapped matrices (or _matrix_source dicts).
+    Open mappings stay readable, so the returned DataFrames keep working.
+    """
+    for matrix in matrices:
+        path = matrix.get("path") if isinstance(matrix, dict) else _memmap_path(matrix)
+        if path:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def heatmap_path(heatmap_args):
+    """Where render_matrix_heatmap(**heatmap_args) writes its image."""
+    return os.path.join(heatmap_args["output_dir"], f"{heatmap_args['filename_prefix']}.png")
+
+
+def discard_matrix_source(heatmap_args):
+    """Drop the matrix file of heatmap_args that will not be rendered after all."""
+    _discard(heatmap_args.get("matrix"))
+
+
+def blocked_matrix(data, kind="corr", ddof=1, name_prefix="", n_jobs=-1):
+    """
+    Correlation ('corr') or covariance ('cov') of NA-free data with the
+    blocked engine: the columns are centred (and for correlation scaled to
+    unit norm) once, then the matrix is filled tile by tile by _cross_tiles.
+    Returns a DataFrame over the (possibly memory-mapped) result.
+    """
+    X = np.asarray(data, dtype=np.float64)
+    n, p = X.shape
+    if n - ddof <= 0:
+        raise ValueError("Not enough rows to compute the matrix.")
+    Z = np.asfortranarray(X - X.mean(axis=0))
+    if kind == "corr":
+        with np.errstate(divide="ignore", invalid="ignore"):
+            Z /= np.sqrt((Z ** 2).sum(axis=0))  # constant columns become NaN, as in pandas
+        scale = 1.0
+    else:
+        scale = n - ddof
+
+    out = _cross_tiles(Z, _matrix_buffer(p, name_prefix, kind), scale, n_jobs=n_jobs)
+    if kind == "corr":
+        for a in range(0, p, PAIR_BLOCK_ROWS):
+            np.clip(out[a:a + PAIR_BLOCK_ROWS], -1.0, 1.0, out=out[a:a + PAIR_BLOCK_ROWS])
+        diag = np.arange(p)
+        out[diag, diag] = np.where(np.isnan(out[diag, diag]), np.nan, 1.0)
+    if isinstance(out, np.memmap):
+        out.flush()
+    return pd.DataFrame(out, index=list(data.columns), columns=list(data.columns), copy=False)
+
+
+def _comoments(X, n_jobs=-1):
+    """Mergeable co-moment state of a block of rows: n, column means and C = (X - mean)'(X - mean)."""
+    mean = X.mean(axis=0)
+    p = X.shape[1]
+    C = _cross_tiles(np.asfortranarray(X - mean), np.empty((p, p)), 1.0, n_jobs=n_jobs)
+    return {"n": len(X), "mean": mean, "C": C}
+
+
+def _merge_comoments(a, b):
+    """Combine the co-moment states of two row blocks (Chan et al.'s pairwise update)."""
+    n = a["n"] + b["n"]
+    delta = b["mean"] - a["mean"]
+    return {
+        "n": n,
+        "mean": a["mean"] + delta * (b["n"] / n),
+        "C": a["C"] + b["C"] + np.outer(delta, delta) * (a["n"] * b["n"] / n),
+    }
+
+
+def _stored_comoments(state_key, data, row_hashes):
+    """
+    Load the co-moment state saved for (state_key, columns) and split off
+    the rows appended since. Returns (cache key, state, new rows); state is
+    None when nothing usable is stored (none yet, or the stored rows are no
+    longer a prefix of the data because earlier rows were edited).
+    """
+    key = cache.fingerprint(state_key, tuple(data.columns))
+    state = cache.load("comoments", key)
+    if state is None:
+        return key, None, None
+    n = state["n"]
+    if n > len(data) or cache.fingerprint(row_hashes[:n]) != state["fingerprint"]:
+        return key, None, None
+    return key, state, data.iloc[n:]
+
+
+def incremental_matrix(data, state_key, kind="corr", ddof=1, n_jobs=-1):
+    """
+    Correlation / covariance of NA-free data from co-moment state persisted
+    per (state_key, columns). When the data is the stored rows plus appended
+    ones, only the new rows are multiplied out and merged in
+    (_merge_comoments), so a growing feed costs O(new rows x p^2) per update.
+    Edited history triggers a full recompute. Returns (DataFrame, update
+    info {mode: 'full' | 'update' | 'reuse', n_new}).
+    """
+    X = np.asarray(data, dtype=np.float64)
+    n, p = X.shape
+    if n - ddof <= 0:
+        raise ValueError("Not enough rows to compute the matrix.")
+    row_hashes = pd.util.hash_pandas_object(data, index=False).to_numpy()
+    key, state, new_rows = _stored_comoments(state_key, data, row_hashes)
+    if state is None:
+        state, update = _comoments(X, n_jobs), {"mode": "full", "n_new": n}
+    elif len(new_rows):
+        state = _merge_comoments(state, _comoments(X[state["n"]:], n_jobs))
+        update = {"mode": "update", "n_new": len(new_rows)}
+    else:
+        update = {"mode": "reuse", "n_new": 0}
+    if update["mode"] != "reuse":
+        cache.save("comoments", key, {**state, "fingerprint": cache.fingerprint(row_hashes)})
+
+    C = state["C"]
+    if kind == "corr":
+        with np.errstate(divide="ignore", invalid="ignore"):
+            scale = np.sqrt(np.diag(C))
+            matrix = np.clip(C / np.outer(scale, scale), -1.0, 1.0)
+        diag = np.arange(p)
+        matrix[diag, diag] = np.where(np.isnan(matrix[diag, diag]), np.nan, 1.0)
+    else:
+        matrix = C / (n - ddof)
+    return pd.DataFrame(matrix, index=list(data.columns), columns=list(data.columns)), update
+
+
+def _kendall_pairs(X, pairs):
+    """Kendall's tau-b and its p-value for a batch of column pairs, on their pairwise-complete rows."""
+    taus = np.full((len(pairs), 2), np.nan)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")  # constant input -> NaN, as in pandas
+        for k, (i, j) in enumerate(pairs):
+            x, y = X[:, i], X[:, j]
+            keep = ~(np.isnan(x) | np.isnan(y))
+            if keep.sum() > 1:
+                test = sps.kendalltau(x[keep], y[keep])
+                taus[k] = test.statistic, test.pvalue
+    return taus
+
+
+def kendall_matrix(data, n_jobs=-1):
+    """
+    Kendall's tau-b matrix. scipy's kendalltau counts discordant pairs with
+    Knight's merge-sort algorithm (O(n log n) per pair instead of pandas'
+    O(n^2)); the column pairs are spread over a process pool in batches,
+    unless they fit in a single batch.
+    Returns (tau, p-values) DataFrames.
+    """
+    X = data.to_numpy(dtype=np.float64)
+    p = X.shape[1]
+    rows, cols = np.triu_indices(p, 1)
+    pairs = list(zip(rows, cols))
+    batches = [pairs[a:a + KENDALL_PAIRS_PER_TASK] for a in range(0, len(pairs), KENDALL_PAIRS_PER_TASK)]
+    if effective_n_jobs(n_jobs) == 1 or len(batches) <= 1:
+        taus = [_kendall_pairs(X, batch) for batch in batches]
+    else:
+        with parallel_config(backend="loky", inner_max_num_threads=1):
+            taus = Parallel(n_jobs=n_jobs, max_nbytes="1M", mmap_mode="r")(
+                delayed(_kendall_pairs)(X, batch) for batch in batches)
+
+    tau, pvalues = np.eye(p), np.zeros((p, p))
+    if pairs:
+        taus = np.concatenate(taus)
+        tau[rows, cols] = tau[cols, rows] = taus[:, 0]
+        pvalues[rows, cols] = pvalues[cols, rows] = taus[:, 1]
+    names = list(data.columns)
+    return pd.DataFrame(tau, index=names, columns=names), pd.DataFrame(pvalues, index=names, columns=names)
+
+
+def spearman_matrix(data, name_prefix="", n_jobs=-1):
+    """Spearman = Pearson on ranks: every column is ranked once (ties averaged), then blocked_matrix."""
+    ranks = pd.DataFrame(sps.rankdata(data.to_numpy(dtype=np.float64), axis=0), columns=data.columns)
+    return blocked_matrix(ranks, kind="corr", name_prefix=name_prefix, n_jobs=n_jobs)
+
+
+def masked_corr(data):
+    """
+    Pairwise-complete Pearson correlation from matrix products of the NA
+    mask instead of pandas' per-pair masking. With M the 0/1 presence mask
+    and X the (mean-centred) data with NA set to 0:
+      n   = M'M        rows where both columns are present
+      Sx  = X'M        sum of column i over those rows (Sx' for column j)
+      Sxx = (X*X)'M    sum of squares of column i over those rows
+      Sxy = X'X        cross-products
+    so every pair's co-moment and both variances come from its own rows in
+    four BLAS calls. Returns (corr, pairwise n) DataFrames.
+    """
+    X = data.to_numpy(dtype=np.float64)
+    present = ~np.isnan(X)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")  # all-NA columns
+        X = np.where(present, X - np.nanmean(X, axis=0), 0.0)
+    M = present.astype(np.float64)
+    n = M.T @ M
+    sx = X.T @ M
+    sxx = (X * X).T @ M
+    sxy = X.T @ X
+    with np.errstate(divide="ignore", invalid="ignore"):
+        comoment = sxy - sx * sx.T / n
+        var = np.maximum(sxx - sx ** 2 / n, 0.0)
+        corr = np.clip(comoment / np.sqrt(var * var.T), -1.0, 1.0)
+    corr[n < 2] = np.nan
+    diag = np.arange(len(corr))
+    corr[diag, diag] = np.where(np.isnan(corr[diag, diag]), np.nan, 1.0)
+    names = list(data.columns)
+    return pd.DataFrame(corr, index=names, columns=names), pd.DataFrame(n, index=names, columns=names)
+
+
+def _pairwise_counts(data):
+    """Pairwise-complete row counts (M'M of the presence mask); a constant view when nothing is missing."""
+    present = data.notna().to_numpy()
+    p = present.shape[1]
+    if present.all():
+        n = np.broadcast_to(float(len(data)), (p, p))
+    else:
+        M = present.astype(np.float64)
+        n = M.T @ M
+    return pd.DataFrame(n, index=list(data.columns), columns=list(data.columns), copy=False)
+
+
+def correlation_pvalues(corr, n, name_prefix=""):
+    """
+    Two-sided p-values of correlation coefficients from the t statistic
+    r * sqrt((n - 2) / (1 - r^2)) on n - 2 degrees of freedom (the test
+    scipy's pearsonr and spearmanr use), band by band; wide matrices go to a
+    memory-mapped file like the correlations themselves.
+    """
+    r, counts = np.asarray(corr), np.asarray(n)
+    out = _matrix_buffer(len(r), name_prefix, "pvalues")
+    for a in range(0, len(r), PAIR_BLOCK_ROWS):
+        band_r, dof = r[a:a + PAIR_BLOCK_ROWS], counts[a:a + PAIR_BLOCK_ROWS] - 2
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t = band_r * np.sqrt(dof / (1.0 - band_r ** 2))
+            out[a:a + PAIR_BLOCK_ROWS] = np.where(dof > 0, 2 * sps.t.sf(np.abs(t), dof), np.nan)
+    return pd.DataFrame(out, index=corr.index, columns=corr.columns, copy=False)
+
+
+def _block_average(values, max_cells=HEATMAP_MAX_CELLS):
+    """Shrink a wide square matrix to at most max_cells per side by averaging blocks, reading it band by band."""
+    p = values.shape[0]
+    edges = np.linspace(0, p, min(p, max_cells) + 1).astype(int)
+    widths = np.diff(edges)
+    image = np.empty((len(widths), len(widths)))
+    for k in range(len(widths)):
+        band = np.asarray(values[edges[k]:edges[k + 1]])
+        image[k] = np.add.reduceat(band.sum(axis=0), edges[:-1]) / (widths[k] * widths)
+    return image
+
+
+def _large_heatmap(matrix, cmap, vmin=None, vmax=None):
+    """Heatmap of a matrix too wide for per-cell drawing: block-averaged image, no labels."""
+    image = _block_average(np.asarray(matrix))
+    fig, ax = subplots(figsize=(12, 10))
+    im = ax.imshow(image, cmap=cmap, vmin=vmin, vmax=vmax, interpolation="nearest",
+                   extent=(0, matrix.shape[1], matrix.shape[0], 0))
+    fig.colorbar(im, ax=ax, shrink=.8)
+    ax.set_xlabel(f"column index ({matrix.shape[1]} columns)")
+    ax.set_ylabel("column index")
+    return fig, ax
+
+
+def _matrix_source(matrix):
+    """
+    Picklable stand-in for a matrix handed to a render worker: the .npy path
+    of a memory-mapped matrix (so it is not copied through the pipe), or the
+    DataFrame itself. The file is handed over with it: render_matrix_heatmap
+    removes it once drawn.
+    """
+    path = _memmap_path(matrix)
+    if path is None:
+        return matrix
+    return {"path": path, "columns": list(matrix.columns)}
+
+
+def render_matrix_heatmap(matrix, kind="corr", title="", output_dir="", filename_prefix=""):
+    """
+    Heatmap of a correlation ('corr', diverging, lower triangle) or
+    covariance ('cov') matrix; block-averaged for wide matrices. `matrix` is
+    a DataFrame or a _matrix_source dict (whose file is removed afterwards).
+    Used inline and by the render service workers. Returns the image filename.
+    """
+    if isinstance(matrix, dict):
+        source = matrix
+        try:
+            matrix = pd.DataFrame(np.load(source["path"], mmap_mode="r"), index=source["columns"],
+                                  columns=source["columns"], copy=False)
+            return render_matrix_heatmap(matrix, kind, title, output_dir, filename_prefix)
+        finally:
+            _discard(source)
+    p = matrix.shape[1]
+    cmap = sns.diverging_palette(220, 10, as_cmap=True) if kind == "corr" else "YlGnBu"
+    bounds = {"vmin": -1, "vmax": 1} if kind == "corr" else {}
+    if p > HEATMAP_MAX_CELLS:
+        fig, ax = _large_heatmap(matrix, cmap, **bounds)
+    else:
+        fig, ax = subplots(figsize=(min(1.1*p, 14), min(1.1*p, 14)))
+        if kind == "corr":
+            bounds.update(center=0, mask=np.triu(np.ones_like(matrix, dtype=bool)))  # show lower triangle
+        sns.heatmap(matrix, cmap=cmap, annot=p <= 15, fmt=".2f", ax=ax,
+                    square=True, linewidths=.5, cbar_kws={"shrink": .8}, **bounds)
+    ax.set_title(title)
+    return _save_fig(fig, output_dir, filename_prefix)
+
+
+def _save_csv(output_dir, filename_prefix, matrix):
+    """
+    Write a square matrix to CSV a band of rows at a time (the matrix may be
+    a memmap). Each row is formatted with a single %-format string, which is
+    several times faster than DataFrame.to_csv on wide matrices.
+    """
     _ensure_dir(output_dir)
     filename = f"{filename_prefix}.csv"
-    outpath = os.path.join(output_dir, filename)
-    df.to_csv(outpath, index=True, encoding="utf-8")
+    values = np.asarray(matrix)
+    labels = pd.Series(matrix.index).to_csv(index=False, header=False).splitlines()
+    row_format = ",".join(["%.15g"] * values.shape[1])
+    with open(os.path.join(output_dir, filename), "w", encoding="utf-8", newline="") as f:
+        f.write(pd.DataFrame(columns=matrix.columns).to_csv(index=True))
+        for a in range(0, len(values), PAIR_BLOCK_ROWS):
+            f.writelines(f"{label},{(row_format % tuple(row)).replace('nan', '')}\n"
+                         for label, row in zip(labels[a:a + PAIR_BLOCK_ROWS], values[a:a + PAIR_BLOCK_ROWS]))
     return filename
 
 
-def compute_correlation(df, columns, method="pearson", handle_na="pairwise", output_dir="", name_prefix=""):
+def _matrix_html(matrix):
+    if matrix.shape[1] > HTML_MAX_COLUMNS:
+        return None
+    return matrix.to_html(classes="table table-striped table-sm", float_format=lambda x: f"{x:.4f}")
+
+
+def _upper_pairs(values, threshold=0.0, rows=PAIR_BLOCK_ROWS):
+    """
+    Yield (i, j, r) arrays for the strict upper triangle of a square matrix,
+    keeping |r| >= threshold (NaN never passes). Works a block of rows at a
+    time so the index arrays stay small even for very wide matrices.
+    """
+    p = values.shape[0]
+    cols = np.arange(p)
+    for start in range(0, p - 1, rows):
+        block = values[start:start + rows]
+        keep = (cols[None, :] > cols[start:start + len(block), None]) & (np.abs(block) >= threshold)
+        i, j = np.nonzero(keep)
+        yield i + start, j, block[i, j]
+
+
+def top_pairs(corr, k=10, threshold=0.0):
+    """
+    The k most correlated pairs (by |r|, at least `threshold`) of a
+    correlation matrix, as (col_a, col_b, r) tuples. Each block of the upper
+    triangle is merged into the running best k with argpartition, so only
+    the k winners are ever sorted.
+    """
+    values = np.asarray(corr, dtype=float)
+    names = list(corr.columns)
+    best_i = best_j = np.empty(0, dtype=np.intp)
+    best_r = np.empty(0)
+    for i, j, r in _upper_pairs(values, threshold):
+        best_i, best_j, best_r = np.concatenate([best_i, i]), np.concatenate([best_j, j]), np.concatenate([best_r, r])
+        if len(best_r) > k:
+            keep = np.argpartition(-np.abs(best_r), k)[:k]
+            best_i, best_j, best_r = best_i[keep], best_j[keep], best_r[keep]
+    order = np.argsort(-np.abs(best_r), kind="stable")
+    return [(names[a], names[b], float(r)) for a, b, r in zip(best_i[order], best_j[order], best_r[order])]
+
+
+def _save_pairs_csv(output_dir, filename_prefix, corr, threshold):
+    """Sparse long-format CSV (var1, var2, r) of every pair with |r| >= threshold, strongest first."""
+    names = np.asarray(corr.columns, dtype=object)
+    found = list(_upper_pairs(np.asarray(corr, dtype=float), threshold))
+    i, j, r = (np.concatenate(parts) for parts in zip(*found)) if found else ([], [], [])
+    pairs = pd.DataFrame({"var1": names[i], "var2": names[j], "r": r})
+    pairs = pairs.iloc[np.argsort(-np.abs(pairs["r"].to_numpy()), kind="stable")]
+    _ensure_dir(output_dir)
+    filename = f"{filename_prefix}.csv"
+    pairs.to_csv(os.path.join(output_dir, filename), index=False, encoding="utf-8")
+    return filename, len(pairs)
+
+
+def compute_correlation(df, columns, method="pearson", handle_na="pairwise", output_dir="", name_prefix="",
+                        top_k=10, pair_threshold=0.0, pairs_csv=False, significance=True, n_jobs=-1,
+                        state_key=None, render=True):
     """
     method: 'pearson' | 'spearman' | 'kendall'
     handle_na: 'pairwise' (default) or 'complete' (drop rows with any NA in selected cols)
+    top_k / pair_threshold: how many of the most correlated pairs to report,
+    and the smallest |r| a pair needs to be listed.
+    pairs_csv: also write every pair with |r| >= pair_threshold to a sparse
+    long-format CSV.
+    Pearson and Spearman on NA-free data go through the blocked engine
+    (blocked_matrix, on ranks for Spearman); from MEMMAP_COLUMNS columns on
+    the matrix lives in a memory-mapped file and the heatmap and CSV are
+    produced from it band by band. Kendall always uses kendall_matrix.
+    Pairwise Pearson with missing values uses masked_corr.
+    significance: also return the pairwise n and p-value matrices (and CSVs).
+    state_key: identifies the dataset for incrementally maintained co-moments
+    (incremental_matrix); used for NA-free Pearson below MEMMAP_COLUMNS.
+    render=False skips drawing the heatmap; the returned "heatmap_args"
+    can be handed to render_matrix_heatmap later (e.g. by the render service).
     """
     data = df[columns].copy()
 
@@ -47,69 +510,110 @@ def compute_correlation(df, columns, method="pearson", handle_na="pairwise", out
         pass
 
     # Compute correlation matrix
-    corr = data.corr(method=method)
+    pvalues = n_obs = update = None
+    incremental = state_key is not None and len(columns) < MEMMAP_COLUMNS
+    if method == "kendall":
+        corr, pvalues = kendall_matrix(data, n_jobs=n_jobs)
+    elif data.isna().to_numpy().any():
+        if method == "pearson":
+            corr, n_obs = masked_corr(data)
+        else:
+            corr = data.corr(method=method)
+    elif method == "spearman":
+        corr = spearman_matrix(data, name_prefix=f"{name_prefix}_{method}", n_jobs=n_jobs)
+    elif incremental:
+        corr, update = incremental_matrix(data, state_key, kind="corr", n_jobs=n_jobs)
+    else:
+        corr = blocked_matrix(data, kind="corr", name_prefix=f"{name_prefix}_{method}", n_jobs=n_jobs)
 
     # Heatmap
-    plt.figure(figsize=(min(1.1*len(columns), 14), min(1.1*len(columns), 14)))
-    mask = np.triu(np.ones_like(corr, dtype=bool))  # show lower triangle
-    cmap = sns.diverging_palette(220, 10, as_cmap=True)
-    sns.heatmap(corr, mask=mask, cmap=cmap, vmin=-1, vmax=1, center=0,
-                square=True, annot=len(columns) <= 15, fmt=".2f",
-                linewidths=.5, cbar_kws={"shrink": .8})
-    plt.title(f"Correlation Matrix ({method.title()})")
-    plot_file = _save_fig(output_dir, f"{name_prefix}_corr_{method}")
+    heatmap = {"matrix": _matrix_source(corr), "kind": "corr", "title": f"Correlation Matrix ({method.title()})",
+               "output_dir": output_dir, "filename_prefix": f"{name_prefix}_corr_{method}"}
+    plot_file = render_matrix_heatmap(**heatmap) if render else None
 
     # Save CSV
     csv_file = _save_csv(output_dir, f"{name_prefix}_corr_{method}", corr)
 
+    # Significance: pairwise n and p-values
+    pvalues_file = n_file = None
+    if significance:
+        n_obs = _pairwise_counts(data) if n_obs is None else n_obs
+        if pvalues is None:
+            pvalues = correlation_pvalues(corr, n_obs, name_prefix=f"{name_prefix}_{method}")
+        pvalues_file = _save_csv(output_dir, f"{name_prefix}_corr_{method}_pvalues", pvalues)
+        n_file = _save_csv(output_dir, f"{name_prefix}_corr_{method}_n", n_obs)
+    else:
+        pvalues = n_obs = None
+
     # Top pairs (absolute value)
-    pairs = []
-    for i in range(len(columns)):
-        for j in range(i+1, len(columns)):
-            pairs.append((columns[i], columns[j], float(corr.iloc[i, j])))
-    # sort by absolute correlation desc
-    pairs_sorted = sorted(pairs, key=lambda x: abs(x[2]), reverse=True)
-    top_pairs = pairs_sorted[:10]
+    pairs_file, n_pairs = None, None
+    if pairs_csv:
+        pairs_file, n_pairs = _save_pairs_csv(output_dir, f"{name_prefix}_corr_{method}_pairs", corr, pair_threshold)
+    best_pairs = top_pairs(corr, k=top_k, threshold=pair_threshold)
+
+    # Everything is written; an unrendered heatmap keeps its matrix file for the renderer
+    _discard(pvalues, *([corr] if render else []))
 
     return {
         "matrix": corr,
-        "matrix_html": corr.to_html(classes="table table-striped table-sm", float_format=lambda x: f"{x:.4f}"),
+        "matrix_html": _matrix_html(corr),
         "plot": plot_file,
+        "heatmap_args": heatmap,
         "csv": csv_file,
-        "top_pairs": top_pairs,
+        "pvalues": pvalues,
+        "pairwise_n": n_obs,
+        "pvalues_csv": pvalues_file,
+        "n_csv": n_file,
+        "top_pairs": best_pairs,
+        "pairs_csv": pairs_file,
+        "n_pairs": n_pairs,
+        "pair_threshold": pair_threshold,
+        "update": update,
         "method": method,
         "na_policy": handle_na
     }
 
 
-def compute_covariance(df, columns, ddof=1, handle_na="complete", output_dir="", name_prefix=""):
+def compute_covariance(df, columns, ddof=1, handle_na="complete", output_dir="", name_prefix="", n_jobs=-1,
+                       state_key=None, render=True):
     """
     ddof: 0 for population, 1 for sample (default)
     handle_na: 'complete' (drop rows with any NA) or 'pairwise' (cov with pairwise NA handling)
     Note: pandas cov already uses pairwise complete observations by default.
+    NA-free data goes through the blocked engine, as in compute_correlation,
+    or the incrementally maintained co-moments when a state_key is given.
+    render: as in compute_correlation.
     """
     data = df[columns].copy()
 
     if handle_na == "complete":
         data = data.dropna()
 
-    cov = data.cov(ddof=ddof)
+    update = None
+    if data.isna().to_numpy().any():
+        cov = data.cov(ddof=ddof)
+    elif state_key is not None and len(columns) < MEMMAP_COLUMNS:
+        cov, update = incremental_matrix(data, state_key, kind="cov", ddof=ddof, n_jobs=n_jobs)
+    else:
+        cov = blocked_matrix(data, kind="cov", ddof=ddof, name_prefix=name_prefix, n_jobs=n_jobs)
 
     # Heatmap (no diverging cmap; covariance not bounded)
-    plt.figure(figsize=(min(1.1*len(columns), 14), min(1.1*len(columns), 14)))
-    sns.heatmap(cov, cmap="YlGnBu", annot=len(columns) <= 15, fmt=".2f",
-                square=True, linewidths=.5, cbar_kws={"shrink": .8})
-    plt.title(f"Covariance Matrix (ddof={ddof})")
-    plot_file = _save_fig(output_dir, f"{name_prefix}_cov_ddof{ddof}")
+    heatmap = {"matrix": _matrix_source(cov), "kind": "cov", "title": f"Covariance Matrix (ddof={ddof})",
+               "output_dir": output_dir, "filename_prefix": f"{name_prefix}_cov_ddof{ddof}"}
+    plot_file = render_matrix_heatmap(**heatmap) if render else None
 
     # Save CSV
     csv_file = _save_csv(output_dir, f"{name_prefix}_cov_ddof{ddof}", cov)
+    if render:
+        _discard(cov)
 
     return {
         "matrix": cov,
-        "matrix_html": cov.to_html(classes="table table-striped table-sm", float_format=lambda x: f"{x:.4f}"),
+        "matrix_html": _matrix_html(cov),
         "plot": plot_file,
+        "heatmap_args": heatmap,
         "csv": csv_file,
         "ddof": ddof,
+        "update": update,
         "na_policy": handle_na
     }
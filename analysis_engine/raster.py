@@ -0,0 +1,96 @@
+# analysis_engine/raster.py
+
+import numpy as np
+import pandas as pd
+import matplotlib
+from matplotlib import colors as mcolors
+import seaborn as sns
+from scipy.ndimage import maximum_filter
+
+RASTER_THRESHOLD = 50_000   # scatter plots with more points than this are drawn as a raster
+RASTER_SHAPE = (500, 700)   # pixel grid (rows, columns) the points are binned into
+
+
+def should_rasterize(n_points):
+    return n_points > RASTER_THRESHOLD
+
+
+def _bounds(values, pad=0.02):
+    lo, hi = float(np.min(values)), float(np.max(values))
+    span = hi - lo if hi > lo else 1.0
+    return lo - pad * span, hi + pad * span
+
+
+def raster_scatter(ax, x, y, categories=None, palette=None, cmap="Greys", shape=RASTER_SHAPE,
+                   spread=0, zorder=1, label=None, order=None):
+    """
+    Draw a point cloud as an aggregated image instead of one marker per point.
+
+    Points are binned into a `shape` pixel grid (one bincount pass), then:
+      - without categories: pixels are shaded by log point density with `cmap`
+      - with categories: pixel color is the count-weighted mix of the category
+        colors (`palette`, a list of colors or a seaborn/matplotlib palette name)
+        and opacity follows log density. Colors go to the categories in
+        `order` (like seaborn's hue_order); by default numbers are sorted and
+        other labels keep their order of first appearance, as seaborn does
+    `spread` grows every occupied pixel by that many pixels, which keeps
+    isolated points or a few discrete positions visible. The image is
+    composited into `ax` with imshow, so render time depends on the grid size,
+    not on the number of points. Legend entries are added as empty proxy
+    markers. Returns the AxesImage.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n_rows, n_cols = shape
+    xmin, xmax = _bounds(x)
+    ymin, ymax = _bounds(y)
+
+    ix = np.clip(((x - xmin) / (xmax - xmin) * n_cols).astype(np.intp), 0, n_cols - 1)
+    iy = np.clip(((y - ymin) / (ymax - ymin) * n_rows).astype(np.intp), 0, n_rows - 1)
+    pixel = iy * n_cols + ix
+
+    if categories is None:
+        counts = np.bincount(pixel, minlength=n_rows * n_cols).reshape(n_rows, n_cols)
+        if spread:
+            counts = maximum_filter(counts, size=2 * spread + 1)
+        density = np.log1p(counts)
+        rgba = matplotlib.colormaps[cmap](0.25 + 0.75 * density / max(density.max(), 1e-12))
+        rgba[..., 3] = counts > 0
+        if label:
+            ax.scatter([], [], color=matplotlib.colormaps[cmap](0.8), label=label)
+    else:
+        levels = _category_order(categories, order)
+        codes = pd.Categorical(categories, categories=levels).codes
+        keep = codes >= 0  # categories left out of `order` are not drawn
+        pixel, codes = pixel[keep], codes[keep]
+        colors = _palette(palette, len(levels))
+        present = np.bincount(codes, minlength=len(levels)) > 0
+        counts = np.bincount(pixel * len(levels) + codes,
+                             minlength=n_rows * n_cols * len(levels)).reshape(n_rows, n_cols, len(levels))
+        if spread:
+            counts = maximum_filter(counts, size=(2 * spread + 1, 2 * spread + 1, 1))
+        total = counts.sum(axis=-1)
+        rgb = (counts @ colors) / np.maximum(total, 1)[..., None]
+        density = np.log1p(total)
+        alpha = np.where(total > 0, 0.35 + 0.65 * density / max(density.max(), 1e-12), 0.0)
+        rgba = np.dstack([rgb, alpha])
+        for level, color, shown in zip(levels, colors, present):
+            if shown:
+                ax.scatter([], [], color=color, label=str(level))
+
+    image = ax.imshow(rgba, extent=(xmin, xmax, ymin, ymax), origin="lower", aspect="auto",
+                      interpolation="nearest", zorder=zorder)
+    return image
+
+
+def _category_order(categories, order=None):
+    if order is not None:
+        return list(order)
+    levels = pd.unique(np.asarray(categories))
+    return list(np.sort(levels) if np.issubdtype(levels.dtype, np.number) else levels)
+
+
+def _palette(palette, n):
+    if palette is None or isinstance(palette, str):
+        palette = sns.color_palette(palette or "tab10", n)
+    return np.array([mcolors.to_rgb(c) for c in palette[:n]])
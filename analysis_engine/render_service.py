@@ -0,0 +1,157 @@
+# analysis_engine/render_service.py
+
+import os
+import json
+import uuid
+import time
+import signal
+import importlib
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, BrokenExecutor
+
+from analysis_engine import cache
+
+# Charts render in a local process pool so a slow figure never holds up a request.
+RENDER_WORKERS = int(os.environ.get("RENDER_WORKERS", min(4, os.cpu_count() or 1)))
+RENDER_QUEUE_MAX = int(os.environ.get("RENDER_QUEUE_MAX", 32))  # jobs queued or running before submit refuses
+RENDER_TIMEOUT = int(os.environ.get("RENDER_TIMEOUT", 120))     # seconds a single chart may take
+RENDER_STATUS_TTL = int(os.environ.get("RENDER_STATUS_TTL", 3600))  # seconds a finished job can still be polled
+
+# Chart specs name one of these renderers; each is called as fn(**args) and returns the image filename.
+RENDERERS = {
+    "matrix_heatmap": "analysis_engine.matrix_tools:render_matrix_heatmap",
+    "pca_plot": "analysis_engine.dimensionality:render_pca_plot",
+    "figure": "analysis_engine.figures:render_figure",
+    "plotly": "analysis_engine.figures:render_plotly",
+}
+
+_executor = None
+_pending = {}
+_lock = threading.Lock()
+
+
+def _status_path(job_id):
+    return os.path.join(cache.CACHE_DIR, "render_jobs", f"{job_id}.json")
+
+
+def _write_status(path, status):
+    """Job status lives in a small JSON file so any server process can answer a poll."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(status, f)
+    os.replace(tmp_path, path)
+
+
+def _prune_status(ttl=None):
+    """Remove job status files untouched for longer than ttl (RENDER_STATUS_TTL) seconds."""
+    ttl = RENDER_STATUS_TTL if ttl is None else ttl
+    folder = os.path.join(cache.CACHE_DIR, "render_jobs")
+    cutoff = time.time() - ttl
+    try:
+        entries = list(os.scandir(folder))
+    except OSError:
+        return
+    for entry in entries:
+        try:
+            if entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+        except OSError:
+            pass  # already removed by another server process
+
+
+def _timed_out(signum, frame):
+    raise TimeoutError("Rendering took too long and was stopped.")
+
+
+def _run_job(status_path, target, args, timeout):
+    """Runs inside a pool worker: mark the job running, resolve the renderer and call it under a SIGALRM deadline."""
+    _write_status(status_path, {"state": "running", "started": time.time()})
+    module_name, func_name = target.split(":")
+    func = getattr(importlib.import_module(module_name), func_name)
+    use_alarm = timeout and hasattr(signal, "SIGALRM")
+    if use_alarm:
+        signal.signal(signal.SIGALRM, _timed_out)
+        signal.alarm(timeout)
+    try:
+        return func(**args)
+    finally:
+        if use_alarm:
+            signal.alarm(0)
+
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            # spawn: forking a threaded web server is not safe
+            _executor = ProcessPoolExecutor(max_workers=RENDER_WORKERS,
+                                            mp_context=multiprocessing.get_context("spawn"))
+        return _executor
+
+
+def _drop_executor(broken):
+    """Forget a pool that lost a worker (it refuses every later job); the next submit starts a new one."""
+    global _executor
+    with _lock:
+        if _executor is broken:
+            _executor = None
+    broken.shutdown(wait=False, cancel_futures=True)
+
+
+def submit(renderer, timeout=RENDER_TIMEOUT, **args):
+    """
+    Queue a chart for rendering and return its job id right away.
+    `args` are passed to the renderer and must be picklable (large matrices
+    should be passed as a file path). Raises RuntimeError when
+    RENDER_QUEUE_MAX jobs are already waiting or running, or when the pool
+    cannot take the job.
+    """
+    if renderer not in RENDERERS:
+        raise ValueError(f"Unknown renderer '{renderer}'.")
+    with _lock:
+        for done in [job for job, future in _pending.items() if future.done()]:
+            del _pending[done]
+        if len(_pending) >= RENDER_QUEUE_MAX:
+            raise RuntimeError("The rendering queue is full; please try again in a moment.")
+
+    _prune_status()
+    job_id = uuid.uuid4().hex
+    path = _status_path(job_id)
+    # written before the job can start, so a worker's "running" is never overwritten
+    _write_status(path, {"state": "queued", "submitted": time.time()})
+    future = None
+    for _ in range(2):  # a broken pool is replaced once
+        executor = _get_executor()
+        try:
+            future = executor.submit(_run_job, path, RENDERERS[renderer], args, timeout)
+            break
+        except BrokenExecutor:
+            _drop_executor(executor)
+    if future is None:
+        _write_status(path, {"state": "failed", "error": "The rendering service is unavailable."})
+        raise RuntimeError("The rendering service is unavailable; please try again in a moment.")
+    with _lock:
+        _pending[job_id] = future
+
+    def _finished(f):
+        error = f.exception()
+        if error is None:
+            _write_status(path, {"state": "done", "plot": f.result()})
+        else:
+            _write_status(path, {"state": "failed", "error": str(error) or type(error).__name__})
+
+    future.add_done_callback(_finished)
+    return job_id
+
+
+def status(job_id):
+    """{'state': 'queued' | 'running' | 'done' | 'failed', 'plot': filename when done, 'error': message when failed}"""
+    if not job_id.isalnum():
+        raise ValueError("Invalid job id.")
+    try:
+        with open(_status_path(job_id), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        raise ValueError("Unknown render job.")
@@ -2,16 +2,46 @@
 
 import os
 import io
+import re
+import math
+import warnings
 import numpy as np
 import pandas as pd
+from joblib import Parallel, delayed, effective_n_jobs, parallel_config
+from pandas.api.types import is_datetime64_any_dtype, is_numeric_dtype
+from pandas.tseries.api import guess_datetime_format
 
-import matplotlib
-matplotlib.use("Agg")  # headless
-import matplotlib.pyplot as plt
 
-from statsmodels.tsa.seasonal import seasonal_decompose
+from scipy.ndimage import minimum_filter1d, maximum_filter1d
+from scipy.signal import detrend
+from scipy import stats as sps
+from statsmodels.tsa.seasonal import seasonal_decompose, STL
 from statsmodels.tsa.holtwinters import ExponentialSmoothing
 from statsmodels.tsa.arima.model import ARIMA
+from statsmodels.tsa.exponential_smoothing.ets import ETSModel
+from statsmodels.tsa.stattools import adfuller
+
+from analysis_engine import cache
+from analysis_engine.figures import subplots, save_figure
+
+DATE_FORMAT_SAMPLE = 500 # values checked when detecting a date column's format
+ARIMA_MAX_P = 3          # default upper bound of the AR order searched by run_arima_auto
+ARIMA_MAX_Q = 3          # default upper bound of the MA order
+ARIMA_MAX_D = 2          # differencing is increased until the ADF test rejects a unit root, up to this
+ARIMA_PATIENCE = 1       # complexity waves without improvement before the order search stops
+BATCH_OVERVIEW_MAX = 9   # series shown in the batch-forecast overview grid
+BACKTEST_ORIGINS = 10    # default number of rolling forecast origins
+PERIOD_MIN_ACF = 0.1     # autocorrelation a periodogram peak needs at its lag to count as a season
+PERIOD_MIN_POWER = 0.05  # secondary periods need this share of the main period's spectral power
+ROLLING_WINDOWS = (3, 6, 12, 24)
+ROLLING_STATS = ("mean", "std", "min", "max", "ewma")
+ROLLING_CHUNK = 4_096    # rows per restart of the cumulative sums behind rolling mean / std
+PLOT_MAX_POINTS = 5_000  # line charts of long series are thinned to about this many points
+DRIFT_THRESHOLD = 2.0    # new-data RMSE / in-sample RMSE above which a stored model is refit
+ANOMALY_WINDOW = 30      # trailing window of the rolling robust z-score
+ANOMALY_THRESHOLD = 3.5  # |robust z| above which a point is flagged (Iglewicz-Hoaglin)
+ANOMALY_MAX_SHARE = 0.05 # S-H-ESD tests at most this share of the points
+MAD_SCALE = 1.4826       # MAD -> standard deviation under normality
 
 
 # ------------------------
@@ -21,15 +51,79 @@ def _ensure_dir(path):
     os.makedirs(path, exist_ok=True)
     return path
 
-def _save_fig(output_dir, filename_prefix):
+def _save_fig(fig, output_dir, filename_prefix):
     _ensure_dir(output_dir)
     filename = f"{filename_prefix}.png"
     outpath = os.path.join(output_dir, filename)
-    plt.tight_layout()
-    plt.savefig(outpath, bbox_inches="tight")
-    plt.close()
+    save_figure(fig, outpath, tight=True, bbox_inches="tight")
     return filename
 
+def _detect_date_format(values):
+    """
+    Guess one strftime format for a whole date column.
+    Candidates are guessed from a few values (month-first and day-first) and
+    the first one that parses an evenly spaced sample without failures wins.
+    Returns None when no single format fits (mixed formats).
+    """
+    sample = values.dropna().astype(str)
+    if sample.empty:
+        return None
+    sample = sample.iloc[::max(1, len(sample) // DATE_FORMAT_SAMPLE)]
+    candidates = []
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        for value in sample.iloc[:10]:
+            for dayfirst in (False, True):
+                fmt = guess_datetime_format(value, dayfirst=dayfirst)
+                if fmt and fmt not in candidates:
+                    candidates.append(fmt)
+    for fmt in candidates:
+        if pd.to_datetime(sample, format=fmt, errors="coerce").notna().all():
+            return fmt
+    return None
+
+
+def _is_year_column(values):
+    """Whole numbers between 1000 and 9999 (e.g. a 'year' column of 2021, 2022, ...)."""
+    if not is_numeric_dtype(values) or values.empty:
+        return False
+    numbers = values.to_numpy(dtype=float)
+    return bool(((numbers % 1 == 0) & (numbers >= 1000) & (numbers <= 9999)).all())
+
+
+def parse_dates(values: pd.Series):
+    """
+    Parse a date column, cached per column version.
+    Only the distinct strings are parsed (dates repeat a lot in long tables),
+    with one format detected up front instead of per-row inference. The
+    parsed column is cached under the column's content fingerprint, so later
+    requests on the same data skip parsing entirely.
+    Returns (parsed Series, fingerprint of the raw column).
+    """
+    key = cache.fingerprint(values)
+    if is_datetime64_any_dtype(values):
+        return values, key
+    parsed = cache.load("ts_dates", key)
+    if parsed is None:
+        codes, uniques = pd.factorize(values)
+        uniques = pd.Series(uniques)
+        if _is_year_column(uniques):
+            # plain years: pd.to_datetime would read 2021 as 2021 ns after the epoch
+            uniques, fmt = uniques.astype(int).astype(str), "%Y"
+        elif is_numeric_dtype(uniques):
+            fmt = None  # other numbers keep pd.to_datetime's own meaning (epoch offsets)
+        else:
+            fmt = _detect_date_format(uniques)
+        if fmt:
+            parsed_uniques = pd.to_datetime(uniques, format=fmt, errors="coerce")
+        else:
+            parsed_uniques = pd.to_datetime(uniques, errors="coerce")
+        parsed = pd.Series(pd.DatetimeIndex(parsed_uniques).take(codes, allow_fill=True, fill_value=pd.NaT),
+                           index=values.index, name=values.name)
+        cache.save("ts_dates", key, parsed)
+    return parsed, key
+
+
 def prepare_series(df, date_col, value_col, freq=None, agg="mean"):
     """
     - Parses date column
@@ -37,10 +131,16 @@ def prepare_series(df, date_col, value_col, freq=None, agg="mean"):
     - Groups duplicates (by agg)
     - Optional resampling to given freq ('D','M','Q','Y')
     Returns a clean pandas Series with DateTimeIndex
+    The result is memoized per (date column, value column, agg, freq) and
+    data version, so re-running another method on the same series is free.
     """
-    s = df[[date_col, value_col]].copy()
-    # Parse dates
-    s[date_col] = pd.to_datetime(s[date_col], errors="coerce")
+    dates, date_key = parse_dates(df[date_col])
+    series_key = cache.fingerprint(date_key, df[value_col], agg, freq)
+    cached = cache.load("ts_series", series_key)
+    if cached is not None:
+        return cached.copy()  # callers may modify their series; the cached one is shared
+
+    s = pd.DataFrame({date_col: dates, value_col: df[value_col]})
     s = s.dropna(subset=[date_col, value_col])
     s = s.sort_values(by=date_col)
     # Aggregate duplicates on same date
@@ -59,7 +159,202 @@ def prepare_series(df, date_col, value_col, freq=None, agg="mean"):
 
     # drop missing after resample
     s = s.dropna()
-    return s
+    cache.save("ts_series", series_key, s)
+    return s.copy()
+
+
+def prepare_panel(df, date_col, value_cols, group_col=None, freq=None, agg="mean"):
+    """
+    Vectorized prepare_series for many series at once.
+    Dates are parsed once, duplicates are aggregated and (optionally)
+    resampled with one groupby over all value columns / groups, and the
+    result is split into a dict {series name: clean Series}. Each series
+    matches prepare_series run on its own group's rows.
+    Series are named after the value column, prefixed with the group when
+    `group_col` is given (e.g. "North | sales").
+    """
+    value_cols = list(value_cols)
+    if not value_cols:
+        raise ValueError("Select at least one value column.")
+    group_keys = [group_col] if group_col else []
+
+    s = df[[date_col] + group_keys + value_cols].copy()
+    s[date_col] = parse_dates(df[date_col])[0]
+    s = s.dropna(subset=[date_col])
+    grouped = s.groupby(group_keys + [date_col])[value_cols]
+    # a date whose values are all missing stays missing (plain sum would make it 0)
+    wide = grouped.sum(min_count=1) if agg == "sum" else grouped.agg(agg)
+
+    if freq:
+        # second pass resamples every group with the same aggregation; unlike a
+        # pd.Grouper, resample keeps empty bins (0 for sum, NaN otherwise) so each
+        # group stays on a regular index from its first to its last period
+        if group_col:
+            wide = wide.groupby(level=group_col).resample(freq, level=date_col).agg(agg)
+        else:
+            wide = wide.resample(freq).agg(agg)
+
+    panel = {}
+    if group_col:
+        for group, block in wide.groupby(level=0, sort=True):
+            block = block.droplevel(0)
+            for col in value_cols:
+                series = block[col].dropna()
+                if len(series):
+                    panel[f"{group} | {col}"] = series.rename(col)
+    else:
+        for col in value_cols:
+            series = wide[col].dropna()
+            if len(series):
+                panel[col] = series
+    return panel
+
+
+# ------------------------
+# Seasonal period detection
+# ------------------------
+def _acf_fft(X, max_lag):
+    """Autocorrelation of every row of X up to max_lag, via zero-padded FFT."""
+    n = X.shape[1]
+    size = 1 << int(np.ceil(np.log2(2 * n)))
+    spectrum = np.fft.rfft(X, n=size, axis=1)
+    acov = np.fft.irfft(spectrum * np.conj(spectrum), n=size, axis=1)[:, :max_lag + 1]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return acov / acov[:, :1]
+
+
+def _periods_2d(X, max_period=None, top_k=3, min_acf=PERIOD_MIN_ACF):
+    """
+    Detect seasonal periods for every row of X (equal-length series).
+    Rows are linearly detrended, windowed (Hann) and transformed with one
+    batched rFFT; periodogram peaks between 2 and max_period are turned
+    into candidate periods, refined to the strongest autocorrelation lag
+    within +/-10%, and kept when that lag is a local ACF peak above both
+    min_acf and the 99% white-noise band (2.58 / sqrt(n)). Secondary periods
+    also need PERIOD_MIN_POWER of the strongest accepted peak's power, which
+    drops spurious low-frequency / harmonic picks but keeps real nested
+    seasons (e.g. 24 and 168 on hourly data).
+    Returns one list per row of {period, power, acf}, strongest first.
+    """
+    X = detrend(np.asarray(X, dtype=float), axis=1)
+    n_series, n = X.shape
+    max_period = int(min(max_period or n // 2, n // 2))
+    if max_period < 2:
+        return [[] for _ in range(n_series)]
+
+    power = np.abs(np.fft.rfft(X * np.hanning(n), axis=1)) ** 2
+    power[:, 0] = 0
+    share = power / np.maximum(power.sum(axis=1, keepdims=True), 1e-300)
+    freqs = np.fft.rfftfreq(n)
+    with np.errstate(divide="ignore"):
+        bin_period = np.where(freqs > 0, 1 / freqs, np.inf)
+
+    # local maxima of the periodogram inside the admissible period range
+    peaks = np.zeros_like(power, dtype=bool)
+    peaks[:, 1:-1] = (power[:, 1:-1] > power[:, :-2]) & (power[:, 1:-1] >= power[:, 2:])
+    peaks &= (bin_period >= 2) & (bin_period <= max_period)
+    scored = np.where(peaks, share, 0.0)
+    n_candidates = min(3 * top_k, scored.shape[1])
+    candidates = np.argsort(-scored, axis=1)[:, :n_candidates]
+
+    acf = _acf_fft(X, max_period + 1)
+    threshold = max(min_acf, 2.58 / np.sqrt(n))
+    detected = []
+    for row in range(n_series):
+        found = []
+        for b in candidates[row]:
+            if scored[row, b] <= 0:
+                break
+            guess = bin_period[b]
+            lo = max(2, int(np.floor(guess * 0.9)))
+            hi = min(max_period, int(np.ceil(guess * 1.1)))
+            if hi < lo:
+                continue
+            lag = lo + int(np.argmax(acf[row, lo:hi + 1]))
+            r = float(acf[row, lag])
+            if r < threshold or acf[row, lag - 1] >= r or acf[row, lag + 1] > r:
+                continue
+            if found and scored[row, b] < PERIOD_MIN_POWER * found[0]["power"]:
+                break
+            if any(abs(lag - f["period"]) <= 0.1 * f["period"] for f in found):
+                continue
+            found.append({"period": lag, "power": float(scored[row, b]), "acf": r})
+            if len(found) == top_k:
+                break
+        detected.append(found)
+    return detected
+
+
+def detect_periods(series: pd.Series, max_period: int = None, top_k: int = 3, min_acf: float = PERIOD_MIN_ACF):
+    """Dominant seasonal periods of one series (see _periods_2d), strongest first."""
+    values = series.to_numpy(dtype=float)
+    if len(values) < 8:
+        return []
+    return _periods_2d(values[None, :], max_period, top_k, min_acf)[0]
+
+
+def detect_periods_batch(panel: dict, max_period: int = None, top_k: int = 3, min_acf: float = PERIOD_MIN_ACF):
+    """
+    detect_periods for a whole panel {name: Series}. Series of the same
+    length are stacked and go through the FFTs together.
+    """
+    by_length = {}
+    for name, series in panel.items():
+        by_length.setdefault(len(series), []).append(name)
+
+    detected = {}
+    for n, names in by_length.items():
+        if n < 8:
+            detected.update({name: [] for name in names})
+            continue
+        X = np.vstack([panel[name].to_numpy(dtype=float) for name in names])
+        detected.update(zip(names, _periods_2d(X, max_period, top_k, min_acf)))
+    return detected
+
+
+def _auto_period(series):
+    found = detect_periods(series)
+    if not found:
+        raise ValueError("No seasonal period could be detected; please enter one.")
+    return found[0]["period"]
+
+
+def run_period_detection(series: pd.Series, max_period: int = None, top_k: int = 3,
+                         output_dir: str = "", name_prefix: str = ""):
+    """Detect seasonal periods and plot the periodogram and autocorrelation with the picks marked."""
+    found = detect_periods(series, max_period=max_period, top_k=top_k)
+    values = detrend(series.to_numpy(dtype=float))
+    n = len(values)
+    if n < 8:
+        raise ValueError("Not enough data points to detect seasonality.")
+    limit = int(min(max_period or n // 2, n // 2))
+
+    power = np.abs(np.fft.rfft(values * np.hanning(n))) ** 2
+    freqs = np.fft.rfftfreq(n)
+    keep = (freqs > 0) & (1 / np.maximum(freqs, 1e-12) <= limit)
+    acf = _acf_fft(values[None, :], limit)[0]
+
+    fig, (ax1, ax2) = subplots(2, 1, figsize=(10, 7))
+    ax1.semilogx(1 / freqs[keep], power[keep] / power[keep].sum(), color="tab:blue")
+    ax1.set_xlabel("Period (observations)")
+    ax1.set_ylabel("Share of power")
+    ax1.set_title("Periodogram")
+    ax2.bar(np.arange(len(acf)), acf, width=0.8, color="tab:gray")
+    ax2.set_xlabel("Lag")
+    ax2.set_ylabel("ACF")
+    ax2.set_title("Autocorrelation")
+    for f in found:
+        ax1.axvline(f["period"], color="tab:red", linestyle="--", alpha=0.7)
+        ax2.axvline(f["period"], color="tab:red", linestyle="--", alpha=0.7)
+        ax2.annotate(str(f["period"]), (f["period"], f["acf"]), textcoords="offset points",
+                     xytext=(4, 4), color="tab:red")
+    filename = _save_fig(fig, output_dir, f"{name_prefix}_periods")
+
+    return {
+        "plot": filename,
+        "periods": found,
+        "period": found[0]["period"] if found else None
+    }
 
 
 # ------------------------
@@ -73,14 +368,14 @@ def moving_average(series: pd.Series, window: int, output_dir: str, name_prefix:
 
     ma = series.rolling(window=window, min_periods=1).mean()
 
-    plt.figure(figsize=(10, 5))
-    plt.plot(series.index, series.values, label="Original")
-    plt.plot(ma.index, ma.values, label=f"Moving Average (window={window})")
-    plt.title("Moving Average")
-    plt.xlabel("Date")
-    plt.ylabel("Value")
-    plt.legend()
-    filename = _save_fig(output_dir, f"{name_prefix}_moving_avg")
+    fig, ax = subplots(figsize=(10, 5))
+    ax.plot(series.index, series.values, label="Original")
+    ax.plot(ma.index, ma.values, label=f"Moving Average (window={window})")
+    ax.set_title("Moving Average")
+    ax.set_xlabel("Date")
+    ax.set_ylabel("Value")
+    ax.legend()
+    filename = _save_fig(fig, output_dir, f"{name_prefix}_moving_avg")
 
     return {
         "plot": filename,
@@ -89,40 +384,253 @@ def moving_average(series: pd.Series, window: int, output_dir: str, name_prefix:
     }
 
 
+# ------------------------
+# Rolling features (several windows / statistics at once)
+# ------------------------
+def _window_moments(x, window, chunk):
+    """
+    Trailing-window sum, sum of squares and count for every position, from
+    cumulative sums. The cumulative sums are restarted every `chunk` rows
+    (each chunk re-reads the `window - 1` rows before it and is centred on
+    its own mean), which keeps rounding error bounded on long series.
+    Partial windows at the start only count the available rows.
+    """
+    n = len(x)
+    lead = window - 1
+    n_chunks = -(-n // chunk)
+    padded = np.zeros(lead + n_chunks * chunk)
+    valid = np.zeros(len(padded), dtype=bool)
+    padded[lead:lead + n] = x
+    valid[lead:lead + n] = True
+
+    # rows = chunks, each prefixed with the `lead` values before it
+    starts = np.arange(n_chunks) * chunk
+    cols = np.arange(lead + chunk)
+    block = padded[starts[:, None] + cols]
+    mask = valid[starts[:, None] + cols]
+    centre = (block * mask).sum(axis=1, keepdims=True) / np.maximum(mask.sum(axis=1, keepdims=True), 1)
+    centred = np.where(mask, block - centre, 0.0)
+
+    zeros = np.zeros((n_chunks, 1))
+    csum = np.hstack([zeros, np.cumsum(centred, axis=1)])
+    csum_sq = np.hstack([zeros, np.cumsum(centred ** 2, axis=1)])
+    ccount = np.hstack([zeros, np.cumsum(mask, axis=1)])
+
+    total = (csum[:, window:] - csum[:, :-window]).ravel()[:n]
+    total_sq = (csum_sq[:, window:] - csum_sq[:, :-window]).ravel()[:n]
+    count = (ccount[:, window:] - ccount[:, :-window]).ravel()[:n]
+    offset = np.repeat(centre[:, 0], chunk)[:n]
+    return total, total_sq, count, offset
+
+
+def rolling_features(series: pd.Series, windows=ROLLING_WINDOWS, stats=ROLLING_STATS,
+                     output_dir: str = "", name_prefix: str = ""):
+    """
+    Rolling mean / std / min / max / EWMA for several windows in one pass.
+    - mean and std come from chunked cumulative sums (see _window_moments),
+      O(n) per window whatever its size
+    - min and max use scipy's 1-D min/max filters (ascending-minima deque,
+      also O(n) per window)
+    - EWMA uses span = window
+    Windows are trailing with partial windows at the start (min_periods=1,
+    as in moving_average). The feature frame is cached and exported on
+    demand by iter_rolling_csv; the chart has one panel per statistic and
+    long series are thinned for drawing only.
+    """
+    windows = sorted({int(w) for w in windows})
+    stats = [st for st in ROLLING_STATS if st in set(stats)]
+    if not windows or windows[0] < 1:
+        raise ValueError("Windows must be >= 1.")
+    if not stats:
+        raise ValueError("Select at least one statistic.")
+
+    x = series.to_numpy(dtype=float)
+    n = len(x)
+    if n < 2:
+        raise ValueError("Not enough data points for rolling statistics.")
+
+    features = {}
+    for w in windows:
+        if "mean" in stats or "std" in stats:
+            total, total_sq, count, offset = _window_moments(x, w, chunk=max(ROLLING_CHUNK, 4 * w))
+        if "mean" in stats:
+            features[f"mean_{w}"] = total / count + offset
+        if "std" in stats:
+            with np.errstate(divide="ignore", invalid="ignore"):
+                var = (total_sq - total ** 2 / count) / (count - 1)
+            # one-point windows have no sample std (NaN, as in pandas)
+            features[f"std_{w}"] = np.where(count > 1, np.sqrt(np.clip(var, 0, None)), np.nan)
+        if "min" in stats:
+            features[f"min_{w}"] = minimum_filter1d(x, w, origin=(w - 1) // 2, mode="nearest")
+        if "max" in stats:
+            features[f"max_{w}"] = maximum_filter1d(x, w, origin=(w - 1) // 2, mode="nearest")
+        if "ewma" in stats:
+            features[f"ewma_{w}"] = series.ewm(span=w).mean().to_numpy()
+    frame = pd.DataFrame(features, index=series.index)
+    cache_key = cache.fingerprint(series, windows, stats)
+    cache.save("rolling", cache_key, frame)
+
+    stride = max(1, int(np.ceil(n / PLOT_MAX_POINTS)))
+    idx = series.index[::stride]
+    fig, axes = subplots(len(stats), 1, figsize=(11, 2.6 * len(stats)), sharex=True, squeeze=False)
+    for ax, stat in zip(axes[:, 0], stats):
+        if stat != "std":
+            ax.plot(idx, x[::stride], color="lightgray", linewidth=1, label="Original")
+        for w in windows:
+            ax.plot(idx, frame[f"{stat}_{w}"].to_numpy()[::stride], linewidth=1.2, label=f"w={w}")
+        ax.set_ylabel(stat.upper() if stat == "ewma" else stat.capitalize())
+        ax.legend(loc="upper left", fontsize=8, ncol=len(windows) + 1)
+    axes[0, 0].set_title(f"Rolling Statistics (windows {', '.join(map(str, windows))})")
+    axes[-1, 0].set_xlabel("Date")
+    filename = _save_fig(fig, output_dir, f"{name_prefix}_rolling")
+
+    return {
+        "plot": filename,
+        "cache_key": cache_key,
+        "windows": windows,
+        "stats": stats,
+        "n_points": n,
+        "latest": {col: (float(v) if np.isfinite(v) else None) for col, v in frame.iloc[-1].items()},
+    }
+
+
+def iter_rolling_csv(cache_key, chunk_rows=100_000):
+    """Yield a cached rolling-feature frame as CSV text, a block of rows at a time."""
+    frame = cache.load("rolling", cache_key)
+    if frame is None:
+        raise ValueError("Rolling features not found; run the analysis again.")
+    for start in range(0, len(frame), chunk_rows):
+        yield frame.iloc[start:start + chunk_rows].to_csv(header=start == 0, index_label="date")
+
+
+# ------------------------
+# Persisted models
+# ------------------------
+def _stored_model(model_key, spec, series):
+    """
+    Load the persisted model for (model_key, spec) and split off the rows
+    appended since it was saved. Returns (cache key, state, new_rows); state
+    and new_rows are None when nothing usable is stored: no model yet, or the stored history is no
+    longer a prefix of the series (past values were edited).
+    """
+    key = cache.fingerprint(model_key, spec)
+    state = cache.load("ts_models", key)
+    if state is None:
+        return key, None, None
+    n = state["n_obs"]
+    if n > len(series) or cache.fingerprint(series.iloc[:n]) != state["fingerprint"]:
+        return key, None, None
+    return key, state, series.iloc[n:]
+
+
+def _drift(errors, scale):
+    """RMSE of the one-step-ahead errors on new data relative to the in-sample residual scale."""
+    errors = np.asarray(errors, dtype=float)
+    errors = errors[np.isfinite(errors)]
+    if len(errors) == 0 or not scale:
+        return 0.0
+    return float(np.sqrt(np.mean(errors ** 2)) / scale)
+
+
 # ------------------------
 # Exponential Smoothing (Holt-Winters)
 # ------------------------
+def _hw_state(fit, series, fitted, seasonal_periods, prior_season=None):
+    """Final level/trend/season of a Holt-Winters fit, i.e. everything needed to continue filtering."""
+    params = fit.params
+    season = None
+    if fit.model.seasonal:
+        # a short update only covers a few periods; the rest of the cycle comes from the prior state
+        season = np.asarray(fit.season)
+        if prior_season is not None:
+            season = np.concatenate([prior_season, season])
+        season = season[-seasonal_periods:]
+    return {
+        "smoothing": {name: params.get(name) for name in
+                      ("smoothing_level", "smoothing_trend", "smoothing_seasonal")},
+        "level": float(fit.level.iloc[-1]),
+        "trend": float(fit.trend.iloc[-1]) if fit.model.trend else None,
+        "season": season,
+        "fitted": np.asarray(fitted, dtype=float),
+        "n_obs": len(series),
+        "fingerprint": cache.fingerprint(series),
+    }
+
+
 def run_exponential_smoothing(series: pd.Series, trend: str = "add", seasonal: str = None,
-                              seasonal_periods: int = None, output_dir: str = "", name_prefix: str = ""):
+                              seasonal_periods: int = None, output_dir: str = "", name_prefix: str = "",
+                              model_key: str = None, refit: bool = False,
+                              drift_threshold: float = DRIFT_THRESHOLD):
     """
     trend: None | 'add' | 'mul'
-    seasonal: None | 'add' | 'mul'
+    seasonal: None | 'add' | 'mul' (seasonal_periods=None detects the period)
+    With a model_key the fitted model is persisted. On later calls, rows
+    appended to the series are filtered through the stored level/trend/season
+    state with the stored smoothing parameters (no re-optimization). A full
+    refit happens when requested, when past values changed, or when the
+    one-step error on the new rows exceeds drift_threshold x the in-sample RMSE.
     """
+    trend = trend if trend != "none" else None
+    seasonal = seasonal if seasonal != "none" else None
     if seasonal and not seasonal_periods:
-        raise ValueError("seasonal_periods is required when seasonal component is specified.")
+        seasonal_periods = _auto_period(series)
+    spec = ("exp_smoothing", trend, seasonal, seasonal_periods)
 
-    model = ExponentialSmoothing(
-        series,
-        trend=trend if trend != "none" else None,
-        seasonal=seasonal if seasonal != "none" else None,
-        seasonal_periods=seasonal_periods
-    )
-    fit = model.fit(optimized=True)
-    fitted = fit.fittedvalues
-
-    plt.figure(figsize=(10, 5))
-    plt.plot(series.index, series.values, label="Original")
-    plt.plot(fitted.index, fitted.values, label="Fitted (Exponential Smoothing)")
-    plt.title("Exponential Smoothing (Holt-Winters)")
-    plt.xlabel("Date")
-    plt.ylabel("Value")
-    plt.legend()
-    filename = _save_fig(output_dir, f"{name_prefix}_exp_smoothing")
+    update = {"mode": "fit", "n_new": len(series), "drift": None}
+    state = None
+    if model_key:
+        key, state, new_rows = _stored_model(model_key, spec, series)
+        if state is not None and not refit:
+            update = {"mode": "reuse", "n_new": len(new_rows), "drift": None}
+            if len(new_rows):
+                with warnings.catch_warnings():
+                    warnings.simplefilter("ignore")
+                    step = ExponentialSmoothing(
+                        new_rows, trend=trend, seasonal=seasonal, seasonal_periods=seasonal_periods,
+                        initialization_method="known", initial_level=state["level"],
+                        initial_trend=state["trend"], initial_seasonal=state["season"]
+                    ).fit(**{k: v for k, v in state["smoothing"].items() if v is not None}, optimized=False)
+                update["drift"] = _drift(new_rows.values - step.fittedvalues.values, state["scale"])
+                if update["drift"] > drift_threshold:
+                    state, update["mode"] = None, "refit (drift)"
+                else:
+                    fitted = np.concatenate([state["fitted"], step.fittedvalues.values])
+                    state = dict(_hw_state(step, series, fitted, seasonal_periods, state["season"]),
+                                 scale=state["scale"], aic=state["aic"])
+                    update["mode"] = "update"
+        elif state is not None:
+            state, update["mode"] = None, "refit"
+
+    if state is None:
+        model = ExponentialSmoothing(
+            series,
+            trend=trend,
+            seasonal=seasonal,
+            seasonal_periods=seasonal_periods
+        )
+        fit = model.fit(optimized=True)
+        aic = getattr(fit, "aic", None)
+        state = dict(_hw_state(fit, series, fit.fittedvalues.values, seasonal_periods),
+                     scale=float(np.sqrt(fit.sse / len(series))),
+                     aic=float(aic) if aic is not None else None)
+    if model_key:
+        cache.save("ts_models", key, state)
+    fitted = pd.Series(state["fitted"], index=series.index)
+
+    fig, ax = subplots(figsize=(10, 5))
+    ax.plot(series.index, series.values, label="Original")
+    ax.plot(fitted.index, fitted.values, label="Fitted (Exponential Smoothing)")
+    ax.set_title("Exponential Smoothing (Holt-Winters)")
+    ax.set_xlabel("Date")
+    ax.set_ylabel("Value")
+    ax.legend()
+    filename = _save_fig(fig, output_dir, f"{name_prefix}_exp_smoothing")
 
-    aic = getattr(fit, "aic", None)
     return {
         "plot": filename,
-        "aic": float(aic) if aic is not None else None
+        "aic": state["aic"],
+        "seasonal_periods": seasonal_periods,
+        "update": update
     }
 
 
@@ -130,63 +638,897 @@ def run_exponential_smoothing(series: pd.Series, trend: str = "add", seasonal: s
 # ARIMA
 # ------------------------
 def run_arima(series: pd.Series, order=(1, 1, 1), forecast_steps: int = 12,
-              output_dir: str = "", name_prefix: str = ""):
+              output_dir: str = "", name_prefix: str = "", model_key: str = None,
+              refit: bool = False, drift_threshold: float = DRIFT_THRESHOLD):
+    """
+    With a model_key the fitted results are persisted; rows appended later
+    are run through the stored state with `extend` (Kalman filter only, no
+    re-optimization). Refits follow the same rules as run_exponential_smoothing.
+    """
     if len(series) < (sum(order) + 3):
         raise ValueError("Not enough data points for the selected ARIMA order.")
 
-    model = ARIMA(series, order=order)
-    fit = model.fit()
+    order = tuple(order)
+    update = {"mode": "fit", "n_new": len(series), "drift": None}
+    state = None
+    if model_key:
+        key, state, new_rows = _stored_model(model_key, ("arima", order), series)
+        if state is not None and not refit:
+            update = {"mode": "reuse", "n_new": len(new_rows), "drift": None}
+            if len(new_rows):
+                with warnings.catch_warnings():
+                    warnings.simplefilter("ignore")
+                    extended = state["results"].extend(new_rows)
+                update["drift"] = _drift(extended.forecasts_error[0], state["scale"])
+                if update["drift"] > drift_threshold:
+                    state, update["mode"] = None, "refit (drift)"
+                else:
+                    state = dict(state, results=extended, n_obs=len(series),
+                                 fingerprint=cache.fingerprint(series))
+                    update["mode"] = "update"
+        elif state is not None:
+            state, update["mode"] = None, "refit"
+
+    if state is None:
+        model = ARIMA(series, order=order)
+        fit = model.fit()
+        burn_in = order[1] + max(order[0], order[2])
+        state = {"results": fit, "aic": float(fit.aic), "n_obs": len(series),
+                 "fingerprint": cache.fingerprint(series),
+                 "scale": float(np.std(np.asarray(fit.resid)[burn_in:]))}
+    if model_key:
+        cache.save("ts_models", key, state)
+
+    fit = state["results"]
     forecast = fit.get_forecast(steps=forecast_steps)
     pred = forecast.predicted_mean
     conf_int = forecast.conf_int()
 
-    plt.figure(figsize=(10, 5))
-    plt.plot(series.index, series.values, label="Observed")
-    plt.plot(pred.index, pred.values, label=f"Forecast ({forecast_steps} steps)")
+    fig, ax = subplots(figsize=(10, 5))
+    ax.plot(series.index, series.values, label="Observed")
+    ax.plot(pred.index, pred.values, label=f"Forecast ({forecast_steps} steps)")
     # Confidence interval shading
-    plt.fill_between(pred.index,
-                     conf_int.iloc[:, 0],
-                     conf_int.iloc[:, 1],
-                     alpha=0.2, label="95% CI")
-    plt.title(f"ARIMA{order} Forecast")
-    plt.xlabel("Date")
-    plt.ylabel("Value")
-    plt.legend()
-    filename = _save_fig(output_dir, f"{name_prefix}_arima")
+    ax.fill_between(pred.index,
+                    conf_int.iloc[:, 0],
+                    conf_int.iloc[:, 1],
+                    alpha=0.2, label="95% CI")
+    ax.set_title(f"ARIMA{order} Forecast")
+    ax.set_xlabel("Date")
+    ax.set_ylabel("Value")
+    ax.legend()
+    filename = _save_fig(fig, output_dir, f"{name_prefix}_arima")
 
     return {
         "plot": filename,
-        "aic": float(fit.aic),
+        "aic": state["aic"],
         "order": list(order),
-        "forecast_steps": forecast_steps
+        "forecast_steps": forecast_steps,
+        "update": update
+    }
+
+
+def _choose_d(values, max_d=ARIMA_MAX_D, alpha=0.05):
+    """Smallest d whose differenced series passes the ADF stationarity test."""
+    x = np.asarray(values, dtype=float)
+    for d in range(max_d + 1):
+        if len(x) < 10 or np.ptp(x) == 0:
+            return d, None
+        pvalue = float(adfuller(x, autolag="AIC")[1])
+        if pvalue < alpha or d == max_d:
+            return d, pvalue
+        x = np.diff(x)
+    return max_d, None
+
+
+def _fit_order(values, order, series_key):
+    """
+    Fit a single ARIMA order in a worker process.
+    Fits are cached by (series fingerprint, order); a cache hit skips the fit.
+    """
+    key = cache.fingerprint(series_key, tuple(order))
+    entry = cache.load("arima_fits", key)
+    if entry is not None:
+        return dict(entry, cached=True)
+
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            fit = ARIMA(values, order=order).fit()
+        entry = {
+            "order": tuple(order),
+            "aic": float(fit.aic),
+            "bic": float(fit.bic),
+            "params": np.asarray(fit.params),
+            "converged": bool(fit.mle_retvals.get("converged", True)) if fit.mle_retvals else True,
+        }
+    except Exception as e:  # numerically hopeless orders just drop out of the ranking
+        entry = {"order": tuple(order), "aic": np.inf, "bic": np.inf, "params": None,
+                 "converged": False, "error": str(e)}
+
+    cache.save("arima_fits", key, entry)
+    return dict(entry, cached=False)
+
+
+def run_arima_auto(series: pd.Series, max_p: int = ARIMA_MAX_P, max_q: int = ARIMA_MAX_Q,
+                   d: int = None, criterion: str = "aic", forecast_steps: int = 12,
+                   output_dir: str = "", name_prefix: str = "", n_jobs: int = -1):
+    """
+    Search the (p, d, q) grid and forecast with the best order.
+    - d is picked with the ADF test unless given explicitly
+    - (p, q) candidates are evaluated in waves of increasing p + q, each wave
+      fitted in parallel worker processes; the search stops once a wave fails
+      to improve the best AIC/BIC (early pruning of the larger orders)
+    - every fit is cached by series fingerprint + order, so resubmitting the
+      form or widening the grid only fits the new orders
+    The winning model is rebuilt from its cached parameters (no refit) for the
+    forecast, and the full leaderboard is written to CSV.
+    """
+    if criterion not in ("aic", "bic"):
+        raise ValueError("criterion must be 'aic' or 'bic'.")
+    max_p, max_q = int(max_p), int(max_q)
+    if max_p < 0 or max_q < 0:
+        raise ValueError("max_p and max_q must be >= 0.")
+
+    values = series.to_numpy(dtype=float)
+    adf_pvalue = None
+    if d is None:
+        d, adf_pvalue = _choose_d(values)
+    d = int(d)
+    series_key = cache.fingerprint(series)
+
+    waves = {}
+    for p in range(max_p + 1):
+        for q in range(max_q + 1):
+            if len(values) >= p + d + q + 3:
+                waves.setdefault(p + q, []).append((p, d, q))
+    if not waves:
+        raise ValueError("Not enough data points for any ARIMA order in the grid.")
+
+    results, best, stale = [], np.inf, 0
+    n_pruned = 0
+    wave_ids = sorted(waves)
+    for i, size in enumerate(wave_ids):
+        # one BLAS thread per worker: the fits are small, the waves provide the parallelism
+        with parallel_config(backend="loky", inner_max_num_threads=1):
+            wave = Parallel(n_jobs=n_jobs)(
+                delayed(_fit_order)(values, order, series_key) for order in waves[size]
+            )
+        results.extend(wave)
+        wave_best = min(r[criterion] for r in wave)
+        if wave_best < best - 1e-6:
+            best, stale = wave_best, 0
+        else:
+            stale += 1
+        if stale >= ARIMA_PATIENCE:
+            n_pruned = sum(len(waves[w]) for w in wave_ids[i + 1:])
+            break
+
+    ranked = sorted(results, key=lambda r: (r[criterion], sum(r["order"])))
+    winner = ranked[0]
+    if winner["params"] is None:
+        raise ValueError("No ARIMA order in the grid could be fitted to this series.")
+    order = winner["order"]
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        fit = ARIMA(series, order=order).filter(winner["params"])
+    forecast = fit.get_forecast(steps=forecast_steps)
+    pred = forecast.predicted_mean
+    conf_int = forecast.conf_int()
+
+    fig, ax = subplots(figsize=(10, 5))
+    ax.plot(series.index, series.values, label="Observed")
+    ax.plot(pred.index, pred.values, label=f"Forecast ({forecast_steps} steps)")
+    ax.fill_between(pred.index,
+                    conf_int.iloc[:, 0],
+                    conf_int.iloc[:, 1],
+                    alpha=0.2, label="95% CI")
+    ax.set_title(f"Auto ARIMA{order} Forecast (best {criterion.upper()})")
+    ax.set_xlabel("Date")
+    ax.set_ylabel("Value")
+    ax.legend()
+    filename = _save_fig(fig, output_dir, f"{name_prefix}_arima_auto")
+
+    leaderboard = [
+        {"order": list(r["order"]), "aic": r["aic"], "bic": r["bic"],
+         "converged": r["converged"], "cached": r["cached"]}
+        for r in ranked
+    ]
+    leaderboard_csv = f"{name_prefix}_arima_leaderboard.csv"
+    pd.DataFrame([
+        {"p": r["order"][0], "d": r["order"][1], "q": r["order"][2], "aic": r["aic"],
+         "bic": r["bic"], "converged": r["converged"], "cached": r["cached"]}
+        for r in ranked
+    ]).to_csv(os.path.join(_ensure_dir(output_dir), leaderboard_csv), index=False)
+
+    return {
+        "plot": filename,
+        "aic": winner["aic"],
+        "bic": winner["bic"],
+        "order": list(order),
+        "criterion": criterion,
+        "forecast_steps": forecast_steps,
+        "adf_pvalue": adf_pvalue,
+        "leaderboard": leaderboard,
+        "leaderboard_csv": leaderboard_csv,
+        "n_evaluated": len(results),
+        "n_cached": sum(r["cached"] for r in results),
+        "n_pruned": n_pruned,
+    }
+
+
+# ------------------------
+# Batch forecasting
+# ------------------------
+def _safe_name(name):
+    return re.sub(r"[^A-Za-z0-9_-]+", "_", str(name)).strip("_") or "series"
+
+
+def _plot_forecast(ax, series, frame, title):
+    ax.plot(series.index, series.values, label="Observed")
+    ax.plot(frame["date"], frame["forecast"], label="Forecast")
+    if frame["lower"].notna().any():
+        ax.fill_between(frame["date"], frame["lower"], frame["upper"], alpha=0.2, label="95% CI")
+    ax.set_title(title)
+
+
+def _forecast_one(name, series, model, order, trend, seasonal_periods, forecast_steps,
+                  output_dir, name_prefix, plot):
+    """Fit one series of the batch and return its forecast rows + summary (worker side)."""
+    summary = {"series": name, "n_obs": int(len(series)), "aic": None, "plot": None, "error": None,
+               "seasonal_periods": seasonal_periods}
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            if model == "arima":
+                if len(series) < (sum(order) + 3):
+                    raise ValueError("not enough data points for the ARIMA order")
+                fit = ARIMA(series, order=order).fit()
+                forecast = fit.get_forecast(steps=forecast_steps)
+                pred = forecast.predicted_mean
+                conf_int = forecast.conf_int()
+                lower, upper = conf_int.iloc[:, 0].values, conf_int.iloc[:, 1].values
+            else:
+                seasonal = "add" if seasonal_periods and len(series) >= 2 * seasonal_periods else None
+                fit = ExponentialSmoothing(
+                    series,
+                    trend=trend if trend != "none" else None,
+                    seasonal=seasonal,
+                    seasonal_periods=seasonal_periods if seasonal else None
+                ).fit(optimized=True)
+                pred = fit.forecast(forecast_steps)
+                lower = upper = np.full(len(pred), np.nan)
+    except Exception as e:  # one bad series should not sink the whole batch
+        summary["error"] = str(e)
+        return None, summary
+
+    aic = getattr(fit, "aic", None)
+    summary["aic"] = float(aic) if aic is not None and np.isfinite(aic) else None
+    frame = pd.DataFrame({"series": name, "date": pred.index, "step": np.arange(1, len(pred) + 1),
+                          "forecast": pred.values, "lower": lower, "upper": upper})
+
+    if plot:
+        fig, ax = subplots(figsize=(10, 5))
+        _plot_forecast(ax, series, frame, f"{name} Forecast ({forecast_steps} steps)")
+        ax.set_xlabel("Date")
+        ax.set_ylabel("Value")
+        ax.legend()
+        summary["plot"] = _save_fig(fig, output_dir, f"{name_prefix}_{_safe_name(name)}_forecast")
+    return frame, summary
+
+
+def run_batch_forecast(panel: dict, model: str = "exp_smoothing", order=(1, 1, 1), trend: str = "add",
+                       seasonal_periods: int = None, forecast_steps: int = 12, output_dir: str = "",
+                       name_prefix: str = "", per_series_plots: bool = False, n_jobs: int = -1):
+    """
+    Forecast every series of a panel (see prepare_panel) in a worker pool.
+    model: 'exp_smoothing' (Holt-Winters; additive seasonality when
+    seasonal_periods is set and the series is long enough) | 'arima' (fixed order).
+    seasonal_periods='auto' detects each series' period in one batched pass.
+    Writes one consolidated forecast CSV (series, date, step, forecast,
+    lower, upper), an overview grid of the first series and, optionally,
+    one plot per series. Series that fail to fit are reported, not raised.
+    """
+    if model not in ("exp_smoothing", "arima"):
+        raise ValueError("model must be 'exp_smoothing' or 'arima'.")
+    if not panel:
+        raise ValueError("No series to forecast.")
+    order = tuple(int(v) for v in order)
+
+    if seasonal_periods == "auto":
+        found = detect_periods_batch(panel, top_k=1)
+        periods = {name: (f[0]["period"] if f else None) for name, f in found.items()}
+    else:
+        periods = dict.fromkeys(panel, seasonal_periods)
+
+    outputs = Parallel(n_jobs=n_jobs)(
+        delayed(_forecast_one)(name, series, model, order, trend, periods[name], forecast_steps,
+                               output_dir, name_prefix, per_series_plots)
+        for name, series in panel.items()
+    )
+    frames = [frame for frame, _ in outputs if frame is not None]
+    summaries = [summary for _, summary in outputs]
+    if not frames:
+        raise ValueError("None of the series could be fitted: " + summaries[0]["error"])
+
+    forecasts = pd.concat(frames, ignore_index=True)
+    forecast_csv = f"{name_prefix}_batch_forecast.csv"
+    forecasts.to_csv(os.path.join(_ensure_dir(output_dir), forecast_csv), index=False)
+
+    # Overview: small multiples of the first successfully fitted series
+    shown = [s["series"] for s in summaries if s["error"] is None][:BATCH_OVERVIEW_MAX]
+    n_cols = min(3, len(shown))
+    n_rows = int(np.ceil(len(shown) / n_cols))
+    fig, axes = subplots(n_rows, n_cols, figsize=(5 * n_cols, 3.2 * n_rows), squeeze=False)
+    by_series = dict(tuple(forecasts.groupby("series", sort=False)))
+    for ax, name in zip(axes.flat, shown):
+        _plot_forecast(ax, panel[name], by_series[name], name)
+        ax.tick_params(axis="x", labelrotation=30, labelsize=8)
+    for ax in axes.flat[len(shown):]:
+        ax.set_visible(False)
+    axes.flat[0].legend(fontsize=8)
+    fig.suptitle(f"Batch Forecast ({len(frames)} of {len(panel)} series, {forecast_steps} steps)")
+    filename = _save_fig(fig, output_dir, f"{name_prefix}_batch_forecast")
+
+    return {
+        "plot": filename,
+        "forecast_csv": forecast_csv,
+        "model": model,
+        "forecast_steps": forecast_steps,
+        "n_series": len(panel),
+        "n_failed": len(panel) - len(frames),
+        "series_summary": summaries,
+    }
+
+
+# ------------------------
+# Rolling-origin backtest
+# ------------------------
+def _fit_state_space(train, spec, start_params=None):
+    """
+    Fit the backtested model on a plain array.
+    Both models are state-space formulations (SARIMAX-based ARIMA, ETS for
+    exponential smoothing), so the previous origin's parameter vector is a
+    valid warm start for the next fit.
+    """
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        if spec["model"] == "arima":
+            return ARIMA(train, order=spec["order"]).fit(start_params=start_params)
+        return ETSModel(train, error="add", trend=spec["trend"], seasonal=spec["seasonal"],
+                        seasonal_periods=spec["seasonal_periods"]).fit(start_params=start_params, disp=False)
+
+
+def _backtest_chunk(values, ends, window, train_size, horizon, spec, start_params):
+    """Evaluate consecutive origins in one worker, warm-starting each fit from the previous one."""
+    rows = []
+    params = start_params
+    for end in ends:
+        start = 0 if window == "expanding" else end - train_size
+        try:
+            fit = _fit_state_space(values[start:end], spec, params)
+            params = fit.params
+            pred = np.asarray(fit.forecast(horizon), dtype=float)
+        except Exception:  # a failed origin is left out of the error table
+            continue
+        actual = values[end:end + horizon]
+        rows.append((end, pred[:len(actual)], actual))
+    return rows
+
+
+def run_backtest(series: pd.Series, model: str = "arima", order=(1, 1, 1), trend: str = "add",
+                 seasonal_periods: int = None, horizon: int = 12, n_origins: int = BACKTEST_ORIGINS,
+                 window: str = "expanding", output_dir: str = "", name_prefix: str = "", n_jobs: int = -1):
+    """
+    Rolling-origin (time series cross-validation) evaluation.
+    Origins are spread over the second half of the series; at each origin the
+    model is refit on an expanding window (everything before the origin) or a
+    sliding window (fixed length = first training window) and forecasts
+    `horizon` steps ahead. Origins are split into contiguous chunks across
+    worker processes; inside a chunk every refit is warm-started with the
+    previous origin's parameters, and every chunk starts from one initial fit.
+    model: 'arima' (fixed order) | 'exp_smoothing' (ETS with additive errors;
+    additive seasonality when seasonal_periods is set).
+    Returns MAE / MAPE per horizon step plus overall, and writes the forecast
+    vs. actual table to CSV.
+    """
+    if model not in ("arima", "exp_smoothing"):
+        raise ValueError("model must be 'arima' or 'exp_smoothing'.")
+    if window not in ("expanding", "sliding"):
+        raise ValueError("window must be 'expanding' or 'sliding'.")
+    horizon, n_origins = int(horizon), int(n_origins)
+    if horizon < 1 or n_origins < 1:
+        raise ValueError("horizon and number of origins must be >= 1.")
+
+    spec = {
+        "model": model,
+        "order": tuple(int(v) for v in order),
+        "trend": trend if trend not in (None, "none") else None,
+        "seasonal": "add" if seasonal_periods else None,
+        "seasonal_periods": seasonal_periods or None,
+    }
+    values = series.to_numpy(dtype=float)
+    n = len(values)
+    min_train = max(sum(spec["order"]) + 10 if model == "arima" else 10, 2 * (seasonal_periods or 0))
+    first = max(min_train, n // 2)
+    last = n - horizon
+    if last < first:
+        raise ValueError(f"Series too short: need at least {first + horizon} observations for this backtest.")
+    ends = np.unique(np.linspace(first, last, n_origins).round().astype(int))
+
+    initial = _fit_state_space(values[:first], spec).params
+    n_chunks = max(1, min(len(ends), effective_n_jobs(n_jobs)))
+    chunks = Parallel(n_jobs=n_jobs)(
+        delayed(_backtest_chunk)(values, chunk, window, first, horizon, spec, initial)
+        for chunk in np.array_split(ends, n_chunks)
+    )
+    rows = [row for chunk in chunks for row in chunk]
+    if not rows:
+        raise ValueError("The model could not be fitted at any backtest origin.")
+
+    # Errors laid out as (origin, step); shorter final windows stay NaN-padded
+    abs_err = np.full((len(rows), horizon), np.nan)
+    pct_err = np.full((len(rows), horizon), np.nan)
+    records = []
+    for i, (end, pred, actual) in enumerate(rows):
+        err = np.abs(actual - pred)
+        abs_err[i, :len(err)] = err
+        with np.errstate(divide="ignore", invalid="ignore"):
+            pct_err[i, :len(err)] = np.where(actual != 0, err / np.abs(actual) * 100, np.nan)
+        for step in range(len(actual)):
+            records.append({"origin": series.index[end - 1], "date": series.index[end + step],
+                            "step": step + 1, "actual": actual[step], "forecast": pred[step]})
+
+    mae_h = np.nanmean(abs_err, axis=0)
+    mape_h = np.nanmean(pct_err, axis=0) if np.isfinite(pct_err).any() else np.full(horizon, np.nan)
+    by_horizon = [{"step": h + 1, "mae": float(mae_h[h]),
+                   "mape": float(mape_h[h]) if np.isfinite(mape_h[h]) else None}
+                  for h in range(horizon)]
+
+    backtest_csv = f"{name_prefix}_backtest.csv"
+    pd.DataFrame(records).to_csv(os.path.join(_ensure_dir(output_dir), backtest_csv), index=False)
+
+    fig, (ax1, ax2) = subplots(1, 2, figsize=(14, 5), gridspec_kw={"width_ratios": [3, 2]})
+    ax1.plot(series.index, values, color="black", linewidth=1, label="Observed")
+    for j, (end, pred, actual) in enumerate(rows):
+        ax1.plot(series.index[end:end + len(pred)], pred, color="tab:orange", alpha=0.7,
+                 label="Backtest forecasts" if j == 0 else None)
+    ax1.set_title(f"Rolling-origin backtest ({window}, {len(rows)} origins)")
+    ax1.set_xlabel("Date")
+    ax1.set_ylabel("Value")
+    ax1.legend()
+    steps = np.arange(1, horizon + 1)
+    ax2.bar(steps, mae_h, color="tab:blue", alpha=0.7, label="MAE")
+    ax2.set_xlabel("Horizon (steps ahead)")
+    ax2.set_ylabel("MAE")
+    if np.isfinite(mape_h).any():
+        ax3 = ax2.twinx()
+        ax3.plot(steps, mape_h, color="tab:red", marker="o", label="MAPE (%)")
+        ax3.set_ylabel("MAPE (%)")
+        ax3.legend(loc="upper right")
+    ax2.legend(loc="upper left")
+    ax2.set_title("Out-of-sample error by horizon")
+    filename = _save_fig(fig, output_dir, f"{name_prefix}_backtest")
+
+    overall_mape = float(np.nanmean(pct_err)) if np.isfinite(pct_err).any() else None
+    return {
+        "plot": filename,
+        "backtest_csv": backtest_csv,
+        "model": model,
+        "window": window,
+        "horizon": horizon,
+        "n_origins": len(rows),
+        "mae": float(np.nanmean(abs_err)),
+        "mape": overall_mape,
+        "by_horizon": by_horizon,
     }
 
 
 # ------------------------
 # Seasonal Decomposition
 # ------------------------
-def run_seasonal_decomposition(series: pd.Series, model: str = "additive", period: int = None,
-                               output_dir: str = "", name_prefix: str = ""):
-    if period is None or period <= 1:
+def _odd(x):
+    x = int(math.ceil(x))
+    return x if x % 2 else x + 1
+
+
+def _stl_components(values, periods, robust=True, iterate=2):
+    """
+    STL for one period, MSTL-style for several (each seasonal is re-estimated
+    on the series minus the other seasonals, `iterate` times; periods in
+    ascending order, seasonal windows 11, 15, ... as in statsmodels' MSTL).
+    Every LOESS smoother only evaluates every ~10% of its window and
+    interpolates in between (the STL *_jump options), which is what makes
+    yearly seasons on daily data tractable.
+    Returns (seasonal matrix [n_periods, n], trend, resid).
+    """
+    values = np.asarray(values, dtype=float)
+    seasonal = np.zeros((len(periods), len(values)))
+    deseasonalized = values.copy()
+    for _ in range(iterate if len(periods) > 1 else 1):
+        for i, period in enumerate(periods):
+            deseasonalized += seasonal[i]
+            seasonal_window = 7 + 4 * (i + 1)
+            trend_window = _odd(1.5 * period / (1 - 1.5 / seasonal_window))
+            low_pass_window = _odd(period + 1)
+            fit = STL(deseasonalized, period=period, seasonal=seasonal_window, trend=trend_window,
+                      low_pass=low_pass_window, robust=robust,
+                      trend_jump=math.ceil(trend_window / 10),
+                      low_pass_jump=math.ceil(low_pass_window / 10)).fit()
+            seasonal[i] = fit.seasonal
+            deseasonalized -= seasonal[i]
+    return seasonal, fit.trend, deseasonalized - fit.trend
+
+
+def _decimate(index, values, max_points=PLOT_MAX_POINTS):
+    """
+    Min/max decimation for line plots: each bucket of consecutive points is
+    drawn as its minimum and maximum, so spikes survive thinning.
+    """
+    n = len(values)
+    if n <= max_points:
+        return index, values
+    bucket = int(np.ceil(2 * n / max_points))
+    n_buckets = n // bucket
+    body = values[:n_buckets * bucket].reshape(n_buckets, bucket)
+    lo, hi = body.argmin(axis=1), body.argmax(axis=1)
+    base = np.arange(n_buckets) * bucket
+    pick = np.sort(np.concatenate([base + lo, base + hi, np.arange(n_buckets * bucket, n)]))
+    return index[pick], values[pick]
+
+
+def run_seasonal_decomposition(series: pd.Series, model: str = "additive", period=None,
+                               output_dir: str = "", name_prefix: str = "", method: str = "classical",
+                               robust: bool = True):
+    """
+    method: 'classical' (moving averages, seasonal_decompose) | 'stl'
+    (robust LOESS; `period` may be a list of periods for multiple
+    seasonalities, e.g. [7, 365] on daily data).
+    period=None detects the dominant seasonal period automatically (all
+    detected periods for STL). Multiplicative STL works on the log scale.
+    Components are always written to CSV next to the chart, which is drawn
+    from min/max-decimated components.
+    """
+    if method not in ("classical", "stl"):
+        raise ValueError("method must be 'classical' or 'stl'.")
+    detected = period is None
+    if detected:
+        if method == "stl":
+            period = [f["period"] for f in detect_periods(series)]
+            if not period:
+                raise ValueError("No seasonal period could be detected; please enter one.")
+        else:
+            period = _auto_period(series)
+    periods = sorted({int(p) for p in np.atleast_1d(period)})
+    if periods[0] <= 1:
         raise ValueError("A valid seasonal period (>1) is required for decomposition.")
+    if method == "classical" and len(periods) > 1:
+        raise ValueError("Classical decomposition supports a single period; use STL for several.")
+    if 2 * periods[-1] > len(series):
+        raise ValueError(f"At least {2 * periods[-1]} observations are needed for a period of {periods[-1]}.")
 
-    result = seasonal_decompose(series, model=model, period=period)
+    if method == "classical":
+        period = periods[0]
+        result = seasonal_decompose(series, model=model, period=period)
+        components = pd.DataFrame({"observed": result.observed, "trend": result.trend,
+                                   "seasonal": result.seasonal, "resid": result.resid})
+        title = f"Seasonal Decomposition ({model}, period {period})"
+    else:
+        values = series.to_numpy(dtype=float)
+        multiplicative = model == "multiplicative"
+        if multiplicative:
+            if (values <= 0).any():
+                raise ValueError("Multiplicative decomposition requires strictly positive values.")
+            values = np.log(values)
+        seasonal, trend, resid = _stl_components(values, periods, robust=robust)
+        if multiplicative:
+            seasonal, trend, resid = np.exp(seasonal), np.exp(trend), np.exp(resid)
 
-    # Plot composite figure
-    fig = result.plot()
-    fig.set_size_inches(10, 7)
-    filename = _save_fig(output_dir, f"{name_prefix}_decomposition")
+        components = {"observed": series.to_numpy(dtype=float), "trend": trend}
+        for p, component in zip(periods, seasonal):
+            components["seasonal" if len(periods) == 1 else f"seasonal_{p}"] = component
+        components["resid"] = resid
+        components = pd.DataFrame(components, index=series.index)
+        title = f"STL Decomposition (periods {', '.join(map(str, periods))}{', robust' if robust else ''})"
+
+    # Composite figure, one panel per component
+    fig, axes = subplots(len(components.columns), 1, figsize=(10, 1.9 * len(components.columns) + 1),
+                         sharex=True, squeeze=False)
+    for ax, col in zip(axes[:, 0], components.columns):
+        x, y = _decimate(components.index, components[col].to_numpy())
+        if col == "resid":
+            ax.plot(x, y, marker=".", markersize=2, linestyle="none")
+            ax.axhline(1.0 if model == "multiplicative" else 0.0, color="black", linewidth=0.8)
+        else:
+            ax.plot(x, y, linewidth=1)
+        ax.set_ylabel(col.replace("_", " ").capitalize())
+    axes[0, 0].set_title(title)
+    filename = _save_fig(fig, output_dir, f"{name_prefix}_decomposition")
+
+    components_csv = f"{name_prefix}_decomposition.csv"
+    components.to_csv(os.path.join(_ensure_dir(output_dir), components_csv), index_label="date")
 
     explained = {
         "model": model,
-        "period": period
+        "period": periods[0] if len(periods) == 1 else ", ".join(map(str, periods)),
+        "detected": detected,
+        "method": method
     }
     return {
         "plot": filename,
+        "components_csv": components_csv,
         "meta": explained
     }
 
 
+# ------------------------
+# Anomaly detection
+# ------------------------
+def _rolling_robust_z(values, window):
+    """
+    Causal robust z-score: each point is compared with the median and MAD of
+    the `window` points before it (rolling medians are skip-list based, so
+    one O(n log window) pass). The MAD is the rolling median of each point's
+    own deviation from its causal median.
+    """
+    x = pd.Series(values)
+    min_periods = max(3, window // 4)
+    median = x.rolling(window, min_periods=min_periods).median().shift(1)
+    mad = (x - median).abs().rolling(window, min_periods=min_periods).median().shift(1) * MAD_SCALE
+    with np.errstate(divide="ignore", invalid="ignore"):
+        z = ((x - median) / mad.where(mad > 0)).to_numpy()
+    return z, median.to_numpy()
+
+
+def _hybrid_esd(residuals, max_anomalies, alpha):
+    """
+    Generalized ESD with median / MAD (the "hybrid" test of S-H-ESD).
+    The most extreme remaining point is always the smallest or largest one,
+    so after one sort each removal just moves one end of a window over the
+    sorted values; the window's median is its middle element and its MAD
+    the k-th smallest of two sorted deviation runs (binary search). That is
+    O(n log n) overall instead of one O(n) pass per tested point.
+    Returns the positions (into `residuals`) of the anomalies.
+    """
+    order = np.argsort(residuals, kind="stable")
+    r = residuals[order]
+    n = len(r)
+    lo, hi = 0, n - 1
+    removed, stats_ = [], []
+
+    def median(a, b):
+        m = a + (b - a) // 2
+        return r[m] if (b - a) % 2 == 0 else (r[m] + r[m + 1]) / 2
+
+    def kth_deviation(a, b, med, k):
+        # k-th smallest |r - med| over r[a..b]: merge of the left run (read
+        # backwards from the median) and the right run, by binary search
+        split = np.searchsorted(r[a:b + 1], med, side="left") + a
+        left_len, right_len = split - a, b - split + 1
+
+        def left(i):  # i-th smallest deviation on the left side
+            return med - r[split - 1 - i]
+
+        def right(j):
+            return r[split + j] - med
+
+        # i values from the left run and j = k + 1 - i from the right make up
+        # the k + 1 smallest; find the smallest i that is not too few
+        lo_i, hi_i = max(0, k + 1 - right_len), min(k + 1, left_len)
+        while lo_i < hi_i:
+            i = (lo_i + hi_i) // 2
+            j = k + 1 - i
+            if j > 0 and i < left_len and left(i) < right(j - 1):
+                lo_i = i + 1
+            else:
+                hi_i = i
+        i = lo_i
+        j = k + 1 - i
+        candidates = []
+        if i > 0:
+            candidates.append(left(i - 1))
+        if j > 0:
+            candidates.append(right(j - 1))
+        return max(candidates)
+
+    for _ in range(max_anomalies):
+        size = hi - lo + 1
+        if size < 3:
+            break
+        med = median(lo, hi)
+        half = size // 2
+        if size % 2:
+            mad = kth_deviation(lo, hi, med, half)
+        else:
+            mad = (kth_deviation(lo, hi, med, half - 1) + kth_deviation(lo, hi, med, half)) / 2
+        mad *= MAD_SCALE
+        if mad <= 0:
+            break
+        if med - r[lo] >= r[hi] - med:
+            stat, pos = (med - r[lo]) / mad, lo
+            lo += 1
+        else:
+            stat, pos = (r[hi] - med) / mad, hi
+            hi -= 1
+        removed.append(order[pos])
+        stats_.append(stat)
+
+    remaining = n - np.arange(len(stats_))
+    t = sps.t.ppf(1 - alpha / (2 * remaining), remaining - 2)
+    lambdas = (remaining - 1) * t / np.sqrt((remaining - 2 + t ** 2) * remaining)
+    exceed = np.nonzero(np.array(stats_) > lambdas)[0]
+    n_anomalies = exceed[-1] + 1 if len(exceed) else 0
+    return np.array(removed[:n_anomalies], dtype=int)
+
+
+def detect_anomalies(series: pd.Series, method: str = "robust_z", window: int = ANOMALY_WINDOW,
+                     threshold: float = ANOMALY_THRESHOLD, period: int = None,
+                     max_share: float = ANOMALY_MAX_SHARE, alpha: float = 0.05):
+    """
+    Score every point of a series and flag anomalies.
+    method:
+      - 'robust_z': causal rolling median / MAD z-score (single streaming pass)
+      - 'residual': one-step-ahead errors of a fitted Holt-Winters model
+        (additive seasonality when a period is given or detected), scored
+        with the same rolling robust z
+      - 'shesd': seasonal-hybrid ESD; robust STL removes the seasonality,
+        the residual (minus its median) goes through the hybrid ESD test
+        with at most `max_share` of the points tested
+    Returns a DataFrame indexed like the series with value, expected, score
+    and is_anomaly columns.
+    """
+    if method not in ("robust_z", "residual", "shesd"):
+        raise ValueError("method must be 'robust_z', 'residual' or 'shesd'.")
+    values = series.to_numpy(dtype=float)
+    n = len(values)
+    if n < 10:
+        raise ValueError("Not enough data points for anomaly detection.")
+    window = int(window)
+    if window < 3:
+        raise ValueError("Window must be >= 3.")
+
+    if method in ("residual", "shesd") and period is None:
+        found = detect_periods(series, top_k=1)
+        period = found[0]["period"] if found else None
+
+    if method == "robust_z":
+        score, expected = _rolling_robust_z(values, window)
+        flags = np.abs(np.nan_to_num(score)) > threshold
+    elif method == "residual":
+        seasonal = "add" if period and 2 <= period and n >= 2 * period else None
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            fit = ExponentialSmoothing(values, trend="add", seasonal=seasonal,
+                                       seasonal_periods=period if seasonal else None).fit(optimized=True)
+        expected = np.asarray(fit.fittedvalues, dtype=float)
+        score, _ = _rolling_robust_z(values - expected, window)
+        flags = np.abs(np.nan_to_num(score)) > threshold
+    else:
+        if period and 2 <= period and n >= 2 * period:
+            seasonal, _, _ = _stl_components(values, [period])
+            seasonal = seasonal[0]
+        else:
+            seasonal = np.zeros(n)
+        residual = values - seasonal - np.median(values)
+        expected = values - residual
+        med = np.median(residual)
+        mad = np.median(np.abs(residual - med)) * MAD_SCALE
+        score = (residual - med) / mad if mad > 0 else np.zeros(n)
+        flags = np.zeros(n, dtype=bool)
+        flags[_hybrid_esd(residual, max(1, int(max_share * n)), alpha)] = True
+
+    return pd.DataFrame({"value": values, "expected": expected, "score": score, "is_anomaly": flags},
+                        index=series.index)
+
+
+def _plot_anomalies(ax, series, scored, annotate=5):
+    x, y = _decimate(series.index, series.to_numpy(dtype=float))
+    ax.plot(x, y, color="tab:blue", linewidth=1, label="Series")
+    flagged = scored[scored["is_anomaly"]]
+    ax.scatter(flagged.index, flagged["value"], color="red", s=25, zorder=3, label=f"Anomalies ({len(flagged)})")
+    top = flagged.reindex(flagged["score"].abs().sort_values(ascending=False).index[:annotate])
+    for when, row in top.iterrows():
+        ax.annotate(pd.Timestamp(when).strftime("%Y-%m-%d") if isinstance(when, (pd.Timestamp, np.datetime64)) else str(when),
+                    (when, row["value"]), textcoords="offset points", xytext=(5, 8), fontsize=8, color="red")
+
+
+def run_anomaly_detection(series: pd.Series, method: str = "robust_z", window: int = ANOMALY_WINDOW,
+                          threshold: float = ANOMALY_THRESHOLD, period: int = None,
+                          output_dir: str = "", name_prefix: str = ""):
+    """Flag anomalies (see detect_anomalies), write them to CSV and draw an annotated chart."""
+    scored = detect_anomalies(series, method=method, window=window, threshold=threshold, period=period)
+    flagged = scored[scored["is_anomaly"]]
+
+    anomalies_csv = f"{name_prefix}_anomalies.csv"
+    flagged.drop(columns="is_anomaly").to_csv(os.path.join(_ensure_dir(output_dir), anomalies_csv),
+                                              index_label="date")
+
+    fig, ax = subplots(figsize=(11, 5))
+    _plot_anomalies(ax, series, scored)
+    labels = {"robust_z": "rolling robust z", "residual": "smoothing residuals", "shesd": "S-H-ESD"}
+    ax.set_title(f"Anomaly Detection ({labels[method]})")
+    ax.set_xlabel("Date")
+    ax.set_ylabel("Value")
+    ax.legend()
+    filename = _save_fig(fig, output_dir, f"{name_prefix}_anomalies")
+
+    top = flagged.reindex(flagged["score"].abs().sort_values(ascending=False).index[:20])
+    return {
+        "plot": filename,
+        "anomalies_csv": anomalies_csv,
+        "method": method,
+        "n_anomalies": int(len(flagged)),
+        "anomaly_share": float(len(flagged) / len(scored)),
+        "top_anomalies": [{"date": str(when), "value": float(row["value"]),
+                           "expected": float(row["expected"]) if np.isfinite(row["expected"]) else None,
+                           "score": float(row["score"])} for when, row in top.iterrows()],
+    }
+
+
+def _anomalies_one(name, series, method, window, threshold, period):
+    try:
+        scored = detect_anomalies(series, method=method, window=window, threshold=threshold, period=period)
+    except Exception as e:  # reported in the summary, the rest of the batch continues
+        return name, None, str(e)
+    return name, scored, None
+
+
+def run_anomaly_batch(panel: dict, method: str = "robust_z", window: int = ANOMALY_WINDOW,
+                      threshold: float = ANOMALY_THRESHOLD, output_dir: str = "", name_prefix: str = "",
+                      n_jobs: int = -1):
+    """
+    detect_anomalies for every series of a panel (see prepare_panel) in a
+    worker pool. Writes one CSV of all flagged points and an overview grid of
+    the series with the most anomalies.
+    """
+    if not panel:
+        raise ValueError("No series to analyze.")
+    outputs = Parallel(n_jobs=n_jobs)(
+        delayed(_anomalies_one)(name, series, method, window, threshold, None)
+        for name, series in panel.items()
+    )
+
+    frames, summary = [], []
+    for name, scored, error in outputs:
+        count = int(scored["is_anomaly"].sum()) if scored is not None else 0
+        summary.append({"series": name, "n_obs": len(panel[name]), "n_anomalies": count, "error": error})
+        if scored is not None and count:
+            flagged = scored[scored["is_anomaly"]].drop(columns="is_anomaly")
+            frames.append(flagged.rename_axis("date").reset_index().assign(series=name))
+    scored_by_name = {name: scored for name, scored, _ in outputs if scored is not None}
+    if not scored_by_name:
+        raise ValueError("None of the series could be analyzed: " + summary[0]["error"])
+
+    anomalies = (pd.concat(frames, ignore_index=True) if frames
+                 else pd.DataFrame(columns=["date", "value", "expected", "score", "series"]))
+    anomalies_csv = f"{name_prefix}_batch_anomalies.csv"
+    anomalies[["series", "date", "value", "expected", "score"]].to_csv(
+        os.path.join(_ensure_dir(output_dir), anomalies_csv), index=False)
+
+    summary.sort(key=lambda row: -row["n_anomalies"])
+    shown = [row["series"] for row in summary if row["series"] in scored_by_name][:BATCH_OVERVIEW_MAX]
+    n_cols = min(3, len(shown))
+    n_rows = int(np.ceil(len(shown) / n_cols))
+    fig, axes = subplots(n_rows, n_cols, figsize=(5 * n_cols, 3.2 * n_rows), squeeze=False)
+    for ax, name in zip(axes.flat, shown):
+        _plot_anomalies(ax, panel[name], scored_by_name[name], annotate=0)
+        ax.set_title(f"{name} ({int(scored_by_name[name]['is_anomaly'].sum())})")
+        ax.tick_params(axis="x", labelrotation=30, labelsize=8)
+    for ax in axes.flat[len(shown):]:
+        ax.set_visible(False)
+    fig.suptitle(f"Anomalies across {len(panel)} series")
+    filename = _save_fig(fig, output_dir, f"{name_prefix}_batch_anomalies")
+
+    return {
+        "plot": filename,
+        "anomalies_csv": anomalies_csv,
+        "method": method,
+        "n_series": len(panel),
+        "n_anomalies": int(len(anomalies)),
+        "anomaly_summary": summary,
+    }
+
+
 # ------------------------
 # Trend Analysis (simple linear trend using polyfit)
 # ------------------------
@@ -199,14 +1541,14 @@ def run_trend_analysis(series: pd.Series, output_dir: str = "", name_prefix: str
     a, b = np.polyfit(x, y, deg=1)
     y_trend = a * x + b
 
-    plt.figure(figsize=(10, 5))
-    plt.plot(series.index, series.values, label="Original")
-    plt.plot(series.index, y_trend, label="Linear Trend", linewidth=2)
-    plt.title("Trend Analysis (Linear)")
-    plt.xlabel("Date")
-    plt.ylabel("Value")
-    plt.legend()
-    filename = _save_fig(output_dir, f"{name_prefix}_trend")
+    fig, ax = subplots(figsize=(10, 5))
+    ax.plot(series.index, series.values, label="Original")
+    ax.plot(series.index, y_trend, label="Linear Trend", linewidth=2)
+    ax.set_title("Trend Analysis (Linear)")
+    ax.set_xlabel("Date")
+    ax.set_ylabel("Value")
+    ax.legend()
+    filename = _save_fig(fig, output_dir, f"{name_prefix}_trend")
 
     slope = float(a)
     direction = "increasing" if slope > 0 else ("decreasing" if slope < 0 else "flat")
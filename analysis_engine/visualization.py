@@ -4,9 +4,7 @@ import os
 import numpy as np
 import pandas as pd
 
-import matplotlib
-matplotlib.use("Agg")
-import matplotlib.pyplot as plt
+from matplotlib.patches import Circle
 import seaborn as sns
 
 from datetime import datetime
@@ -14,14 +12,14 @@ from datetime import datetime
 # Plotly (for interactive, special charts)
 import plotly.graph_objects as go
 import plotly.express as px
-from plotly.offline import plot as plotly_save
 
 # NetworkX (for network graphs)
 import networkx as nx
 
 # Dendrogram
-from scipy.cluster.hierarchy import dendrogram, linkage
+from scipy.cluster.hierarchy import dendrogram, linkage, leaves_list
 from app.models import Graph
+from analysis_engine.figures import new_figure, subplots, save_figure, save_plotly
 
 # ---------- helpers ----------
 
@@ -37,19 +35,15 @@ def _html_name(prefix):
     ts = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
     return f"{prefix}_{ts}.html"
 
-def _save_fig(output_dir_img, filename):
+def _save_fig(fig, output_dir_img, filename):
     _ensure_dir(output_dir_img)
     outpath = os.path.join(output_dir_img, filename)
-    plt.tight_layout()
-    plt.savefig(outpath, bbox_inches="tight", dpi=140)
-    plt.close()
-    return filename
+    return save_figure(fig, outpath, tight=True, bbox_inches="tight", dpi=140)
 
 def _save_plotly(fig, output_dir_html, filename):
     _ensure_dir(output_dir_html)
     outpath = os.path.join(output_dir_html, filename)
-    plotly_save(fig, filename=outpath, auto_open=False, include_plotlyjs="cdn")
-    return filename
+    return save_plotly(fig, outpath)
 
 
 # ---------- main dispatcher ----------
@@ -178,34 +172,35 @@ def _bar_chart(df, cfg, interactive, out_img, out_html, prefix):
 
     # Matplotlib
     data = _aggregate_if_needed(df, x, y, agg)
-    plt.figure(figsize=(10,6))
+    fig, ax = subplots(figsize=(10,6))
     if subtype == "horizontal":
-        plt.barh(data[x], data[y])
-        plt.xlabel(y); plt.ylabel(x)
+        ax.barh(data[x], data[y])
+        ax.set_xlabel(y); ax.set_ylabel(x)
     elif subtype == "stacked" and hue:
         # simple stacked: pivot by hue
         pivot = df.pivot_table(index=x, columns=hue, values=y, aggfunc=agg or "sum").fillna(0)
         bottom = np.zeros(len(pivot))
         for col in pivot.columns:
-            plt.bar(pivot.index, pivot[col], bottom=bottom, label=str(col))
+            ax.bar(pivot.index, pivot[col], bottom=bottom, label=str(col))
             bottom += pivot[col].values
-        plt.legend()
+        ax.legend()
     elif subtype == "grouped" and hue:
         pivot = df.pivot_table(index=x, columns=hue, values=y, aggfunc=agg or "sum").fillna(0)
         idx = np.arange(len(pivot.index))
         w = 0.8 / len(pivot.columns)
         for i, col in enumerate(pivot.columns):
-            plt.bar(idx + i*w, pivot[col].values, width=w, label=str(col))
-        plt.xticks(idx + w*(len(pivot.columns)-1)/2, pivot.index, rotation=45)
-        plt.legend()
+            ax.bar(idx + i*w, pivot[col].values, width=w, label=str(col))
+        ax.set_xticks(idx + w*(len(pivot.columns)-1)/2)
+        ax.set_xticklabels(pivot.index, rotation=45)
+        ax.legend()
     else:
-        plt.bar(data[x], data[y])
-        plt.xticks(rotation=45)
-        plt.ylabel(y); plt.xlabel(x)
+        ax.bar(data[x], data[y])
+        ax.tick_params(axis="x", labelrotation=45)
+        ax.set_ylabel(y); ax.set_xlabel(x)
 
-    plt.title("Bar Chart")
+    ax.set_title("Bar Chart")
     name = _img_name(prefix + "_bar")
-    return {"kind": "image", "file": _save_fig(out_img, name), "meta": {}}
+    return {"kind": "image", "file": _save_fig(fig, out_img, name), "meta": {}}
 
 
 def _line_chart(df, cfg, interactive, out_img, out_html, prefix):
@@ -230,20 +225,20 @@ def _line_chart(df, cfg, interactive, out_img, out_html, prefix):
         name = _html_name(prefix + "_line")
         return {"kind": "html", "file": _save_plotly(fig, out_html, name), "meta": {}}
 
-    plt.figure(figsize=(10,6))
+    fig, ax = subplots(figsize=(10,6))
     if subtype == "multiple" and y_multi:
         for col in y_multi:
-            plt.plot(df[x], df[col], label=str(col))
-        plt.legend()
+            ax.plot(df[x], df[col], label=str(col))
+        ax.legend()
     elif subtype == "area" and y_multi:
-        plt.stackplot(df[x], [df[col] for col in y_multi], labels=y_multi)
-        plt.legend(loc='upper left')
+        ax.stackplot(df[x], [df[col] for col in y_multi], labels=y_multi)
+        ax.legend(loc='upper left')
     else:
         data = _aggregate_if_needed(df, x, y, agg)
-        plt.plot(data[x], data[y])
-    plt.title("Line Chart"); plt.xlabel(x); plt.ylabel(y or "value")
+        ax.plot(data[x], data[y])
+    ax.set_title("Line Chart"); ax.set_xlabel(x); ax.set_ylabel(y or "value")
     name = _img_name(prefix + "_line")
-    return {"kind": "image", "file": _save_fig(out_img, name), "meta": {}}
+    return {"kind": "image", "file": _save_fig(fig, out_img, name), "meta": {}}
 
 
 def _pie_chart(df, cfg, out_img, prefix):
@@ -260,20 +255,20 @@ def _pie_chart(df, cfg, out_img, prefix):
     labels = data[labels_col].astype(str).values
     values = data[values_col].values
 
-    plt.figure(figsize=(8,8))
+    fig, ax = subplots(figsize=(8,8))
     explode = None
     if subtype == "exploded":
         explode = [0.1] + [0]*(len(values)-1)
 
-    wedges, texts, autotexts = plt.pie(values, labels=labels, autopct="%1.1f%%",
-                                       startangle=140, pctdistance=0.85 if subtype=="donut" else 0.6,
-                                       explode=explode)
+    wedges, texts, autotexts = ax.pie(values, labels=labels, autopct="%1.1f%%",
+                                      startangle=140, pctdistance=0.85 if subtype=="donut" else 0.6,
+                                      explode=explode)
     if subtype == "donut":
-        centre_circle = plt.Circle((0,0),0.70,fc='white')
-        fig = plt.gcf(); fig.gca().add_artist(centre_circle)
-    plt.title(subtype.title())
+        centre_circle = Circle((0,0),0.70,fc='white')
+        ax.add_artist(centre_circle)
+    ax.set_title(subtype.title())
     name = _img_name(prefix + "_pie")
-    return {"kind": "image", "file": _save_fig(out_img, name), "meta": {}}
+    return {"kind": "image", "file": _save_fig(fig, out_img, name), "meta": {}}
 
 
 def _scatter_chart(df, cfg, interactive, out_img, out_html, prefix):
@@ -296,16 +291,16 @@ def _scatter_chart(df, cfg, interactive, out_img, out_html, prefix):
         name = _html_name(prefix + "_scatter")
         return {"kind": "html", "file": _save_plotly(fig, out_html, name), "meta": {}}
 
-    plt.figure(figsize=(9,6))
+    fig, ax = subplots(figsize=(9,6))
     if subtype == "bubble" and size and size in df.columns:
         s = df[size].fillna(0).values
         s_scaled = 200 * (s - s.min()) / (s.max() - s.min() + 1e-9) + 20
-        plt.scatter(df[x], df[y], s=s_scaled, c='C0', alpha=0.7)
+        ax.scatter(df[x], df[y], s=s_scaled, c='C0', alpha=0.7)
     else:
-        plt.scatter(df[x], df[y], alpha=0.7)
-    plt.xlabel(x); plt.ylabel(y); plt.title("Scatter")
+        ax.scatter(df[x], df[y], alpha=0.7)
+    ax.set_xlabel(x); ax.set_ylabel(y); ax.set_title("Scatter")
     name = _img_name(prefix + "_scatter")
-    return {"kind": "image", "file": _save_fig(out_img, name), "meta": {}}
+    return {"kind": "image", "file": _save_fig(fig, out_img, name), "meta": {}}
 
 
 def _hist_chart(df, cfg, out_img, prefix):
@@ -317,11 +312,11 @@ def _hist_chart(df, cfg, out_img, prefix):
     if not col:
         raise ValueError("Histogram requires a numeric column.")
 
-    plt.figure(figsize=(9,6))
-    plt.hist(df[col].dropna().values, bins=bins, cumulative=(subtype=="cumulative"), alpha=0.85)
-    plt.xlabel(col); plt.ylabel("Frequency"); plt.title("Histogram" + (" (Cumulative)" if subtype=="cumulative" else ""))
+    fig, ax = subplots(figsize=(9,6))
+    ax.hist(df[col].dropna().values, bins=bins, cumulative=(subtype=="cumulative"), alpha=0.85)
+    ax.set_xlabel(col); ax.set_ylabel("Frequency"); ax.set_title("Histogram" + (" (Cumulative)" if subtype=="cumulative" else ""))
     name = _img_name(prefix + "_hist")
-    return {"kind": "image", "file": _save_fig(out_img, name), "meta": {}}
+    return {"kind": "image", "file": _save_fig(fig, out_img, name), "meta": {}}
 
 
 def _box_violin(df, cfg, out_img, prefix):
@@ -330,20 +325,20 @@ def _box_violin(df, cfg, out_img, prefix):
     group = cfg.get("group")  # categorical splitter
     subtype = cfg.get("subtype","box")
 
-    plt.figure(figsize=(10,6))
+    fig, ax = subplots(figsize=(10,6))
     if subtype == "violin":
         if group:
-            sns.violinplot(x=group, y=col, data=df, cut=0)
+            sns.violinplot(x=group, y=col, data=df, cut=0, ax=ax)
         else:
-            sns.violinplot(y=df[col])
+            sns.violinplot(y=df[col], ax=ax)
     else:
         if group:
-            sns.boxplot(x=group, y=col, data=df)
+            sns.boxplot(x=group, y=col, data=df, ax=ax)
         else:
-            sns.boxplot(y=df[col])
-    plt.title(subtype.title())
+            sns.boxplot(y=df[col], ax=ax)
+    ax.set_title(subtype.title())
     name = _img_name(prefix + "_boxviolin")
-    return {"kind": "image", "file": _save_fig(out_img, name), "meta": {}}
+    return {"kind": "image", "file": _save_fig(fig, out_img, name), "meta": {}}
 
 
 def _heatmap(df, cfg, out_img, prefix):
@@ -356,20 +351,48 @@ def _heatmap(df, cfg, out_img, prefix):
         raise ValueError("Heatmap requires at least two numeric columns.")
 
     if subtype == "clustered":
-        # seaborn clustermap returns its own fig; save via fig.savefig
-        cg = sns.clustermap(data.corr(), cmap="coolwarm", vmin=-1, vmax=1, annot=len(cols)<=15)
+        # laid out by its own grid (tight_layout would fight the colorbar axes), so save it directly
+        fig = _clustered_heatmap(data.corr(), annot=len(cols)<=15)
         name = _img_name(prefix + "_clustermap")
-        outpath = os.path.join(out_img, name)
-        _ensure_dir(out_img)
-        cg.fig.savefig(outpath, bbox_inches="tight", dpi=140)
-        plt.close(cg.fig)
+        outpath = os.path.join(_ensure_dir(out_img), name)
+        save_figure(fig, outpath, bbox_inches="tight", dpi=140)
         return {"kind": "image", "file": name, "meta": {}}
     else:
-        plt.figure(figsize=(9,7))
-        sns.heatmap(data.corr(), cmap="coolwarm", vmin=-1, vmax=1, annot=len(cols)<=15)
-        plt.title("Correlation Heatmap")
+        fig, ax = subplots(figsize=(9,7))
+        sns.heatmap(data.corr(), cmap="coolwarm", vmin=-1, vmax=1, annot=len(cols)<=15, ax=ax)
+        ax.set_title("Correlation Heatmap")
         name = _img_name(prefix + "_heatmap")
-        return {"kind": "image", "file": _save_fig(out_img, name), "meta": {}}
+        return {"kind": "image", "file": _save_fig(fig, out_img, name), "meta": {}}
+
+
+def _clustered_heatmap(corr, annot=False):
+    """
+    Correlation heatmap with rows/columns reordered by average-linkage
+    clustering and the dendrogram drawn along the top and left edge (what
+    sns.clustermap draws, but on our own figure instead of a pyplot one).
+    """
+    Z = linkage(corr.values, method="average")
+    order = leaves_list(Z)
+    ordered = corr.iloc[order, order]
+
+    fig = new_figure(figsize=(10,10))
+    # dendrogram | heatmap | room for the row labels | colorbar
+    grid = fig.add_gridspec(2, 4, width_ratios=[.2, 1, .1, .04], height_ratios=[.2, 1], wspace=.02, hspace=.02)
+    ax_top = fig.add_subplot(grid[0, 1])
+    ax_left = fig.add_subplot(grid[1, 0])
+    ax = fig.add_subplot(grid[1, 1])
+    cbar_ax = fig.add_subplot(grid[1, 3])
+
+    dendrogram(Z, ax=ax_top, orientation="top", no_labels=True, color_threshold=0, above_threshold_color="#555")
+    dendrogram(Z, ax=ax_left, orientation="left", no_labels=True, color_threshold=0, above_threshold_color="#555")
+    ax_left.invert_yaxis()  # leaves run top to bottom, like the heatmap rows
+    for dendro_ax in (ax_top, ax_left):
+        dendro_ax.set_axis_off()
+
+    sns.heatmap(ordered, cmap="coolwarm", vmin=-1, vmax=1, annot=annot, fmt=".2f", ax=ax, cbar_ax=cbar_ax)
+    ax.yaxis.tick_right()
+    ax.tick_params(axis="y", labelrotation=0)
+    return fig
 
 def log_graph_to_db(name, graph_type, dataset_id, analysis_type, file_path, user_id):
     graph = Graph(
@@ -397,16 +420,15 @@ def _radar_chart(df, cfg, out_img, prefix):
     angles = np.linspace(0, 2*np.pi, len(cats), endpoint=False).tolist()
     angles += angles[:1]
 
-    plt.figure(figsize=(8,8))
-    ax = plt.subplot(111, polar=True)
+    fig, ax = subplots(figsize=(8,8), subplot_kw={"projection": "polar"})
     ax.plot(angles, values, linewidth=2)
     if cfg.get("filled") == "on":
         ax.fill(angles, values, alpha=0.25)
     ax.set_xticks(angles[:-1])
     ax.set_xticklabels(cats, fontsize=9)
-    plt.title("Radar Chart")
+    ax.set_title("Radar Chart")
     name = _img_name(prefix + "_radar")
-    return {"kind": "image", "file": _save_fig(out_img, name), "meta": {}}
+    return {"kind": "image", "file": _save_fig(fig, out_img, name), "meta": {}}
 
 
 def _treemap(df, cfg, out_html, prefix):
@@ -452,11 +474,11 @@ def _network(df, cfg, out_img, prefix):
                 if abs(corr[i,j]) >= float(cfg.get("corr_threshold", 0.6)):
                     G.add_edge(labels[i], labels[j], weight=float(corr[i,j]))
     pos = nx.spring_layout(G, seed=42)
-    plt.figure(figsize=(8,6))
-    nx.draw(G, pos, with_labels=True, node_size=700, node_color="#7aa2ff", edge_color="#999", font_size=9)
-    plt.title("Network Graph")
+    fig, ax = subplots(figsize=(8,6))
+    nx.draw(G, pos, ax=ax, with_labels=True, node_size=700, node_color="#7aa2ff", edge_color="#999", font_size=9)
+    ax.set_title("Network Graph")
     name = _img_name(prefix + "_network")
-    return {"kind":"image","file":_save_fig(out_img, name),"meta":{}}
+    return {"kind":"image","file":_save_fig(fig, out_img, name),"meta":{}}
 
 
 def _waterfall(df, cfg, out_img, prefix):
@@ -468,11 +490,11 @@ def _waterfall(df, cfg, out_img, prefix):
     vals = data[y].values
     idx = np.arange(len(vals))
     cum = np.cumsum(vals)
-    plt.figure(figsize=(10,6))
-    plt.bar(idx, vals, bottom=np.hstack(([0], cum[:-1])), color=["#2ecc71" if v>=0 else "#e74c3c" for v in vals])
-    plt.xticks(idx, data[x], rotation=45); plt.title("Waterfall")
+    fig, ax = subplots(figsize=(10,6))
+    ax.bar(idx, vals, bottom=np.hstack(([0], cum[:-1])), color=["#2ecc71" if v>=0 else "#e74c3c" for v in vals])
+    ax.set_xticks(idx); ax.set_xticklabels(data[x], rotation=45); ax.set_title("Waterfall")
     name = _img_name(prefix + "_waterfall")
-    return {"kind":"image","file":_save_fig(out_img, name),"meta":{}}
+    return {"kind":"image","file":_save_fig(fig, out_img, name),"meta":{}}
 
 
 def _gantt(df, cfg, out_html, prefix):
@@ -552,11 +574,11 @@ def _dendrogram(df, cfg, out_img, prefix):
     if cfg.get("standardize") == "on":
         data = (data - data.mean()) / (data.std(ddof=0) + 1e-9)
     Z = linkage(data.values, method=cfg.get("linkage","ward"))
-    plt.figure(figsize=(10,6))
-    dendrogram(Z, labels=None, leaf_rotation=90)
-    plt.title("Hierarchical Clustering Dendrogram")
+    fig, ax = subplots(figsize=(10,6))
+    dendrogram(Z, labels=None, leaf_rotation=90, ax=ax)
+    ax.set_title("Hierarchical Clustering Dendrogram")
     name = _img_name(prefix + "_dendrogram")
-    return {"kind":"image","file":_save_fig(out_img, name),"meta":{}}
+    return {"kind":"image","file":_save_fig(fig, out_img, name),"meta":{}}
 
 
 def _combo_chart(df, cfg, out_img, prefix):
@@ -564,15 +586,15 @@ def _combo_chart(df, cfg, out_img, prefix):
     x = cfg.get("x"); y1 = cfg.get("y"); y2 = cfg.get("y2")
     if not all([x, y1, y2]):
         raise ValueError("Combo requires x, y (bar) and y2 (line).")
-    fig, ax1 = plt.subplots(figsize=(10,6))
+    fig, ax1 = subplots(figsize=(10,6))
     ax1.bar(df[x], df[y1], alpha=0.6, label=y1)
     ax1.set_xlabel(x); ax1.set_ylabel(y1)
     ax2 = ax1.twinx()
     ax2.plot(df[x], df[y2], marker='o', label=y2, linewidth=2)
     ax2.set_ylabel(y2)
-    plt.title("Combo Chart (Bar + Line)")
+    ax1.set_title("Combo Chart (Bar + Line)")
     name = _img_name(prefix + "_combo")
-    return {"kind":"image","file":_save_fig(out_img, name),"meta":{}}
+    return {"kind":"image","file":_save_fig(fig, out_img, name),"meta":{}}
 
 
 def _scatter3d(df, cfg, out_html, prefix):
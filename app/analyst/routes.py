@@ -1,7 +1,7 @@
 import os
 import pandas as pd
 import numpy as np
-from flask import Blueprint, render_template, flash, redirect, url_for, request, send_file, current_app, Response
+from flask import Blueprint, render_template, flash, redirect, url_for, request, send_file, current_app, Response, jsonify, session
 from werkzeug.utils import secure_filename
 from app.forms import DatasetUploadForm, CleanTransformForm
 from flask_login import login_required, current_user
@@ -13,24 +13,37 @@ from app.utils import load_dataset_by_id, save_cleaned_dataframe  # custom utili
 from analysis_engine.cleaning import clean_and_transform_data  # custom module you'll define
 from analysis_engine.statistics import compute_descriptive_stats  # to be defined
 from analysis_engine.statistics import calculate_confidence_interval, one_sample_ttest
-from analysis_engine.dimensionality import run_pca, run_mca
+from analysis_engine.dimensionality import run_pca, run_mca, run_embedding, render_pca_plot, pca_plot_name
 from analysis_engine.density_curve import run_density_curve
 from analysis_engine.visualization import render_chart
 from app.models import Report
 import uuid
-from analysis_engine.matrix_tools import compute_correlation, compute_covariance
+from analysis_engine.matrix_tools import compute_correlation, compute_covariance, discard_matrix_source, heatmap_path
+from analysis_engine import render_service
+from analysis_engine.figures import deferred_rendering
 from analysis_engine.time_series import (
     prepare_series,
+    prepare_panel,
     moving_average,
+    rolling_features,
+    iter_rolling_csv,
     run_exponential_smoothing,
     run_arima,
+    run_arima_auto,
+    run_batch_forecast,
+    run_backtest,
     run_seasonal_decomposition,
+    run_period_detection,
+    run_anomaly_detection,
+    run_anomaly_batch,
     run_trend_analysis
 )
 
 analyst = Blueprint('analyst', __name__, template_folder='templates')
 UPLOAD_FOLDER = 'uploads'
 ALLOWED_EXTENSIONS = {'csv', 'xlsx', 'json'}
+PCA_SESSION_FITS = 20  # PCA fits per user session whose plots pca_plot will serve
+PCA_GRAPH_NAMES = {'scree': 'Scree Plot', 'biplot': 'PCA Biplot', 'correlation_circle': 'Correlation Circle'}
 if not os.path.exists(UPLOAD_FOLDER):
     os.makedirs(UPLOAD_FOLDER)
 
@@ -69,6 +82,15 @@ def dashboard():
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def _render_polls(queued):
+    """{static URL of a chart still rendering: URL to poll its job} for render_jobs.js"""
+    static_root = os.path.join(current_app.root_path, 'static')
+    return {
+        url_for('static', filename=os.path.relpath(os.path.abspath(path), static_root).replace(os.sep, '/')):
+            url_for('analyst.render_status', job_id=job_id)
+        for path, job_id in queued.items()
+    }
+
 @analyst.route('/analyst/upload', methods=['GET', 'POST'])
 @login_required
 def upload():
@@ -331,6 +353,8 @@ def dimensionality_analysis(dataset_id):
 
     result = None
     method = None
+    queued = {}  # charts handed to the render pool, polled by the page
+    pca_polls = {}
 
     if request.method == 'POST':
         try:
@@ -345,34 +369,35 @@ def dimensionality_analysis(dataset_id):
                     "Subvention_to_Income": ("subvs", "pib2022"),
                     "Revenue_to_Salary": ("revenue", "salary")
                 }
-                result = run_pca(df, selected_cols, output_dir, custom_ratios)
-                
-                # Save PCA graphs to database
+                n_components = request.form.get('n_components', '')
+                n_components = int(n_components) if n_components else None
+                solver = request.form.get('pca_solver', 'auto')
+                result = run_pca(df, selected_cols, output_dir, custom_ratios,
+                                 n_components=n_components, solver=solver)
+
+                # The plots are served (and saved to the database) by pca_plot; remember
+                # which fits this user may draw and queue the views on the render pool.
                 if result:
-                    graphs_to_save = [
-                        ('scree_plot', 'Scree Plot'),
-                        ('biplot', 'PCA Biplot'),
-                        ('correlation_circle', 'Correlation Circle')
-                    ]
-                    
-                    for key, name in graphs_to_save:
-                        if result.get(key):
-                            file_path = os.path.join('generated', result[key])
-                            new_graph = Graph(
-                                name=f"PCA - {name}",
-                                graph_type='PCA',
-                                dataset_id=dataset_id,
-                                analysis_type='dimensionality',
-                                file_path=file_path,
-                                created_by=current_user.id
-                            )
-                            db.session.add(new_graph)
-                    
-                    db.session.commit()
+                    cache_key = result['cache_key']
+                    fits = [f for f in session.get('pca_fits', []) if f != f"{dataset_id}:{cache_key}"]
+                    session['pca_fits'] = (fits + [f"{dataset_id}:{cache_key}"])[-PCA_SESSION_FITS:]
+                    live = {f.split(':', 1)[1] for f in session['pca_fits']}
+                    pca_jobs = {k: v for k, v in session.get('pca_jobs', {}).items() if k.split(':')[0] in live}
+                    for kind in PCA_GRAPH_NAMES:
+                        try:
+                            job_id = render_service.submit('pca_plot', cache_key=cache_key, kind=kind,
+                                                           output_dir=output_dir)
+                        except RuntimeError:
+                            break  # queue full: pca_plot draws the remaining views itself
+                        pca_jobs[f"{cache_key}:{kind}"] = job_id
+                        pca_polls[url_for('analyst.pca_plot', dataset_id=dataset_id, cache_key=cache_key, kind=kind)] = \
+                            url_for('analyst.render_status', job_id=job_id)
+                    session['pca_jobs'] = pca_jobs
                     flash("PCA analysis saved successfully!", "success")
 
             elif method == 'MCA' and selected_cols:
-                result = run_mca(df, selected_cols, output_dir)
+                with deferred_rendering() as queued:
+                    result = run_mca(df, selected_cols, output_dir)
                 
                 # Save MCA graph to database
                 if result and result.get('mca_map') and not result.get('error'):
@@ -389,6 +414,25 @@ def dimensionality_analysis(dataset_id):
                     db.session.commit()
                     flash("MCA analysis saved successfully!", "success")
 
+            elif method == 'EMBED' and selected_cols:
+                embed_method = request.form.get('embed_method', 'tsne')
+                perplexity = float(request.form.get('perplexity', 30))
+                with deferred_rendering() as queued:
+                    result = run_embedding(df, selected_cols, output_dir, method=embed_method, perplexity=perplexity)
+
+                file_path = os.path.join('generated', result['embedding_plot'])
+                new_graph = Graph(
+                    name=f"{result['method']} - 2D Embedding",
+                    graph_type='EMBED',
+                    dataset_id=dataset_id,
+                    analysis_type='dimensionality',
+                    file_path=file_path,
+                    created_by=current_user.id
+                )
+                db.session.add(new_graph)
+                db.session.commit()
+                flash(f"{result['method']} embedding saved successfully!", "success")
+
             else:
                 flash("Please select a method and at least one column.", "danger")
 
@@ -411,7 +455,49 @@ def dimensionality_analysis(dataset_id):
         all_cols=df.columns.tolist(),
         result=result,
         method=method,
-        graphs=graphs)
+        graphs=graphs,
+        render_jobs={**_render_polls(queued), **pca_polls})
+
+@analyst.route('/dataset/<int:dataset_id>/dimensionality/pca/<cache_key>/<kind>.png')
+@login_required
+def pca_plot(dataset_id, cache_key, kind):
+    """
+    Serve a PCA view. Views are drawn by the render pool queued in
+    dimensionality_analysis (202 while that job runs); a view without a job
+    is drawn here from the cached fit. Only fits the current user ran on one
+    of their own datasets are served; the Graph row is saved once the image exists.
+    """
+    dataset = Dataset.query.get_or_404(dataset_id)
+    if dataset.user_id != current_user.id or f"{dataset_id}:{cache_key}" not in session.get('pca_fits', []):
+        return Response(status=404)
+
+    output_dir = os.path.join(current_app.root_path, 'static', 'generated')
+    os.makedirs(output_dir, exist_ok=True)
+    job_id = session.get('pca_jobs', {}).get(f"{cache_key}:{kind}")
+    if job_id and not os.path.exists(os.path.join(output_dir, pca_plot_name(cache_key, kind))):
+        try:
+            pending = render_service.status(job_id)['state'] in ('queued', 'running')
+        except ValueError:
+            pending = False
+        if pending:
+            return Response(status=202)  # the page reloads the image once the job is done
+    try:
+        filename = render_pca_plot(cache_key, kind, output_dir)
+    except ValueError:
+        return Response(status=404)
+
+    file_path = os.path.join('generated', filename)
+    if not Graph.query.filter_by(dataset_id=dataset_id, file_path=file_path, created_by=current_user.id).first():
+        db.session.add(Graph(
+            name=f"PCA - {PCA_GRAPH_NAMES[kind]}",
+            graph_type='PCA',
+            dataset_id=dataset_id,
+            analysis_type='dimensionality',
+            file_path=file_path,
+            created_by=current_user.id
+        ))
+        db.session.commit()
+    return send_file(os.path.join(output_dir, filename), mimetype='image/png')
 
 @analyst.route('/dataset/<int:dataset_id>/clustering', methods=['GET', 'POST'])
 @login_required
@@ -429,27 +515,53 @@ def clustering(dataset_id):
 
     numeric_cols = df.select_dtypes(include='number').columns.tolist()
     result = {}
+    queued = {}  # charts handed to the render pool, polled by the page
 
     if request.method == 'POST':
         selected_cols = request.form.getlist('columns')
         algorithm = request.form.get('algorithm')
         n_clusters = int(request.form.get('n_clusters', 3))
         method = request.form.get('hac_method', 'ward')
+        kmeans_mode = request.form.get('kmeans_mode', 'auto')
+        hac_clusters = request.form.get('hac_clusters', '')
+        hac_clusters = int(hac_clusters) if hac_clusters else None
 
         output_dir = os.path.join('app', 'static', 'img')
         os.makedirs(output_dir, exist_ok=True)
+        # plots and row-level labels are public static files: unique, unguessable names per run
+        prefix = f"{algorithm}_{dataset_id}_{uuid.uuid4().hex}"
 
         try:
-            from analysis_engine.clustering import run_kmeans, run_hac
-
-            if algorithm == 'kmeans':
-                result = run_kmeans(df, selected_cols, n_clusters, output_dir)
-                graph_name = f"K-Means Clustering (k={n_clusters})"
-                plot_key = 'kmeans_plot'
-            elif algorithm == 'hac':
-                result = run_hac(df, selected_cols, output_dir, method=method)
-                graph_name = f"HAC Dendrogram ({method})"
-                plot_key = 'hac_plot'
+            from analysis_engine.clustering import run_kmeans, run_kmeans_sweep, run_hac, run_dbscan
+
+            with deferred_rendering() as queued:
+                if algorithm == 'kmeans':
+                    result = run_kmeans(df, selected_cols, n_clusters, output_dir, mode=kmeans_mode,
+                                        state_key=f"kmeans:{dataset_id}", name_prefix=prefix)
+                    graph_name = f"K-Means Clustering (k={n_clusters})"
+                    plot_key = 'kmeans_plot'
+                elif algorithm == 'kmeans_sweep':
+                    k_max = int(request.form.get('k_max', 10))
+                    result = run_kmeans_sweep(df, selected_cols, k_max, output_dir, name_prefix=prefix)
+                    graph_name = f"K-Means k-Sweep (k=2..{k_max}, best k={result['recommended_k']})"
+                    plot_key = 'sweep_plot'
+                elif algorithm == 'hac':
+                    result = run_hac(df, selected_cols, output_dir, method=method, n_clusters=hac_clusters,
+                                     name_prefix=prefix)
+                    graph_name = f"HAC Dendrogram ({method})"
+                    plot_key = 'hac_plot'
+                elif algorithm in ('dbscan', 'hdbscan'):
+                    eps = float(request.form.get('eps', 0.5))
+                    min_samples = int(request.form.get('min_samples', 5))
+                    min_cluster_size = int(request.form.get('min_cluster_size', 15))
+                    result = run_dbscan(df, selected_cols, output_dir, algorithm=algorithm, eps=eps,
+                                        min_samples=min_samples, min_cluster_size=min_cluster_size,
+                                        name_prefix=prefix)
+                    if algorithm == 'dbscan':
+                        graph_name = f"DBSCAN (eps={eps}, min_samples={min_samples})"
+                    else:
+                        graph_name = f"HDBSCAN (min_cluster_size={min_cluster_size})"
+                    plot_key = 'density_plot'
             
             # Save to database
             if result and result.get(plot_key):
@@ -482,7 +594,8 @@ def clustering(dataset_id):
                            dataset_id=dataset_id,
                            numeric_cols=numeric_cols,
                            result=result,
-                           graphs=graphs)
+                           graphs=graphs,
+                           render_jobs=_render_polls(queued))
 
 @analyst.route('/dataset/<int:dataset_id>/timeseries', methods=['GET', 'POST'])
 @login_required
@@ -500,9 +613,11 @@ def time_series_analysis(dataset_id):
 
     date_cols = [c for c in df.columns if np.issubdtype(df[c].dtype, np.datetime64) or df[c].dtype == 'object']
     num_cols = df.select_dtypes(include='number').columns.tolist()
+    cat_cols = df.select_dtypes(include=['object', 'category']).columns.tolist()  # batch group-by choices
 
     result = None
     method = None
+    queued = {}  # charts handed to the render pool, polled by the page
 
     if request.method == 'POST':
         method = request.form.get('method')
@@ -513,66 +628,164 @@ def time_series_analysis(dataset_id):
         output_dir = os.path.join('app', 'static', 'img')
         os.makedirs(output_dir, exist_ok=True)
 
-        if not date_col or not value_col:
+        batch = method == 'batch_forecast'
+        batch_cols = request.form.getlist('batch_value_cols') or ([value_col] if value_col else [])
+        batch_group = request.form.get('batch_group_col') or None
+        if method == 'anomaly':
+            # several columns or a group column turn anomaly detection into a batch run
+            batch_cols = request.form.getlist('anomaly_value_cols') or ([value_col] if value_col else [])
+            batch_group = request.form.get('anomaly_group_col') or None
+            batch = len(batch_cols) > 1 or batch_group is not None
+
+        if not date_col or not (batch_cols if batch else value_col):
             flash("Please select both date and value columns.", "danger")
             return render_template('time_series.html',
                                    dataset_id=dataset_id,
                                    date_cols=df.columns.tolist(),
                                    num_cols=num_cols,
+                                   cat_cols=cat_cols,
                                    result=None,
                                    method=method)
 
         try:
-            series = prepare_series(df, date_col, value_col, freq=freq, agg=agg)
+            if batch:
+                panel = prepare_panel(df, date_col, batch_cols, group_col=batch_group, freq=freq, agg=agg)
+            else:
+                series = prepare_series(df, date_col, value_col, freq=freq, agg=agg)
         except Exception as e:
             flash(f"Error preparing series: {e}", "danger")
             return render_template('time_series.html',
                                    dataset_id=dataset_id,
                                    date_cols=df.columns.tolist(),
                                    num_cols=num_cols,
+                                   cat_cols=cat_cols,
                                    result=None,
                                    method=method)
 
-        name_prefix = f"ts_{dataset_id}_{method}_{value_col}"
+        # per-request prefix: charts render in the background, so concurrent runs must not share files
+        name_prefix = f"ts_{dataset_id}_{method}_{'batch' if batch else value_col}_{uuid.uuid4().hex}"
+        # identifies the series a persisted ARIMA / Holt-Winters model was fitted on
+        model_key = f"{dataset_id}:{date_col}:{value_col}:{freq}:{agg}"
 
         try:
-            if method == 'moving_average':
-                window = int(request.form.get('ma_window', 3))
-                result = moving_average(series, window=window, output_dir=output_dir, name_prefix=name_prefix)
-                graph_name = f"Moving Average - {value_col} (window={window})"
-
-            elif method == 'exp_smoothing':
-                trend = request.form.get('trend', 'add')
-                seasonal = request.form.get('seasonal', 'none')
-                seasonal_periods = request.form.get('seasonal_periods', '')
-                seasonal_periods = int(seasonal_periods) if seasonal_periods else None
-                result = run_exponential_smoothing(series, trend=trend, seasonal=seasonal,
-                                                   seasonal_periods=seasonal_periods,
+            with deferred_rendering() as queued:
+                if method == 'moving_average':
+                    window = int(request.form.get('ma_window', 3))
+                    result = moving_average(series, window=window, output_dir=output_dir, name_prefix=name_prefix)
+                    graph_name = f"Moving Average - {value_col} (window={window})"
+
+                elif method == 'rolling_features':
+                    windows = [int(w) for w in request.form.get('rf_windows', '3,6,12,24').replace(' ', '').split(',') if w]
+                    stats = request.form.getlist('rf_stats') or ['mean', 'std', 'min', 'max', 'ewma']
+                    result = rolling_features(series, windows=windows, stats=stats,
+                                              output_dir=output_dir, name_prefix=name_prefix)
+                    graph_name = f"Rolling Statistics - {value_col} (windows {','.join(map(str, result['windows']))})"
+
+                elif method == 'exp_smoothing':
+                    trend = request.form.get('trend', 'add')
+                    seasonal = request.form.get('seasonal', 'none')
+                    seasonal_periods = request.form.get('seasonal_periods', '')
+                    seasonal_periods = int(seasonal_periods) if seasonal_periods else None
+                    result = run_exponential_smoothing(series, trend=trend, seasonal=seasonal,
+                                                       seasonal_periods=seasonal_periods,
+                                                       output_dir=output_dir, name_prefix=name_prefix,
+                                                       model_key=model_key,
+                                                       refit=bool(request.form.get('es_refit')))
+                    graph_name = f"Exponential Smoothing - {value_col}"
+
+                elif method == 'arima':
+                    p = int(request.form.get('arima_p', 1))
+                    d = int(request.form.get('arima_d', 1))
+                    q = int(request.form.get('arima_q', 1))
+                    steps = int(request.form.get('forecast_steps', 12))
+                    result = run_arima(series, order=(p, d, q), forecast_steps=steps,
+                                       output_dir=output_dir, name_prefix=name_prefix,
+                                       model_key=model_key, refit=bool(request.form.get('arima_refit')))
+                    graph_name = f"ARIMA({p},{d},{q}) - {value_col}"
+
+                elif method == 'arima_auto':
+                    max_p = int(request.form.get('auto_max_p', 3))
+                    max_q = int(request.form.get('auto_max_q', 3))
+                    auto_d = request.form.get('auto_d', '')
+                    auto_d = int(auto_d) if auto_d else None
+                    criterion = request.form.get('auto_criterion', 'aic')
+                    steps = int(request.form.get('auto_forecast_steps', 12))
+                    result = run_arima_auto(series, max_p=max_p, max_q=max_q, d=auto_d,
+                                            criterion=criterion, forecast_steps=steps,
+                                            output_dir=output_dir, name_prefix=name_prefix)
+                    p, d, q = result['order']
+                    graph_name = f"Auto ARIMA({p},{d},{q}) - {value_col}"
+
+                elif method == 'batch_forecast':
+                    model = request.form.get('batch_model', 'exp_smoothing')
+                    order = (int(request.form.get('batch_p', 1)),
+                             int(request.form.get('batch_d', 1)),
+                             int(request.form.get('batch_q', 1)))
+                    seasonal_periods = request.form.get('batch_seasonal_periods', '')
+                    seasonal_periods = int(seasonal_periods) if seasonal_periods else None
+                    if request.form.get('batch_auto_period'):
+                        seasonal_periods = 'auto'
+                    steps = int(request.form.get('batch_forecast_steps', 12))
+                    result = run_batch_forecast(panel, model=model, order=order,
+                                                seasonal_periods=seasonal_periods, forecast_steps=steps,
+                                                output_dir=output_dir, name_prefix=name_prefix,
+                                                per_series_plots=bool(request.form.get('batch_plots')))
+                    graph_name = f"Batch Forecast - {result['n_series']} series"
+
+                elif method == 'backtest':
+                    model = request.form.get('bt_model', 'arima')
+                    order = (int(request.form.get('bt_p', 1)),
+                             int(request.form.get('bt_d', 1)),
+                             int(request.form.get('bt_q', 1)))
+                    seasonal_periods = request.form.get('bt_seasonal_periods', '')
+                    seasonal_periods = int(seasonal_periods) if seasonal_periods else None
+                    result = run_backtest(series, model=model, order=order,
+                                          trend=request.form.get('bt_trend', 'add'),
+                                          seasonal_periods=seasonal_periods,
+                                          horizon=int(request.form.get('bt_horizon', 12)),
+                                          n_origins=int(request.form.get('bt_origins', 10)),
+                                          window=request.form.get('bt_window', 'expanding'),
+                                          output_dir=output_dir, name_prefix=name_prefix)
+                    graph_name = f"Backtest ({model}, {result['window']}) - {value_col}"
+
+                elif method == 'decomposition':
+                    model = request.form.get('decomp_model', 'additive')
+                    decomp_method = request.form.get('decomp_method', 'classical')
+                    period = [int(p) for p in request.form.get('decomp_period', '').replace(' ', '').split(',') if p]
+                    period = (period[0] if len(period) == 1 else period) or None
+                    result = run_seasonal_decomposition(series, model=model, period=period,
+                                                        output_dir=output_dir, name_prefix=name_prefix,
+                                                        method=decomp_method,
+                                                        robust=bool(request.form.get('decomp_robust')))
+                    graph_name = f"Seasonal Decomposition - {value_col}"
+
+                elif method == 'period_detection':
+                    max_period = request.form.get('pd_max_period', '')
+                    result = run_period_detection(series, max_period=int(max_period) if max_period else None,
+                                                  output_dir=output_dir, name_prefix=name_prefix)
+                    graph_name = f"Seasonality Detection - {value_col}"
+
+                elif method == 'anomaly':
+                    detector = request.form.get('anomaly_method', 'robust_z')
+                    window = int(request.form.get('anomaly_window', 30))
+                    threshold = float(request.form.get('anomaly_threshold', 3.5))
+                    if batch:
+                        result = run_anomaly_batch(panel, method=detector, window=window, threshold=threshold,
                                                    output_dir=output_dir, name_prefix=name_prefix)
-                graph_name = f"Exponential Smoothing - {value_col}"
-
-            elif method == 'arima':
-                p = int(request.form.get('arima_p', 1))
-                d = int(request.form.get('arima_d', 1))
-                q = int(request.form.get('arima_q', 1))
-                steps = int(request.form.get('forecast_steps', 12))
-                result = run_arima(series, order=(p, d, q), forecast_steps=steps,
-                                   output_dir=output_dir, name_prefix=name_prefix)
-                graph_name = f"ARIMA({p},{d},{q}) - {value_col}"
-
-            elif method == 'decomposition':
-                model = request.form.get('decomp_model', 'additive')
-                period = int(request.form.get('decomp_period', 12))
-                result = run_seasonal_decomposition(series, model=model, period=period,
-                                                    output_dir=output_dir, name_prefix=name_prefix)
-                graph_name = f"Seasonal Decomposition - {value_col}"
-
-            elif method == 'trend':
-                result = run_trend_analysis(series, output_dir=output_dir, name_prefix=name_prefix)
-                graph_name = f"Trend Analysis - {value_col}"
+                        graph_name = f"Anomaly Detection - {result['n_series']} series"
+                    else:
+                        period = request.form.get('anomaly_period', '')
+                        result = run_anomaly_detection(series, method=detector, window=window, threshold=threshold,
+                                                       period=int(period) if period else None,
+                                                       output_dir=output_dir, name_prefix=name_prefix)
+                        graph_name = f"Anomaly Detection - {value_col}"
+
+                elif method == 'trend':
+                    result = run_trend_analysis(series, output_dir=output_dir, name_prefix=name_prefix)
+                    graph_name = f"Trend Analysis - {value_col}"
 
-            else:
-                flash("Unknown method.", "danger")
+                else:
+                    flash("Unknown method.", "danger")
                 
             # Save to database
             if result and result.get('plot'):
@@ -605,9 +818,33 @@ def time_series_analysis(dataset_id):
                            dataset_id=dataset_id,
                            date_cols=df.columns.tolist(),
                            num_cols=num_cols,
+                           cat_cols=cat_cols,
                            result=result,
                            method=method,
-                           graphs=graphs)
+                           graphs=graphs,
+                           render_jobs=_render_polls(queued))
+
+@analyst.route('/dataset/<int:dataset_id>/timeseries/rolling/<cache_key>.csv')
+@login_required
+def rolling_features_csv(dataset_id, cache_key):
+    """Stream cached rolling features as CSV without materializing the whole file"""
+    if not cache_key.isalnum():
+        return Response(status=404)
+    try:
+        chunks = iter_rolling_csv(cache_key)
+        first = next(chunks)
+    except ValueError:
+        return Response(status=404)
+
+    def generate():
+        yield first
+        yield from chunks
+
+    return Response(
+        generate(),
+        mimetype='text/csv',
+        headers={'Content-Disposition': f'attachment; filename="rolling_features_{dataset_id}.csv"'}
+    )
 
 @analyst.route('/dataset/<int:dataset_id>/matrix', methods=['GET', 'POST'])
 @login_required
@@ -629,6 +866,7 @@ def matrix_operations(dataset_id):
 
     result = None
     method = None
+    queued = {}  # charts handed to the render pool, polled by the page
 
     if request.method == 'POST':
         method = request.form.get('method')
@@ -645,7 +883,10 @@ def matrix_operations(dataset_id):
 
         output_dir = os.path.join('app', 'static', 'img')
         os.makedirs(output_dir, exist_ok=True)
-        prefix = f"matrix_{dataset_id}"
+        # outputs are written in the background: unique names per run
+        prefix = f"matrix_{dataset_id}_{uuid.uuid4().hex}"
+        # co-moment state is kept per dataset and updated when rows are appended
+        state_key = f"matrix:{dataset_id}:{request.form.get('na_policy')}"
 
         try:
             if method == 'correlation':
@@ -654,7 +895,12 @@ def matrix_operations(dataset_id):
                 result = compute_correlation(
                     df, selected_cols, method=corr_method,
                     handle_na=na_policy, output_dir=output_dir,
-                    name_prefix=prefix
+                    name_prefix=prefix,
+                    top_k=int(request.form.get('top_k', 10)),
+                    pair_threshold=float(request.form.get('pair_threshold') or 0),
+                    pairs_csv=bool(request.form.get('pairs_csv')),
+                    significance=bool(request.form.get('significance')),
+                    state_key=state_key, render=False
                 )
                 
                 # Save correlation matrix to database
@@ -681,7 +927,7 @@ def matrix_operations(dataset_id):
                 result = compute_covariance(
                     df, selected_cols, ddof=ddof,
                     handle_na=na_policy, output_dir=output_dir,
-                    name_prefix=prefix
+                    name_prefix=prefix, state_key=state_key, render=False
                 )
                 
                 # Save covariance matrix to database
@@ -703,6 +949,16 @@ def matrix_operations(dataset_id):
                     flash(f"Covariance matrix '{graph_name}' saved successfully!", "success")
             else:
                 flash("Unknown method selected.", "danger")
+
+            # The heatmap is drawn by the render pool; the page polls for it
+            if result:
+                try:
+                    path = heatmap_path(result['heatmap_args'])
+                    queued[path] = render_service.submit('matrix_heatmap', **result['heatmap_args'])
+                    result['render_plot'] = os.path.basename(path)
+                except RuntimeError as e:
+                    discard_matrix_source(result['heatmap_args'])
+                    flash(f"Heatmap skipped: {e}", "warning")
                 
         except Exception as e:
             flash(f"Computation error: {e}", "danger")
@@ -719,7 +975,18 @@ def matrix_operations(dataset_id):
                            numeric_cols=numeric_cols,
                            method=method,
                            result=result,
-                           graphs=graphs)
+                           graphs=graphs,
+                           render_jobs=_render_polls(queued))
+
+@analyst.route('/render/<job_id>')
+@login_required
+def render_status(job_id):
+    """Poll a chart queued on the render service"""
+    try:
+        status = render_service.status(job_id)
+    except ValueError as e:
+        return jsonify({"state": "failed", "error": str(e)}), 404
+    return jsonify(status)
 
 @analyst.route('/dataset/<int:dataset_id>/density-curve', methods=['GET', 'POST'])
 @login_required
@@ -780,6 +1047,7 @@ def visualizations(dataset_id):
     cat_cols = [c for c in all_cols if c not in num_cols]
 
     result = None
+    queued = {}  # charts handed to the render pool, polled by the page
     chart_type = request.form.get('chart_type') if request.method == 'POST' else None
     subtype = request.form.get('subtype') if request.method == 'POST' else None
 
@@ -846,8 +1114,9 @@ def visualizations(dataset_id):
             os.makedirs(output_html_dir, exist_ok=True)
 
             prefix = f"viz_{dataset_id}"
-            result = render_chart(df, cfg, output_img_dir, output_html_dir, prefix,
-                                  dataset_id=dataset_id, user_id=current_user.id)
+            with deferred_rendering() as queued:
+                result = render_chart(df, cfg, output_img_dir, output_html_dir, prefix,
+                                      dataset_id=dataset_id, user_id=current_user.id)
             
             # Save graph to database after successful creation
             if result and result.get('image_path'):
@@ -897,7 +1166,8 @@ def visualizations(dataset_id):
                            chart_type=chart_type, 
                            subtype=subtype,
                            df_html=df_html,
-                           graphs=graphs)
+                           graphs=graphs,
+                           render_jobs=_render_polls(queued))
 
 
 @analyst.route('/download_graph/<int:graph_id>')
@@ -57,30 +57,32 @@ document.addEventListener('DOMContentLoaded', function() {
     createCheckboxContainers();
 
     // Algorithm selection toggle
+    const optionBlocks = {
+        'kmeans': kmeansOptions,
+        'kmeans_sweep': document.getElementById('sweep-options'),
+        'hac': hacOptions,
+        'dbscan': document.getElementById('density-options'),
+        'hdbscan': document.getElementById('density-options')
+    };
+
     function toggleAlgorithmOptions() {
-        const selectedAlgorithm = algorithmSelect.value;
-        
-        if (selectedAlgorithm === 'kmeans') {
-            kmeansOptions.style.display = 'block';
-            hacOptions.style.display = 'none';
-            
-            // Add smooth reveal animation
-            kmeansOptions.style.opacity = '0';
-            kmeansOptions.style.transform = 'translateY(-10px)';
-            setTimeout(() => {
-                kmeansOptions.style.opacity = '1';
-                kmeansOptions.style.transform = 'translateY(0)';
-            }, 10);
-        } else if (selectedAlgorithm === 'hac') {
-            kmeansOptions.style.display = 'none';
-            hacOptions.style.display = 'block';
-            
+        const selectedBlock = optionBlocks[algorithmSelect.value];
+
+        Object.values(optionBlocks).forEach(block => {
+            if (block && block !== selectedBlock) {
+                block.style.display = 'none';
+            }
+        });
+
+        if (selectedBlock) {
+            selectedBlock.style.display = 'block';
+
             // Add smooth reveal animation
-            hacOptions.style.opacity = '0';
-            hacOptions.style.transform = 'translateY(-10px)';
+            selectedBlock.style.opacity = '0';
+            selectedBlock.style.transform = 'translateY(-10px)';
             setTimeout(() => {
-                hacOptions.style.opacity = '1';
-                hacOptions.style.transform = 'translateY(0)';
+                selectedBlock.style.opacity = '1';
+                selectedBlock.style.transform = 'translateY(0)';
             }, 10);
         }
     }
@@ -232,7 +234,10 @@ document.addEventListener('DOMContentLoaded', function() {
     // Add tooltip functionality for algorithm types
     const algorithmTooltips = {
         'kmeans': 'K-Means clustering partitions data into k clusters where each observation belongs to the cluster with the nearest mean.',
-        'hac': 'Hierarchical clustering creates a tree of clusters (dendrogram) that can be cut at different levels to get different numbers of clusters.'
+        'kmeans_sweep': 'Fits K-Means for k = 2..K in parallel and recommends the k with the best silhouette score, with an elbow chart of the inertia.',
+        'hac': 'Hierarchical clustering creates a tree of clusters (dendrogram) that can be cut at different levels to get different numbers of clusters.',
+        'dbscan': 'DBSCAN groups points that have at least min_samples neighbors within eps; isolated points are labelled as noise.',
+        'hdbscan': 'HDBSCAN builds a hierarchy of density levels and keeps the most stable clusters, so no eps is needed.'
     };
 
     // Create tooltip element
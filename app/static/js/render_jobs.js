@@ -0,0 +1,35 @@
+// static/js/render_jobs.js
+// Charts are drawn by the render pool after the page is sent; the route lists them in
+// #render-jobs as {chart src: status url}. Hide each chart until its job is done.
+document.addEventListener('DOMContentLoaded', () => {
+  const jobs = JSON.parse(document.getElementById('render-jobs').textContent);
+  const charts = Array.from(document.querySelectorAll('img[src], iframe[src]'));
+
+  Object.entries(jobs).forEach(([src, statusUrl]) => {
+    charts.filter((el) => el.getAttribute('src') === src).forEach((el) => {
+      const statusLine = document.createElement('p');
+      statusLine.className = 'meta render-status';
+      statusLine.textContent = 'Rendering chart…';
+      el.parentNode.insertBefore(statusLine, el);
+      el.style.display = 'none';
+
+      function poll(delay) {
+        fetch(statusUrl, { credentials: 'same-origin' })
+          .then((r) => r.json())
+          .then((job) => {
+            if (job.state === 'done') {
+              el.src = src + (src.includes('?') ? '&' : '?') + 't=' + Date.now();
+              el.style.display = '';
+              statusLine.remove();
+            } else if (job.state === 'failed') {
+              statusLine.textContent = 'Chart could not be rendered: ' + (job.error || 'unknown error');
+            } else {
+              setTimeout(() => poll(Math.min(delay * 1.5, 5000)), delay);
+            }
+          })
+          .catch(() => setTimeout(() => poll(5000), 5000));
+      }
+      poll(500);
+    });
+  });
+});
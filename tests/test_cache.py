@@ -0,0 +1,47 @@
+import os
+
+import numpy as np
+import pytest
+
+from analysis_engine import cache
+
+
+@pytest.fixture(autouse=True)
+def _private_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, "CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(cache, "_memory", cache.OrderedDict())
+    monkeypatch.setattr(cache, "_unpruned_bytes", 0)
+    monkeypatch.setattr(cache, "_last_prune", None)
+
+
+def _files():
+    return sorted(name for _, _, names in os.walk(cache.CACHE_DIR) for name in names)
+
+
+def test_prune_drops_least_recently_used(monkeypatch):
+    for i in range(4):
+        cache.save("blob", f"k{i}", np.zeros(1000))
+        os.utime(cache._path("blob", f"k{i}"), (1000 + i, 1000 + i))
+    assert cache.load("blob", "k0") is not None  # a hit makes k0 the most recent entry
+
+    entry = os.path.getsize(cache._path("blob", "k0"))
+    cache._prune(max_bytes=2 * entry)
+    assert _files() == ["k0.pkl", "k3.pkl"]
+
+
+def test_save_prunes_only_when_due(monkeypatch):
+    calls = []
+    monkeypatch.setattr(cache, "_prune", lambda max_bytes=None: calls.append(1))
+    monkeypatch.setattr(cache, "MAX_DISK_BYTES", 20 * 100_000)
+
+    cache.save("blob", "first", b"x")
+    assert len(calls) == 1  # the first save of a process checks the size
+    for i in range(10):
+        cache.save("blob", f"small{i}", b"x")
+    assert len(calls) == 1  # small saves within PRUNE_INTERVAL do not walk the cache
+    cache.save("blob", "big", b"x" * 100_000)
+    assert len(calls) == 2  # MAX_DISK_BYTES / 20 written since the last check
+
+    monkeypatch.setattr(cache, "_last_prune", cache._last_prune - cache.PRUNE_INTERVAL)
+    cache.save("blob", "later", b"x")
+    assert len(calls) == 3
@@ -0,0 +1,89 @@
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.cluster.hierarchy import fcluster, linkage
+from sklearn.cluster import DBSCAN
+from sklearn.metrics import adjusted_rand_score
+from sklearn.preprocessing import StandardScaler
+
+from analysis_engine import cache
+from analysis_engine.clustering import run_dbscan, run_hac, run_kmeans, run_kmeans_sweep
+
+
+@pytest.fixture(autouse=True)
+def _private_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, "CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(cache, "_memory", cache.OrderedDict())
+
+
+def _blobs(n_per=200, centers=((0, 0, 0), (8, 8, 0), (0, 8, 8), (8, 0, 8)), seed=0):
+    rng = np.random.default_rng(seed)
+    points = np.vstack([np.asarray(c) + rng.normal(size=(n_per, len(c))) for c in centers])
+    labels = np.repeat(np.arange(len(centers)), n_per)
+    order = rng.permutation(len(points))
+    return pd.DataFrame(points[order], columns=["a", "b", "c"]), labels[order]
+
+
+@pytest.mark.parametrize("mode", ["full", "minibatch"])
+def test_kmeans_warm_starts_after_rows_are_appended(tmp_path, mode):
+    df, _ = _blobs()
+    first = run_kmeans(df, ["a", "b"], 3, str(tmp_path), mode=mode, state_key="ds1", name_prefix="r1")
+    assert first["warm_started"] is False
+
+    more, _ = _blobs(seed=1)
+    grown = pd.concat([df, more], ignore_index=True)
+    again = run_kmeans(grown, ["a", "b"], 3, str(tmp_path), mode=mode, state_key="ds1", name_prefix="r2")
+    assert again["warm_started"] is True
+
+    # other columns or another dataset start from scratch
+    assert run_kmeans(grown, ["a", "c"], 3, str(tmp_path), mode=mode, state_key="ds1",
+                      name_prefix="r3")["warm_started"] is False
+    assert run_kmeans(grown, ["a", "b"], 3, str(tmp_path), mode=mode, state_key="ds2",
+                      name_prefix="r4")["warm_started"] is False
+
+
+def test_kmeans_sweep_recommends_the_number_of_blobs(tmp_path):
+    df, _ = _blobs()
+    result = run_kmeans_sweep(df, ["a", "b", "c"], 8, str(tmp_path), n_jobs=2)
+    assert [s["k"] for s in result["scores"]] == list(range(2, 9))
+    assert result["recommended_k"] == 4
+    assert result["elbow_k"] == 4
+    assert (tmp_path / result["sweep_plot"]).exists()
+
+
+def test_hac_labels_match_direct_linkage(tmp_path):
+    df, _ = _blobs(n_per=50)
+    columns = ["a", "b", "c"]
+    direct = linkage(StandardScaler().fit_transform(df[columns]), method="ward")
+
+    for n_clusters, cached in ((4, False), (3, True)):  # a new cut reuses the cached linkage
+        result = run_hac(df, columns, str(tmp_path), n_clusters=n_clusters, name_prefix=f"hac{n_clusters}")
+        assert result["linkage_cached"] is cached
+        labels = pd.read_csv(tmp_path / result["labels_csv"])
+        assert labels["row"].tolist() == df.index.tolist()
+        expected = fcluster(direct, t=n_clusters, criterion="maxclust") - 1
+        np.testing.assert_array_equal(labels["cluster"], expected)
+
+
+def test_hac_on_micro_clusters_recovers_blobs(tmp_path):
+    df, truth = _blobs()
+    result = run_hac(df, ["a", "b", "c"], str(tmp_path), n_clusters=4, max_rows=300, n_micro=50)
+    assert result["precluster"] is True and result["n_leaves"] == 50
+    labels = pd.read_csv(tmp_path / result["labels_csv"])["cluster"]
+    assert adjusted_rand_score(truth, labels) == 1.0
+
+
+def test_dbscan_on_cached_radius_graph_matches_sklearn(tmp_path):
+    df, _ = _blobs()
+    df.iloc[:5] = df.iloc[5:10].to_numpy()  # duplicate rows: zero distances must survive filtering
+    columns = ["a", "b", "c"]
+    X_scaled = StandardScaler().fit_transform(df[columns])
+
+    # widest eps first, then a smaller one filtered from the cached graph, then a new query
+    for eps, reused in ((0.3, False), (0.15, True), (0.3, True), (0.4, False)):
+        result = run_dbscan(df, columns, str(tmp_path), eps=eps, min_samples=5, n_jobs=1,
+                            name_prefix=f"db{eps}")
+        assert result["index_reused"] is reused
+        labels = pd.read_csv(tmp_path / result["labels_csv"])["cluster"]
+        expected = DBSCAN(eps=eps, min_samples=5).fit_predict(X_scaled)
+        np.testing.assert_array_equal(labels, expected, err_msg=f"eps={eps}")
@@ -0,0 +1,100 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from analysis_engine import cache, dimensionality
+from analysis_engine.dimensionality import _fit_pca, _project_out_of_sample, _sparse_mca, run_embedding
+
+
+@pytest.fixture(autouse=True)
+def _private_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, "CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(cache, "_memory", cache.OrderedDict())
+
+
+def _dense_mca(df, n_components):
+    """Textbook correspondence analysis of the dense indicator matrix."""
+    indicators = pd.get_dummies(df.fillna("nan"), prefix_sep="__")
+    Z = indicators.to_numpy(dtype=float)
+    P = Z / Z.sum()
+    r, c = P.sum(axis=1), P.sum(axis=0)
+    S = (P - np.outer(r, c)) / np.sqrt(np.outer(r, c))
+    U, s, Vt = np.linalg.svd(S, full_matrices=False)
+    U, s, V = U[:, :n_components], s[:n_components], Vt[:n_components].T
+    rows = U * s / np.sqrt(r)[:, None]
+    cols = pd.DataFrame(V * s / np.sqrt(c)[:, None], index=indicators.columns)
+    return rows, cols, s ** 2, (S ** 2).sum()
+
+
+def test_sparse_mca_matches_dense_correspondence_analysis():
+    rng = np.random.default_rng(0)
+    n = 400
+    colour = rng.choice(["red", "green", "blue"], n, p=[0.5, 0.3, 0.2])
+    df = pd.DataFrame({
+        "colour": colour,
+        # related to colour, so the first axes carry real structure
+        "size": np.where(colour == "red", rng.choice(["S", "M"], n), rng.choice(["M", "L", "XL"], n)),
+        "shape": rng.choice(["round", "square"], n),
+    })
+    df.loc[rng.choice(n, 25, replace=False), "shape"] = np.nan  # missing values are their own category
+    rows, cols, eigenvalues, explained = _sparse_mca(df, n_components=3)
+    ref_rows, ref_cols, ref_eigenvalues, total_inertia = _dense_mca(df, 3)
+
+    np.testing.assert_allclose(eigenvalues, ref_eigenvalues, rtol=1e-8)
+    np.testing.assert_allclose(explained, ref_eigenvalues / total_inertia, rtol=1e-8)
+    # axes are defined up to sign
+    signs = np.sign((rows.to_numpy() * ref_rows).sum(axis=0))
+    np.testing.assert_allclose(rows.to_numpy() * signs, ref_rows, atol=1e-8)
+    np.testing.assert_allclose(cols.loc[ref_cols.index].to_numpy() * signs, ref_cols, atol=1e-8)
+
+
+def test_incremental_pca_handles_short_chunks(monkeypatch):
+    rng = np.random.default_rng(0)
+    latent = rng.normal(size=(503, 2))
+    df = pd.DataFrame(latent @ rng.normal(size=(2, 5)) + 0.1 * rng.normal(size=(503, 5)), columns=list("abcde"))
+    df.iloc[:48] = np.nan  # the first block keeps 2 rows, fewer than n_components
+    # 503 rows in blocks of 50 leave a 3-row tail
+    monkeypatch.setattr(dimensionality, "PCA_CHUNK_ROWS", 50)
+
+    fit = _fit_pca(df, list("abcde"), None, 4, "incremental")
+    exact = _fit_pca(df, list("abcde"), None, 4, "exact")
+
+    assert fit["solver"] == "incremental"
+    assert fit["scores"].shape == (455, 2)
+    assert len(fit["explained_variance"]) == 4
+    # the leading axes (the ones behind the scores) match the exact fit
+    np.testing.assert_allclose(fit["explained_variance"][:2], exact["explained_variance"][:2], rtol=1e-6)
+    signs = np.sign((fit["scores"] * exact["scores"]).sum(axis=0))
+    np.testing.assert_allclose(fit["scores"] * signs, exact["scores"], atol=1e-4)
+
+
+def test_out_of_sample_rows_land_next_to_their_fitted_neighbours():
+    rng = np.random.default_rng(0)
+    X_fit, Y_fit = rng.normal(size=(50, 4)), rng.normal(size=(50, 2))
+    # a row equal to a fitted row takes its coordinates; others stay inside the neighbours' hull
+    Y = _project_out_of_sample(X_fit, Y_fit, np.vstack([X_fit[7], rng.normal(size=(20, 4))]), n_jobs=1)
+    assert Y.shape == (21, 2)
+    np.testing.assert_allclose(Y[0], Y_fit[7])
+    assert (Y.min(axis=0) >= Y_fit.min(axis=0)).all() and (Y.max(axis=0) <= Y_fit.max(axis=0)).all()
+
+
+def test_embedding_projects_rows_beyond_the_sample(tmp_path):
+    rng = np.random.default_rng(1)
+    truth = np.repeat(np.arange(3), 100)
+    centers = np.array([[0, 0, 0], [10, 0, 0], [0, 10, 0]])
+    df = pd.DataFrame(centers[truth] + rng.normal(size=(300, 3)), columns=["a", "b", "c"])
+
+    result = run_embedding(df, ["a", "b", "c"], str(tmp_path), perplexity=10, max_points=120, n_jobs=1)
+    assert (result["n_observations"], result["n_fitted"], result["cached"]) == (300, 120, False)
+    assert (tmp_path / result["embedding_plot"]).exists()
+
+    key = cache.fingerprint(df[["a", "b", "c"]], "tsne", 10, 15, 120)
+    emb = cache.load("embedding", key)
+    Y, fitted = emb["coordinates"], emb["fitted"]
+    assert Y.shape == (300, 2) and fitted.sum() == 120
+    # every projected row sits closest to a fitted centroid of its own blob
+    centroids = np.array([Y[fitted & (truth == k)].mean(axis=0) for k in range(3)])
+    nearest = np.argmin(((Y[~fitted, None, :] - centroids) ** 2).sum(axis=-1), axis=1)
+    np.testing.assert_array_equal(nearest, truth[~fitted])
+
+    assert run_embedding(df, ["a", "b", "c"], str(tmp_path), perplexity=10, max_points=120, n_jobs=1)["cached"]
@@ -0,0 +1,115 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+from scipy import stats as sps
+
+from analysis_engine import cache, matrix_tools
+from analysis_engine.matrix_tools import (
+    _discard, _memmap_path, blocked_matrix, MATRIX_TILE,
+    kendall_matrix, spearman_matrix, masked_corr, correlation_pvalues, incremental_matrix
+)
+
+
+@pytest.fixture(autouse=True)
+def _private_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, "CACHE_DIR", str(tmp_path / "cache"))
+
+
+def _frame(n=200, p=6, missing=0.0, seed=0):
+    rng = np.random.default_rng(seed)
+    mixing = rng.normal(size=(p, p))
+    values = rng.normal(size=(n, p)) @ mixing
+    values[:, -1] = np.round(values[:, -1])  # ties
+    if missing:
+        values[rng.random((n, p)) < missing] = np.nan
+    return pd.DataFrame(values, columns=[f"c{i}" for i in range(p)])
+
+
+def test_kendall_matrix_matches_scipy_pairwise_complete():
+    data = _frame(missing=0.1)
+    tau, pvalues = kendall_matrix(data, n_jobs=1)
+    for i in data.columns:
+        for j in data.columns:
+            if i == j:
+                continue
+            pair = data[[i, j]].dropna()
+            expected = sps.kendalltau(pair[i], pair[j])
+            assert tau.loc[i, j] == pytest.approx(expected.statistic, abs=1e-12)
+            assert pvalues.loc[i, j] == pytest.approx(expected.pvalue, rel=1e-9)
+    pd.testing.assert_frame_equal(tau, data.corr(method="kendall"), atol=1e-12)
+
+
+def test_kendall_matrix_pool_matches_in_process(monkeypatch):
+    data = _frame(missing=0.1)
+    expected = kendall_matrix(data, n_jobs=1)
+    monkeypatch.setattr(matrix_tools, "KENDALL_PAIRS_PER_TASK", 4)  # 15 pairs -> 4 batches
+    for got, want in zip(kendall_matrix(data, n_jobs=2), expected):
+        pd.testing.assert_frame_equal(got, want)
+
+
+def test_spearman_matrix_matches_pandas():
+    data = _frame()
+    pd.testing.assert_frame_equal(spearman_matrix(data, n_jobs=1), data.corr(method="spearman"), atol=1e-12)
+
+
+def test_masked_corr_matches_pandas_pairwise_complete():
+    data = _frame(missing=0.2)
+    data["constant"] = 3.0
+    data.loc[::2, "sparse"] = np.arange(0, len(data), 2, dtype=float) ** 0.5  # half the rows only
+    corr, n = masked_corr(data)
+    pd.testing.assert_frame_equal(corr, data.corr(), atol=1e-12)
+    present = data.notna().astype(float)
+    pd.testing.assert_frame_equal(n, present.T @ present)
+
+
+def test_correlation_pvalues_match_pearsonr():
+    data = _frame(n=60, missing=0.15)
+    corr, n = masked_corr(data)
+    pvalues = correlation_pvalues(corr, n)
+    for i in data.columns:
+        for j in data.columns:
+            if i == j:
+                continue
+            pair = data[[i, j]].dropna()
+            assert pvalues.loc[i, j] == pytest.approx(sps.pearsonr(pair[i], pair[j]).pvalue, rel=1e-8)
+
+
+@pytest.mark.parametrize("kind", ["corr", "cov"])
+def test_incremental_matrix_tracks_appended_rows(kind):
+    data = _frame(n=600, p=8, seed=3)
+    reference = {"corr": lambda d: d.corr(), "cov": lambda d: d.cov(ddof=1)}[kind]
+
+    modes = []
+    for end in (200, 350, 350, 600):
+        matrix, update = incremental_matrix(data.iloc[:end], "feed", kind=kind, n_jobs=1)
+        modes.append((update["mode"], update["n_new"]))
+        pd.testing.assert_frame_equal(matrix, reference(data.iloc[:end]), atol=1e-10)
+    assert modes == [("full", 200), ("update", 150), ("reuse", 0), ("update", 250)]
+
+    # editing a row that is already folded into the state forces a full recompute
+    edited = data.copy()
+    edited.iloc[10, 0] += 1.0
+    matrix, update = incremental_matrix(edited, "feed", kind=kind, n_jobs=1)
+    assert update["mode"] == "full"
+    pd.testing.assert_frame_equal(matrix, reference(edited), atol=1e-10)
+
+
+@pytest.mark.parametrize("n_jobs", [1, 2])
+def test_blocked_matrix_matches_pandas_across_tiles(monkeypatch, n_jobs):
+    data = _frame(n=80, p=MATRIX_TILE + 37, seed=4)  # two tiles, the second one partial
+    data["c3"] = 2.0  # constant column -> NaN row and column
+    monkeypatch.setattr(matrix_tools, "MEMMAP_COLUMNS", 500)
+
+    corr = blocked_matrix(data, kind="corr", name_prefix="wide", n_jobs=n_jobs)
+    cov = blocked_matrix(data, kind="cov", ddof=1, name_prefix="wide", n_jobs=n_jobs)
+    pd.testing.assert_frame_equal(corr, data.corr(), atol=1e-12)
+    pd.testing.assert_frame_equal(cov, data.cov(), atol=1e-10)
+
+    # wide results live in memory-mapped files under the cache, removed by _discard
+    paths = [_memmap_path(corr), _memmap_path(cov)]
+    assert all(path and path.startswith(cache.CACHE_DIR) for path in paths)
+    _discard(corr, cov)
+    assert not any(os.path.exists(path) for path in paths)
+    assert corr.iloc[0, 0] == 1.0  # the open mapping stays readable
@@ -0,0 +1,51 @@
+import numpy as np
+import seaborn as sns
+from matplotlib import colors as mcolors
+
+from analysis_engine.figures import subplots
+from analysis_engine.raster import raster_scatter
+
+
+def _legend(ax):
+    handles, labels = ax.get_legend_handles_labels()
+    return {label: mcolors.to_rgb(handle.get_facecolor()[0]) for handle, label in zip(handles, labels)}
+
+
+def test_category_colors_follow_the_given_order():
+    # twelve clusters: "Cluster 10" sorts before "Cluster 2" as a string
+    rng = np.random.default_rng(0)
+    labels = rng.integers(-1, 12, 5000)
+    names = np.where(labels < 0, "Noise", np.char.add("Cluster ", labels.astype(str)))
+    x, y = labels + rng.uniform(-0.2, 0.2, len(labels)), rng.uniform(0, 1, len(labels))
+    palette = sns.color_palette("tab20", 12)
+    order = [f"Cluster {c}" for c in range(12)] + ["Noise"]
+
+    fig, ax = subplots()
+    image = raster_scatter(ax, x, y, categories=names, palette=palette + ["lightgray"], order=order)
+
+    expected = dict(zip(order, [mcolors.to_rgb(c) for c in palette + ["lightgray"]]))
+    assert _legend(ax) == expected
+    # each cluster owns one vertical band of the image, drawn in its own color
+    rgba = image.get_array()
+    xmin, xmax = image.get_extent()[:2]
+    for cluster in range(12):
+        column = int((cluster - xmin) / (xmax - xmin) * rgba.shape[1])
+        filled = rgba[:, column, 3] > 0
+        assert np.allclose(rgba[filled, column, :3], expected[f"Cluster {cluster}"])
+
+
+def test_default_order_sorts_numbers_and_keeps_first_appearance_otherwise():
+    fig, ax = subplots()
+    raster_scatter(ax, [0, 1, 2], [0, 1, 2], categories=[10, 2, 1], palette=["red", "green", "blue"])
+    assert list(_legend(ax)) == ["1", "2", "10"]
+
+    fig, ax = subplots()
+    raster_scatter(ax, [0, 1], [0, 1], categories=["Projected", "Fitted"], palette=["red", "green"])
+    assert _legend(ax) == {"Projected": (1.0, 0.0, 0.0), "Fitted": mcolors.to_rgb("green")}
+
+
+def test_absent_categories_get_no_legend_entry():
+    fig, ax = subplots()
+    raster_scatter(ax, [0, 1], [0, 1], categories=["Cluster 0", "Cluster 1"],
+                   palette=["red", "green", "lightgray"], order=["Cluster 0", "Cluster 1", "Noise"])
+    assert list(_legend(ax)) == ["Cluster 0", "Cluster 1"]
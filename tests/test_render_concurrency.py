@@ -0,0 +1,52 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import matplotlib.image as mpimg
+import matplotlib.pyplot as plt
+
+from analysis_engine import time_series, matrix_tools
+
+
+def _series(seed):
+    rng = np.random.default_rng(seed)
+    index = pd.date_range("2022-01-01", periods=365, freq="D")
+    return pd.Series(np.cumsum(rng.normal(size=len(index))), index=index)
+
+
+def _matrix(seed, p):
+    rng = np.random.default_rng(seed)
+    frame = pd.DataFrame(rng.normal(size=(200, p)), columns=[f"c{i}" for i in range(p)])
+    return frame.corr()
+
+
+CHARTS = {
+    "moving_avg": lambda out, i: time_series.moving_average(_series(i), 14, out, f"s{i}")["plot"],
+    "trend": lambda out, i: time_series.run_trend_analysis(_series(i), out, f"s{i}")["plot"],
+    "corr": lambda out, i: matrix_tools.render_matrix_heatmap(_matrix(i, 8), "corr", f"Correlation {i}", out, f"m{i}"),
+    "cov": lambda out, i: matrix_tools.render_matrix_heatmap(_matrix(i, 30), "cov", f"Covariance {i}", out, f"m{i}"),
+}
+
+
+def _render(chart, seed, output_dir):
+    filename = CHARTS[chart](output_dir, seed)
+    return mpimg.imread(os.path.join(output_dir, filename))
+
+
+def test_charts_render_concurrently_without_crosstalk(tmp_path):
+    # every (chart, seed) drawn once on its own, then many times at once from threads
+    jobs = [(chart, seed) for chart in CHARTS for seed in range(3)]
+    expected = {job: _render(*job, str(tmp_path / "serial" / f"{job[0]}_{job[1]}")) for job in jobs}
+
+    work = [(chart, seed, str(tmp_path / f"run{k}" / f"{chart}_{seed}")) for k in range(4) for chart, seed in jobs]
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        images = list(pool.map(lambda args: _render(*args), work))
+
+    for (chart, seed, _), image in zip(work, images):
+        reference = expected[(chart, seed)]
+        assert image.shape == reference.shape, (chart, seed)
+        assert np.array_equal(image, reference), (chart, seed)
+
+    # nothing went through pyplot, so no figures were left open
+    assert plt.get_fignums() == []
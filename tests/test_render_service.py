@@ -0,0 +1,86 @@
+import os
+import time
+from concurrent.futures import BrokenExecutor
+
+import pytest
+
+from analysis_engine import cache, render_service
+
+
+# renderers run in spawned workers, which import them from this module
+def _write(path):
+    with open(path, "w") as f:
+        f.write("chart")
+    return os.path.basename(path)
+
+
+def _sleep(seconds):
+    time.sleep(seconds)
+    return "slept.png"
+
+
+def _crash():
+    os._exit(1)
+
+
+@pytest.fixture(autouse=True)
+def _service(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, "CACHE_DIR", str(tmp_path / "cache"))
+    for name in ("_write", "_sleep", "_crash"):
+        monkeypatch.setitem(render_service.RENDERERS, name, f"{__name__}:{name}")
+    yield
+    executor = render_service._executor
+    render_service._executor = None
+    if executor is not None:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def _wait(job_id, states=("done", "failed"), limit=60):
+    deadline = time.time() + limit
+    while time.time() < deadline:
+        status = render_service.status(job_id)
+        if status["state"] in states:
+            return status
+        time.sleep(0.05)
+    raise AssertionError(f"job never reached {states}: {status}")
+
+
+def test_job_reaches_done(tmp_path):
+    job = render_service.submit("_write", path=str(tmp_path / "chart.png"))
+    assert _wait(job) == {"state": "done", "plot": "chart.png"}
+    assert (tmp_path / "chart.png").read_text() == "chart"
+
+
+def test_running_state_is_visible_from_the_status_file():
+    job = render_service.submit("_sleep", seconds=3)
+    assert _wait(job, states=("running",))["state"] == "running"
+    assert _wait(job)["state"] == "done"
+
+
+def test_job_over_its_deadline_fails():
+    job = render_service.submit("_sleep", timeout=1, seconds=10)
+    status = _wait(job)
+    assert status["state"] == "failed"
+    assert "too long" in status["error"]
+
+
+def test_dead_worker_fails_its_job_and_the_pool_is_replaced(tmp_path):
+    assert _wait(render_service.submit("_crash"))["state"] == "failed"
+    job = render_service.submit("_write", path=str(tmp_path / "after.png"))
+    assert _wait(job)["state"] == "done"
+
+
+def test_submit_that_cannot_reach_a_pool_marks_the_job_failed(monkeypatch):
+    class Broken:
+        def submit(self, *args, **kwargs):
+            raise BrokenExecutor("worker died")
+
+        def shutdown(self, *args, **kwargs):
+            pass
+
+    monkeypatch.setattr(render_service, "_get_executor", Broken)
+    with pytest.raises(RuntimeError):
+        render_service.submit("_sleep", seconds=0)
+    folder = os.path.join(cache.CACHE_DIR, "render_jobs")
+    (name,) = os.listdir(folder)
+    assert render_service.status(name[:-len(".json")])["state"] == "failed"
@@ -0,0 +1,253 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy import stats as sps
+from statsmodels.tsa.arima.model import ARIMA
+
+from analysis_engine import cache
+from analysis_engine.time_series import (
+    _hybrid_esd, MAD_SCALE, prepare_panel, prepare_series, rolling_features, ROLLING_CHUNK, run_arima_auto,
+    run_backtest, detect_periods, detect_periods_batch, run_seasonal_decomposition
+)
+
+
+@pytest.fixture(autouse=True)
+def _private_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, "CACHE_DIR", str(tmp_path / "cache"))
+
+
+def _naive_hybrid_esd(residuals, max_anomalies, alpha):
+    """Textbook generalized ESD with median / MAD: recompute everything after each removal."""
+    values, positions = residuals.copy(), np.arange(len(residuals))
+    removed, stats_ = [], []
+    for _ in range(max_anomalies):
+        if len(values) < 3:
+            break
+        med = np.median(values)
+        mad = np.median(np.abs(values - med)) * MAD_SCALE
+        if mad <= 0:
+            break
+        deviation = np.abs(values - med)
+        i = int(np.argmax(deviation))
+        removed.append(positions[i])
+        stats_.append(deviation[i] / mad)
+        values, positions = np.delete(values, i), np.delete(positions, i)
+
+    n_anomalies = 0
+    for m, stat in enumerate(stats_):
+        remaining = len(residuals) - m
+        t = sps.t.ppf(1 - alpha / (2 * remaining), remaining - 2)
+        if stat > (remaining - 1) * t / np.sqrt((remaining - 2 + t ** 2) * remaining):
+            n_anomalies = m + 1
+    return set(removed[:n_anomalies])
+
+
+def test_hybrid_esd_matches_naive_reference():
+    rng = np.random.default_rng(0)
+    for _ in range(300):
+        n = int(rng.integers(10, 200))
+        residuals = rng.normal(size=n)
+        spikes = rng.choice(n, int(rng.integers(0, 6)), replace=False)
+        residuals[spikes] += rng.choice([-1, 1], len(spikes)) * rng.uniform(3, 8, len(spikes))
+        max_anomalies = max(1, n // 5)
+
+        found = set(_hybrid_esd(residuals, max_anomalies, 0.05).tolist())
+        assert found == _naive_hybrid_esd(residuals, max_anomalies, 0.05)
+
+
+@pytest.mark.parametrize("agg", ["mean", "sum", "max", "min"])
+@pytest.mark.parametrize("freq", [None, "MS", "W"])
+def test_prepare_panel_matches_prepare_series_per_group(agg, freq):
+    rng = np.random.default_rng(1)
+    n = 300
+    df = pd.DataFrame({
+        "date": pd.Timestamp("2022-01-01") + pd.to_timedelta(rng.integers(0, 700, n), "D"),
+        "region": rng.choice(["North", "South", "East"], n),
+        "sales": rng.normal(size=n),
+        "units": rng.normal(size=n),
+    })
+    df.loc[rng.choice(n, 30), "sales"] = np.nan
+    # North has no rows at all in March: that bin must still be there after resampling
+    df = df[~((df["region"] == "North") & (df["date"].dt.month == 3))]
+    df["date"] = df["date"].dt.strftime("%Y-%m-%d")
+
+    panel = prepare_panel(df, "date", ["sales", "units"], group_col="region", freq=freq, agg=agg)
+    for region in ["North", "South", "East"]:
+        rows = df[df["region"] == region].reset_index(drop=True)
+        for col in ["sales", "units"]:
+            expected = prepare_series(rows, "date", col, freq=freq, agg=agg)
+            pd.testing.assert_series_equal(panel[f"{region} | {col}"], expected,
+                                           check_names=False, check_freq=False)
+
+
+def test_prepare_series_returns_a_private_copy():
+    df = pd.DataFrame({"date": ["2023-01-01", "2023-01-02", "2023-01-03"], "value": [1.0, 2.0, 3.0]})
+    first = prepare_series(df, "date", "value")
+    first.iloc[0] = 100.0
+    assert prepare_series(df, "date", "value").iloc[0] == 1.0
+    second = prepare_series(df, "date", "value")
+    second.iloc[1] = 200.0
+    assert prepare_series(df, "date", "value").iloc[1] == 2.0
+
+
+def test_integer_year_columns_are_read_as_years():
+    df = pd.DataFrame({"date": [2021, 2022, 2023, 2022], "value": [1.0, 2.0, 3.0, 4.0]})
+    series = prepare_series(df, "date", "value")
+    assert series.index.equals(pd.DatetimeIndex(["2021-01-01", "2022-01-01", "2023-01-01"]))
+    assert series.tolist() == [1.0, 3.0, 3.0]
+
+    floats = prepare_series(df.astype({"date": float}), "date", "value")
+    assert floats.index.equals(series.index)
+
+    # other numbers are not years: they keep pd.to_datetime's epoch meaning
+    epochs = pd.DataFrame({"date": [1_600_000_000, 1_600_086_400], "value": [1.0, 2.0]})
+    parsed = prepare_series(epochs, "date", "value")
+    assert parsed.index.equals(pd.DatetimeIndex(pd.to_datetime(epochs["date"])))
+
+
+def _exact_rolling(x, window, reduce):
+    """Trailing-window statistic evaluated window by window (partial windows at the start)."""
+    head = [reduce(x[:i + 1]) for i in range(min(window - 1, len(x)))]
+    full = reduce(sliding_window_view(x, window), axis=-1)
+    return np.concatenate([head, full])
+
+
+def test_rolling_features_match_exact_windows(tmp_path):
+    # long enough to cross several cumulative-sum restarts, on a large offset to expose rounding
+    # (pandas' online rolling std is off by ~1e-3 on this series, so the reference is computed directly)
+    rng = np.random.default_rng(2)
+    n = 3 * ROLLING_CHUNK + 123
+    series = pd.Series(1e6 + np.cumsum(rng.normal(size=n)),
+                       index=pd.date_range("2000-01-01", periods=n, freq="h"))
+    windows = [1, 7, 50, 600]
+    result = rolling_features(series, windows=windows, output_dir=str(tmp_path), name_prefix="rf")
+    frame = cache.load("rolling", result["cache_key"])
+
+    x = series.to_numpy()
+    with np.errstate(divide="ignore", invalid="ignore"), warnings.catch_warnings():
+        warnings.simplefilter("ignore")  # std of one value
+        for w in windows:
+            expected = {
+                "mean": _exact_rolling(x, w, np.mean),
+                "std": _exact_rolling(x, w, lambda v, axis=None: np.std(v, axis=axis, ddof=1)),
+                "min": _exact_rolling(x, w, np.min),
+                "max": _exact_rolling(x, w, np.max),
+                "ewma": series.ewm(span=w).mean().to_numpy(),
+            }
+            for stat, values in expected.items():
+                np.testing.assert_allclose(frame[f"{stat}_{w}"], values, rtol=1e-7, err_msg=f"{stat}_{w}")
+
+
+def _ar1(n=400, phi=0.7, seed=0):
+    rng = np.random.default_rng(seed)
+    noise = rng.normal(size=n)
+    x = np.zeros(n)
+    for t in range(1, n):
+        x[t] = phi * x[t - 1] + noise[t]
+    return pd.Series(x, index=pd.date_range("2000-01-01", periods=n, freq="D"))
+
+
+def test_arima_grid_finds_the_ar1_order(tmp_path):
+    series = _ar1()
+    result = run_arima_auto(series, max_p=2, max_q=2, criterion="bic", output_dir=str(tmp_path),
+                            name_prefix="ar1", n_jobs=1)
+    assert result["order"] == [1, 0, 0]
+    assert result["leaderboard"][0]["order"] == [1, 0, 0]
+    assert not any(row["cached"] for row in result["leaderboard"])
+    assert (tmp_path / result["leaderboard_csv"]).exists()
+
+    # a rerun reads every fit from the cache
+    again = run_arima_auto(series, max_p=2, max_q=2, criterion="bic", output_dir=str(tmp_path),
+                           name_prefix="ar1", n_jobs=1)
+    assert again["order"] == [1, 0, 0]
+    assert all(row["cached"] for row in again["leaderboard"])
+
+
+@pytest.mark.parametrize("window", ["expanding", "sliding"])
+def test_backtest_folds_and_errors(tmp_path, window):
+    series = _ar1(n=200) + 50.0
+    result = run_backtest(series, model="arima", order=(1, 0, 0), horizon=5, n_origins=6, window=window,
+                          output_dir=str(tmp_path), name_prefix="bt", n_jobs=1)
+    assert result["n_origins"] == 6
+    table = pd.read_csv(tmp_path / result["backtest_csv"], parse_dates=["origin", "date"])
+    # origins spread from the middle of the series to the last full horizon
+    expected_origins = series.index[np.linspace(100, 195, 6).round().astype(int) - 1]
+    assert list(table["origin"].unique()) == list(expected_origins)
+    assert len(table) == 6 * 5
+
+    # each forecast matches a direct fit on that origin's training window
+    first = table[table["origin"] == expected_origins[0]]
+    direct = ARIMA(series.to_numpy()[:100], order=(1, 0, 0)).fit().forecast(5)
+    np.testing.assert_allclose(first["forecast"], direct, rtol=1e-4)
+
+    err = (table["actual"] - table["forecast"]).abs()
+    by_step = err.groupby(table["step"]).mean()
+    assert [h["mae"] for h in result["by_horizon"]] == pytest.approx(by_step.tolist())
+    assert result["mae"] == pytest.approx(err.mean())
+    assert result["mape"] == pytest.approx((err / table["actual"].abs() * 100).mean())
+
+
+def _hourly(n, periods=(24, 168), seed=0):
+    rng = np.random.default_rng(seed)
+    t = np.arange(n)
+    values = 0.01 * t + rng.normal(scale=0.5, size=n)  # trend + noise
+    for amplitude, period in zip((3.0, 2.0), periods):
+        values += amplitude * np.sin(2 * np.pi * t / period)
+    return pd.Series(values, index=pd.date_range("2024-01-01", periods=n, freq="h"))
+
+
+def test_detect_periods_finds_nested_seasons():
+    found = detect_periods(_hourly(24 * 7 * 8))
+    assert sorted(f["period"] for f in found) == [24, 168]
+    assert found[0]["period"] == 24  # the stronger season comes first
+
+    noise = pd.Series(np.random.default_rng(1).normal(size=1000))
+    assert detect_periods(noise) == []
+
+
+def test_detect_periods_batch_matches_single_series():
+    panel = {"a": _hourly(1344, seed=1), "b": _hourly(1344, periods=(12,), seed=2),
+             "c": _hourly(500, periods=(7,), seed=3), "short": _hourly(5)}
+    batch = detect_periods_batch(panel)
+    assert batch.keys() == panel.keys()
+    for name, series in panel.items():
+        single = detect_periods(series)
+        assert [f["period"] for f in batch[name]] == [f["period"] for f in single]
+        for got, want in zip(batch[name], single):
+            assert (got["power"], got["acf"]) == pytest.approx((want["power"], want["acf"]))
+    assert [f["period"] for f in batch["b"]] == [12]
+    assert [f["period"] for f in batch["c"]] == [7]
+    assert batch["short"] == []
+
+
+def test_stl_components_add_up_and_recover_each_season(tmp_path):
+    n = 24 * 7 * 8
+    t = np.arange(n)
+    daily, weekly = 3.0 * np.sin(2 * np.pi * t / 24), 2.0 * np.sin(2 * np.pi * t / 168)
+    series = _hourly(n)
+    series.iloc[500] += 40.0  # a spike: the robust fit leaves it in the residual
+
+    result = run_seasonal_decomposition(series, period=None, method="stl", output_dir=str(tmp_path),
+                                        name_prefix="stl")
+    assert result["meta"]["detected"] and result["meta"]["period"] == "24, 168"
+    parts = pd.read_csv(tmp_path / result["components_csv"], index_col="date")
+    assert list(parts.columns) == ["observed", "trend", "seasonal_24", "seasonal_168", "resid"]
+    np.testing.assert_allclose(parts[["trend", "seasonal_24", "seasonal_168", "resid"]].sum(axis=1),
+                               series.to_numpy(), atol=1e-9)
+
+    inner = slice(168, -168)  # away from the LOESS edges
+    for column, truth in (("seasonal_24", daily), ("seasonal_168", weekly)):
+        rmse = np.sqrt(np.mean((parts[column].to_numpy() - truth)[inner] ** 2))
+        assert rmse < 0.3, column  # noise sd is 0.5
+    assert parts["resid"].abs().idxmax() == parts.index[500]
+
+
+def test_multiplicative_stl_components_multiply_to_the_series(tmp_path):
+    series = np.exp(_hourly(24 * 30, periods=(24,)) / 10)
+    result = run_seasonal_decomposition(series, model="multiplicative", period=24, method="stl",
+                                        output_dir=str(tmp_path), name_prefix="mstl")
+    parts = pd.read_csv(tmp_path / result["components_csv"], index_col="date")
+    np.testing.assert_allclose(parts["trend"] * parts["seasonal"] * parts["resid"], series.to_numpy(), rtol=1e-9)